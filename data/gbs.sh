@@ -85,7 +85,7 @@ __gbs ()
         --include-all --extra-packs= --spec= --commit= --cache
         --skip-conf-repos --profile= --noinit --keep-packs --use-higher-deps
         --not-export-source --clean-repos --define --baselibs --disable-debuginfo
-        --full-build --deps-build --snapshot
+        --full-build --deps-build --snapshot --pre-export --build-events= --offline
     "
     cr_opts="
         --profile= --tmpfs --ks-file
@@ -93,7 +93,8 @@ __gbs ()
 
     rb_opts="
         --base-obsprj= --target-obsprj= --spec= --commit= --include-all
-        --status --buildlog --profile= --arch= --repository=
+        --status --watch --buildlog --follow --profile= --arch= --repository= --package-list=
+        --jobs=
     "
     sr_opts="
         --msg= --target= --commit= --spec= --sign --user-key= --remote= --tag=
@@ -104,7 +105,7 @@ __gbs ()
         --filter=  --no-patch-import
     "
     ex_opts="
-        --source-rpm --include-all --commit= --spec= --outdir=
+        --source-rpm --include-all --commit= --spec= --outdir= --jobs=
     "
     ch_opts="--message= --since= --packaging-dir="
     chr_opts="--root"
@@ -0,0 +1,235 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+This module runs depanneur and follows its output to track the build of
+every package. Package started/finished/failed events can be written to a
+file in JSON lines format, and progress is reported while building.
+"""
+
+import os
+import re
+import pty
+import sys
+import json
+import time
+import errno
+import termios
+import subprocess
+
+from gitbuildsys.log import LOGGER as log
+
+# *** [1/3] building glib2-2.36.1-1 armv7l tizen (worker: 0) ***
+RE_STARTED = re.compile(r'\*\*\* \[(\d+)/(\d+)\] building (\S+) (\S+) (\S+)'
+                        r' \(worker: (\d+)\) \*\*\*')
+# finished building glib2
+RE_FINISHED = re.compile(r'finished (?:incremental )?building (\S+)')
+# build failed, Leaving the logs in .../logs/fail/glib2-2.36.1-1/log.txt
+RE_FAILED = re.compile(r'build failed, Leaving the logs in (\S+)')
+RE_COLOR = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def split_nvr(nvr):
+    """Get package name from name-version-release string."""
+    parts = nvr.rsplit('-', 2)
+    if len(parts) == 3:
+        return parts[0]
+    return nvr
+
+
+class BuildMonitor(object):
+    """Track package builds from depanneur output lines."""
+
+    def __init__(self, events=None):
+        """events is a file object to write JSON lines events to."""
+        self.events = events
+        self.running = {}
+        self.finished = []
+        self.failed = []
+        self.total = 0
+        self.start_time = time.time()
+
+    def emit(self, event, pkg, **kwargs):
+        """Write one event of package pkg."""
+        record = {'event': event, 'time': time.time()}
+        record.update(pkg)
+        record.update(kwargs)
+        if self.events:
+            self.events.write(json.dumps(record, sort_keys=True) + '\n')
+            self.events.flush()
+        return record
+
+    def _find_running(self, name=None, path=None):
+        """Find running package by name or by its log path."""
+        for nvr, pkg in self.running.iteritems():
+            if name and pkg['package'] == name:
+                return nvr
+            if path and '/%s/' % nvr in path:
+                return nvr
+        if len(self.running) == 1:
+            return self.running.keys()[0]
+
+    def _done(self, nvr, status):
+        """Mark running package nvr as done with status."""
+        pkg = self.running.pop(nvr)
+        now = time.time()
+        record = self.emit(status, pkg, duration=round(now - pkg['start'], 3))
+        if status == 'finished':
+            self.finished.append(record)
+        else:
+            self.failed.append(record)
+        log.info('[%d/%d] %s %s in %s (%d running, %d failed)' %
+                 (len(self.finished) + len(self.failed), self.total,
+                  pkg['nvr'], status, format_duration(now - pkg['start']),
+                  len(self.running), len(self.failed)))
+
+    def feed(self, line):
+        """Process one line of depanneur output."""
+        line = RE_COLOR.sub('', line)
+        match = RE_STARTED.search(line)
+        if match:
+            index, total, nvr, arch, dist, worker = match.groups()
+            self.total = int(total)
+            pkg = {'package': split_nvr(nvr), 'nvr': nvr, 'arch': arch,
+                   'dist': dist, 'worker': int(worker), 'index': int(index),
+                   'start': time.time()}
+            self.running[nvr] = pkg
+            self.emit('started', pkg)
+            return
+
+        match = RE_FINISHED.search(line)
+        if match:
+            nvr = self._find_running(name=match.group(1))
+            if nvr:
+                self._done(nvr, 'finished')
+            return
+
+        match = RE_FAILED.search(line)
+        if match:
+            nvr = self._find_running(path=match.group(1))
+            if nvr:
+                self._done(nvr, 'failed')
+
+    def summary(self, retcode):
+        """Emit and log summary of the whole build."""
+        duration = time.time() - self.start_time
+        self.emit('done', {}, retcode=retcode, duration=round(duration, 3),
+                  finished=len(self.finished), failed=len(self.failed))
+        if self.finished or self.failed:
+            log.info('%d packages built, %d failed in %s' %
+                     (len(self.finished), len(self.failed),
+                      format_duration(duration)))
+        for record in self.failed:
+            log.error('%s failed to build' % record['nvr'])
+
+
+def format_duration(seconds):
+    """Format seconds as [h:]mm:ss."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%d:%02d:%02d' % (hours, minutes, seconds)
+    return '%02d:%02d' % (minutes, seconds)
+
+
+def open_pty():
+    """
+    Open a pseudo terminal for depanneur output, so that it's line buffered.
+    Returns: (master fd, slave fd), or None if no pty is available.
+    """
+    try:
+        master, slave = pty.openpty()
+    except OSError:
+        return None
+    # keep '\n' line endings as they are
+    attrs = termios.tcgetattr(slave)
+    attrs[1] &= ~termios.ONLCR
+    termios.tcsetattr(slave, termios.TCSANOW, attrs)
+    return master, slave
+
+
+def read_lines(fdesc):
+    """Read lines from file descriptor fdesc as soon as they are written."""
+    data = ''
+    while True:
+        try:
+            chunk = os.read(fdesc, 4096)
+        except OSError, err:
+            # pty master gets EIO when all its slaves are closed
+            if err.errno == errno.EINTR:
+                continue
+            if err.errno != errno.EIO:
+                raise
+            chunk = ''
+        if not chunk:
+            break
+        data += chunk
+        lines = data.split('\n')
+        data = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if data:
+        yield data
+
+
+def run_depanneur(cmd, events_file=None, cwd=None):
+    """
+    Run depanneur command line cmd (a list of shell words) in cwd, copy its
+    output to stdout and track package builds.
+    depanneur is run on a pty, as perl block buffers output to a pipe and
+    builds would be tracked late. Without a pty its output is read from a
+    pipe and package times are only as accurate as the buffering allows.
+    Returns: exit code of depanneur.
+    """
+    events = None
+    if events_file:
+        events = open(os.path.abspath(os.path.expanduser(events_file)), 'w')
+    monitor = BuildMonitor(events)
+    fds = open_pty()
+    if fds:
+        master, slave = fds
+        proc = subprocess.Popen(' '.join(cmd), shell=True, cwd=cwd,
+                                stdout=slave, stderr=slave, close_fds=True)
+        os.close(slave)
+        lines = read_lines(master)
+    else:
+        proc = subprocess.Popen(' '.join(cmd), shell=True, cwd=cwd,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        lines = iter(proc.stdout.readline, '')
+    # depanneur colors its output on the pty
+    color = sys.stdout.isatty()
+    try:
+        try:
+            for line in lines:
+                sys.stdout.write(line if color else RE_COLOR.sub('', line))
+                sys.stdout.flush()
+                monitor.feed(line)
+        except KeyboardInterrupt:
+            # depanneur got SIGINT as well, wait for its cleanup
+            proc.wait()
+            raise
+        retcode = proc.wait()
+        monitor.summary(retcode)
+    finally:
+        if fds:
+            os.close(master)
+        if events:
+            events.close()
+
+    return retcode
@@ -0,0 +1,192 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+This module provides a persistent, size bounded on-disk cache which can be
+shared by gbs subcommands and by several gbs processes running at once.
+
+Every cache entry is a directory named by the sha1 of its key, containing
+the cached files and a 'meta.json' file with caller defined metadata.
+The mtime of 'meta.json' is refreshed on every hit, and least recently used
+entries are evicted when the total size exceeds the limit.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+from gitbuildsys.log import LOGGER as log
+
+# 512M is enough for the metadata of ~40 snapshot repos
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+META_FILE = 'meta.json'
+
+
+class CacheEntry(object):
+    """One entry of FileCache."""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+
+    def filepath(self, name):
+        """Get full path of a file stored in this entry."""
+        return os.path.join(self.path, name)
+
+    def files(self):
+        """List names of files stored in this entry."""
+        return sorted(name for name in os.listdir(self.path)
+                      if name != META_FILE)
+
+
+def link_or_copy(src, dst):
+    """Hardlink src to dst, fall back to copy if it's impossible."""
+    if os.path.exists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class FileCache(object):
+    """Persistent on-disk cache with LRU eviction."""
+
+    def __init__(self, cachedir, max_size=DEFAULT_MAX_SIZE):
+        self.cachedir = os.path.abspath(os.path.expanduser(cachedir))
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hashkey(key):
+        """Convert cache key (string or tuple of strings) to entry name."""
+        if isinstance(key, (tuple, list)):
+            key = '\0'.join(str(i) for i in key)
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return hashlib.sha1(key).hexdigest()
+
+    def _entry_path(self, key):
+        """Get entry directory of key."""
+        return os.path.join(self.cachedir, self.hashkey(key))
+
+    def get(self, key):
+        """
+        Look up key in the cache.
+        Returns: CacheEntry if found, else None.
+        """
+        path = self._entry_path(key)
+        metafile = os.path.join(path, META_FILE)
+        try:
+            with open(metafile) as fobj:
+                meta = json.load(fobj)
+            # mark entry as recently used
+            os.utime(metafile, None)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return CacheEntry(path, meta)
+
+    def put(self, key, files=(), meta=None):
+        """
+        Store files and metadata under key, replacing old entry.
+        Files are hardlinked into cache if possible, else copied.
+        Returns: CacheEntry of the new entry, or None if cache is not
+        writable.
+        """
+        path = self._entry_path(key)
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            tmpdir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cachedir)
+            for fname in files:
+                link_or_copy(fname, os.path.join(tmpdir,
+                                                 os.path.basename(fname)))
+            with open(os.path.join(tmpdir, META_FILE), 'w') as fobj:
+                json.dump(meta or {}, fobj)
+
+            self._remove(path)
+            os.rename(tmpdir, path)
+        except (IOError, OSError) as err:
+            log.debug('failed to update cache %s: %s' % (self.cachedir, err))
+            return None
+
+        self.evict()
+        return CacheEntry(path, meta or {})
+
+    def touch(self, key, meta):
+        """Update metadata of existing entry."""
+        metafile = os.path.join(self._entry_path(key), META_FILE)
+        try:
+            with open(metafile, 'w') as fobj:
+                json.dump(meta, fobj)
+        except (IOError, OSError) as err:
+            log.debug('failed to update cache %s: %s' % (metafile, err))
+
+    def remove(self, key):
+        """Drop key from the cache."""
+        self._remove(self._entry_path(key))
+
+    @staticmethod
+    def _remove(path):
+        """Remove entry directory without raising errors."""
+        if os.path.exists(path):
+            # rename first, so other processes never see partial entry
+            trash = tempfile.mkdtemp(prefix='.del-',
+                                     dir=os.path.dirname(path))
+            try:
+                os.rename(path, os.path.join(trash, 'entry'))
+            except OSError:
+                pass
+            shutil.rmtree(trash, True)
+
+    def evict(self):
+        """Remove least recently used entries until under max_size."""
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.cachedir)
+        except OSError:
+            return
+
+        for name in names:
+            path = os.path.join(self.cachedir, name)
+            try:
+                atime = os.stat(os.path.join(path, META_FILE)).st_mtime
+                size = sum(os.stat(os.path.join(path, fname)).st_size
+                           for fname in os.listdir(path))
+            except OSError:
+                continue
+            entries.append((atime, size, path))
+            total += size
+
+        if total <= self.max_size:
+            return
+
+        for _atime, size, path in sorted(entries):
+            log.debug('evicting cache entry %s' % path)
+            self._remove(path)
+            total -= size
+            if total <= self.max_size:
+                break
@@ -20,6 +20,7 @@
 """
 
 import os
+import copy
 import shutil
 import pwd
 import re
@@ -31,14 +32,20 @@ from lxml import etree
 import xml.etree.cElementTree as ET
 import xml.etree.ElementTree as ETP
 import subprocess
-
-from gitbuildsys.utils import Temp, Workdir, RepoParser, read_localconf, \
-                              guess_spec, show_file_from_rev, \
-                              GitRefMappingParser, GitDirFinder, GerritNameMapper
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from gitbuildsys.buildmonitor import run_depanneur
+from gitbuildsys.cache import FileCache
+from gitbuildsys.utils import Temp, RepoParser, read_localconf, \
+                              guess_spec, RepoMetaCache, \
+                              GitRefMappingParser, GitDirFinder, \
+                              GerritNameMapper, GitCatFile, PkgDependsGraph
 from gitbuildsys.errors import GbsError, Usage
 from gitbuildsys.conf import configmgr, MappingConfigParser, encode_passwd
 from gitbuildsys.safe_url import SafeURL
-from gitbuildsys.cmd_export import get_packaging_dir, config_is_true
+from gitbuildsys.cmd_export import get_packaging_dir, config_is_true, \
+                                   export_packages
 from gitbuildsys.log import LOGGER as log
 from gitbuildsys.oscapi import OSC, OSCError
 from gitbuildsys.log import DEBUG
@@ -73,6 +80,15 @@ SUPPORTEDARCHS = [
     'riscv64',
     ]
 
+# number of git repos to read specs from at the same time
+SPEC_READ_THREADS = 8
+# parse specs in worker processes if there are at least so many
+SPEC_PARSE_BATCH = 16
+# number of dependency graph files to fetch at the same time
+DEPENDS_THREADS = 8
+# file listing local projects copied into synced sources of full build
+LOCAL_PROJECTS = '.gbs-local-projects'
+
 USERID = pwd.getpwuid(os.getuid())[0]
 TMPDIR = None
 
@@ -88,10 +104,39 @@ def formalize_build_conf(profile):
     # '-' is not allowed, so replace with '_'
     return profile.replace('-', '_')
 
+def get_repo_metacache():
+    '''get persistent repo metadata cache under build root'''
+    return RepoMetaCache(os.path.join(os.environ['TIZEN_BUILD_ROOT'],
+                                      'local', 'gbscache', 'repodata'))
+
+def parse_spec_name(spec):
+    """
+    Get package name from spec, spec is (path, content) tuple, content is
+    None to parse the file at path. Runs in worker processes.
+    Returns: (name, None), or (None, error message).
+    """
+    path, content = spec
+    try:
+        if content is None:
+            return rpm.SpecFile(path).name, None
+        return rpm.SpecFile(filedata=content).name, None
+    except GbpError as err:
+        return None, '%s' % err
+    except Exception as err:
+        return None, '%s: %s' % (path, err)
+
 def get_binary_name_from_git(args, package_dirs):
     ''' get binary rpm name from specified git package'''
+    names = get_binary_names_of_packages(args, package_dirs)
+    return [name for package_dir in package_dirs
+            for name in names[package_dir]]
+
+def get_binary_names_of_packages(args, package_dirs):
+    '''
+    Get binary rpm names of every specified git package.
+    Returns: dict of package dir => list of names of its specs.
+    '''
 
-    binary_list = []
     packaging_dir = get_packaging_dir(args)
     if args.commit:
         commit = args.commit
@@ -100,28 +145,57 @@ def get_binary_name_from_git(args, package_dirs):
     else:
         commit = 'HEAD'
 
-    for package_dir in package_dirs:
-        main_spec, rest_specs = guess_spec(package_dir, packaging_dir,
-                                           None, commit)
-        rest_specs.append(main_spec)
-        for spec in rest_specs:
-            if args.include_all:
-                spec_to_parse = os.path.join(package_dir, spec)
-            else:
-                content = show_file_from_rev(package_dir, spec, commit)
+    def read_specs(package_dir):
+        """Read all specs of one package with one git process."""
+        reader = None if args.include_all else GitCatFile(package_dir)
+        try:
+            main_spec, rest_specs = guess_spec(package_dir, packaging_dir,
+                                               None, commit, reader)
+            rest_specs.append(main_spec)
+            specs = []
+            for spec in rest_specs:
+                if args.include_all:
+                    specs.append((package_dir,
+                                  (os.path.join(package_dir, spec), None)))
+                    continue
+                content = reader.show(spec, commit)
                 if content is None:
                     raise GbsError('failed to checkout %s from commit: %s' %
                                    (spec, commit))
-                tmp_spec = Temp(content=content)
-                spec_to_parse = tmp_spec.path
+                specs.append((package_dir,
+                              (os.path.join(package_dir, spec), content)))
+            return specs
+        finally:
+            if reader:
+                reader.close()
+
+    # git is IO bound, read packages in threads
+    threads = ThreadPool(min(len(package_dirs), SPEC_READ_THREADS) or 1)
+    try:
+        specs = threads.map_async(read_specs, package_dirs).get(0xFFFF)
+    finally:
+        threads.terminate()
+    specs = [spec for pkg_specs in specs for spec in pkg_specs]
+    owners = [package_dir for package_dir, _spec in specs]
+    specs = [spec for _package_dir, spec in specs]
+
+    # spec parsing is CPU bound, parse in processes if there are many
+    if len(specs) >= SPEC_PARSE_BATCH:
+        pool = multiprocessing.Pool()
+        try:
+            results = pool.map_async(parse_spec_name, specs).get(0xFFFF)
+        finally:
+            pool.terminate()
+    else:
+        results = [parse_spec_name(spec) for spec in specs]
 
-            try:
-                spec = rpm.SpecFile(spec_to_parse)
-            except GbpError as err:
-                raise GbsError('%s' % err)
-            binary_list.append(spec.name)
+    names = dict((package_dir, []) for package_dir in package_dirs)
+    for package_dir, (name, error) in zip(owners, results):
+        if error is not None:
+            raise GbsError(error)
+        names[package_dir].append(name)
 
-    return binary_list
+    return names
 
 def prepare_repos_and_build_conf(args, arch, profile):
     '''generate repos and build conf options for depanneur'''
@@ -161,7 +235,7 @@ def prepare_repos_and_build_conf(args, arch, profile):
     if arch not in archs:
         log.warning('No local package repository for arch %s' % arch)
 
-    repoparser = RepoParser(repos, cachedir)
+    repoparser = RepoParser(repos, cachedir, get_repo_metacache())
     repourls = repoparser.get_repos_by_arch(arch)
     if not repourls:
         raise GbsError('no available repositories found for arch %s under the '
@@ -340,36 +414,80 @@ def get_local_archs(repos):
 
     Each toolchain should contain about 128 packages,
     it is insufficient if less than that.
+
+    Archs of each repo are cached under build root, keyed by checksum of
+    its primary file, so unchanged repos need not to be parsed again.
     """
     def get_primary_file_from_local(repos):
         def find_primary(repo):
+            repomd = os.path.join(repo, 'repodata', 'repomd.xml')
+            try:
+                root = ET.parse(repomd).getroot()
+            except (IOError, SyntaxError):
+                root = None
+
+            if root is not None:
+                xmlns = re.sub(r'repomd$', '', root.tag)
+                for elm in root.findall('%sdata' % xmlns):
+                    if elm.attrib.get('type') != 'primary':
+                        continue
+                    location = elm.find('%slocation' % xmlns)
+                    checksum = elm.findtext('%schecksum' % xmlns)
+                    if location is None or not checksum:
+                        break
+                    pri = os.path.join(repo, location.attrib.get('href', ''))
+                    if pri.endswith('.gz') and os.path.isfile(pri):
+                        return pri, checksum.strip()
+                    break
+
             pattern = os.path.join(repo, 'repodata', '*primary.*.gz')
             files = glob.glob(pattern)
             if files:
-                return files[0]
+                stat = os.stat(files[0])
+                return files[0], '%s-%d-%d' % (files[0], stat.st_size,
+                                               stat.st_mtime)
+            return None, None
 
         for repo in repos:
             if not repo.startswith('http'):
-                pri = find_primary(repo)
+                pri, checksum = find_primary(repo)
                 if pri:
-                    yield pri
+                    yield repo, pri, checksum
 
     def extract_arch(primary):
         with gzip.open(primary) as fobj:
-            root = ET.fromstring(fobj.read())
+            context = ET.iterparse(fobj, events=('start', 'end'))
+            _event, root = next(context)
+            xmlns = re.sub(r'metadata$', '', root.tag)
+            for event, elm in context:
+                if event != 'end' or elm.tag != '%spackage' % xmlns:
+                    continue
+                arch = elm.findtext('%sarch' % xmlns)
+                # drop parsed packages to keep memory usage constant
+                root.clear()
+                if not arch:
+                    continue
+                if re.match(r'i[3-6]86', arch):
+                    yield 'i586'
+                elif arch not in ('noarch', 'src'):
+                    yield arch
 
-        xmlns = re.sub(r'metadata$', '', root.tag)
-        for elm in root.getiterator('%spackage' % xmlns):
-            arch = elm.find('%sarch' % xmlns).text
-            if re.match(r'i[3-6]86', arch):
-                yield 'i586'
-            elif arch not in ('noarch', 'src'):
-                yield arch
+    cache = None
+    if 'TIZEN_BUILD_ROOT' in os.environ:
+        cache = FileCache(os.path.join(os.environ['TIZEN_BUILD_ROOT'],
+                                       'local', 'gbscache', 'archs'))
 
     archs = set()
-    for pri in get_primary_file_from_local(repos):
-        for arch in extract_arch(pri):
-            archs.add(arch)
+    for repo, pri, checksum in get_primary_file_from_local(repos):
+        key = (os.path.abspath(repo), checksum)
+        entry = cache.get(key) if cache else None
+        if entry and 'archs' in entry.meta:
+            repo_archs = set(str(arch) for arch in entry.meta['archs'])
+        else:
+            repo_archs = set(extract_arch(pri))
+            if cache:
+                cache.put(key, meta={'archs': sorted(repo_archs)})
+        archs.update(repo_archs)
 
     return archs
 
@@ -399,19 +517,16 @@ def get_profile_url(snapshot):
 
     return profile_url
 
-def create_autoconf(arch, snapshot, full_build):
+def generate_autoconf(arch, snapshot, full_build, ref_meta, mapping_conf):
     """
-    Create ~/.gbs.conf.auto for user
+    Generate content of ~/.gbs.conf.auto
+    Returns: (content, repos_map)
     """
     url = ''
 
     profile_url = get_profile_url(snapshot)
 
-    log.info("sync git-ref-mapping from review.tizen.org to get reference binary id")
-    refparser = GitRefMappingParser()
-    ref_meta = refparser.parse()
-
-    mapparser = MappingConfigParser('/usr/share/gbs/mapping.conf')
+    mapparser = MappingConfigParser(mapping_conf)
     obs_meta = mapparser.GetObsMapping()
     prefix_meta = mapparser.GetPrefixMapping()
     repo_meta = mapparser.GetRepoMapping()
@@ -489,6 +604,51 @@ def create_autoconf(arch, snapshot, full_build):
 
     content += '[obs.tizen]\nurl = https://build.tizen.org\nuser = obs_viewer\npasswd = obs_viewer\n'
 
+    return content, repos_map
+
+def create_autoconf(arch, snapshot, full_build, offline=False):
+    """
+    Create ~/.gbs.conf.auto for user
+
+    Generated config is cached, keyed by arguments, mtime of mapping.conf
+    and commit of git-ref-mapping. In offline mode git-ref-mapping is not
+    fetched, and the last config generated for the arguments is reused.
+    """
+    mapping_conf = '/usr/share/gbs/mapping.conf'
+    refparser = GitRefMappingParser()
+    if not offline:
+        log.info("sync git-ref-mapping from review.tizen.org to get reference binary id")
+    refparser.sync(offline)
+
+    cache = FileCache(os.path.expanduser('~/.ref-gbs/cache/autoconf'))
+    last_key = ('autoconf', arch, snapshot, bool(full_build))
+    mtime = None
+    if os.path.exists(mapping_conf):
+        mtime = os.path.getmtime(mapping_conf)
+    key = last_key + (mtime, refparser.head())
+
+    entry = cache.get(key)
+    if entry is None and offline:
+        entry = cache.get(last_key)
+        if entry is None:
+            raise GbsError('no auto generated config available in offline '
+                           'mode, please run once without --offline')
+    if entry:
+        with open(entry.filepath('gbs.conf.auto')) as fobj:
+            content = fobj.read()
+        repos_map = dict((str(k), str(v))
+                         for k, v in entry.meta['repos_map'].iteritems())
+    else:
+        content, repos_map = generate_autoconf(arch, snapshot, full_build,
+                                               refparser.parse(),
+                                               mapping_conf)
+        tmpdir = Temp(directory=True)
+        tmpfile = os.path.join(tmpdir.path, 'gbs.conf.auto')
+        with open(tmpfile, 'w') as fobj:
+            fobj.write(content)
+        cache.put(key, [tmpfile], {'repos_map': repos_map})
+        cache.put(last_key, [tmpfile], {'repos_map': repos_map})
+
     fpath = os.path.expanduser('~/.gbs.conf.auto')
     with open(fpath, 'w') as wfile:
         wfile.write(content)
@@ -497,108 +657,287 @@ def create_autoconf(arch, snapshot, full_build):
 
     return repos_map
 
-def sync_source(exclude_pkgs, pkgs, manifest_url, path):
+def filter_manifest(content, exclude_pkgs=None, pkgs=None):
+    """
+    Filter projects of repo manifest content by their path: drop projects
+    in exclude_pkgs, or keep only projects in pkgs if it's given.
+    Returns: (filtered manifest content, [(path, revision)] of kept projects)
+    """
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError as err:
+        raise GbsError('failed to parse manifest: %s' % err)
+
+    exclude_pkgs = set(exclude_pkgs or [])
+    pkgs = set(pkgs) if pkgs is not None else None
+    default = root.find('default')
+    default_rev = default.get('revision') if default is not None else None
+
+    projects = []
+    for elem in root.findall('project'):
+        path = elem.get('path', elem.get('name'))
+        if path in exclude_pkgs or (pkgs is not None and path not in pkgs):
+            root.remove(elem)
+        else:
+            projects.append((path, elem.get('revision', default_rev)))
+
+    return ET.tostring(root), projects
+
+def get_checkout_revision(path):
+    """Get commit checked out in git project path, None if unknown."""
+    try:
+        with open(os.path.join(path, '.git', 'HEAD')) as fobj:
+            head = fobj.read().strip()
+    except IOError:
+        return None
+    # repo checks projects out as detached HEAD
+    if re.match(r'^[0-9a-f]{40}$', head):
+        return head
+    return None
+
+def get_changed_projects(path, projects):
+    """
+    Get projects which are not checked out under path at their revision.
+    Projects without fixed revision always count as changed.
+    Returns: list of project paths
+    """
+    return [prj for prj, rev in projects
+            if rev is None or
+            get_checkout_revision(os.path.join(path, prj)) != rev]
+
+def prune_projects(path, projects):
+    """
+    Remove checkouts of projects synced into path by earlier builds which
+    are not in projects any more. Synced projects are read from
+    project.list of repo, which is updated to projects.
+    """
+    listfile = os.path.join(path, '.repo', 'project.list')
+    try:
+        with open(listfile) as fobj:
+            synced = fobj.read().split()
+    except IOError:
+        return
+
+    top = os.path.abspath(path)
+    wanted = set(projects)
+    for prj in synced:
+        if prj in wanted:
+            continue
+        log.debug('removing %s, it is not in manifest any more' % prj)
+        prj_path = os.path.join(top, prj)
+        shutil.rmtree(prj_path, ignore_errors=True)
+        # remove parent dirs left empty, like platform/upstream
+        parent = os.path.dirname(prj_path)
+        while parent != top and os.path.isdir(parent) and \
+                not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+    with open(listfile, 'w') as fobj:
+        fobj.write(''.join('%s\n' % prj for prj in sorted(wanted)))
+
+def sync_source(exclude_pkgs, pkgs, manifest_url, path, jobs=None):
+    """
+    Sync projects listed in manifest_url into path with repo, skipping
+    projects in exclude_pkgs, or syncing only projects in pkgs. path is
+    kept between builds, projects already checked out at the wanted
+    revision are not synced again, projects not wanted any more are
+    removed.
+    """
     if pkgs != None:
         if len(pkgs) == 0:
+            prune_projects(path, [])
             return
 
-    cmd = 'repo init -u https://git.tizen.org/cgit/scm/manifest -b tizen -m unified_standard.xml'
-    with Workdir(path):
-        ret = os.system(cmd)
+    def run(cmd):
+        """Run repo command in path."""
+        log.debug('running command: %s' % ' '.join(cmd))
+        try:
+            ret = subprocess.call(cmd, cwd=path)
+        except OSError as err:
+            raise GbsError("failed to run %s in %s: %s" % (' '.join(cmd),
+                                                           path, err))
         if ret != 0:
             raise GbsError("failed to run %s in %s" % (' '.join(cmd), path))
 
-    out_file = path + '/.repo/manifests/unified_standard.xml.new'
-    in_file = path + '/.repo/manifests/unified_standard.xml'
-    with open(out_file, 'w') as f:
-        with open(in_file, 'r') as i:
-            for line in i.readlines():
-                if 'metadata.xml' not in line and 'prebuilt.xml' not in line:
-                    f.write(line)
+    manifests = os.path.join(path, '.repo', 'manifests')
+    if os.path.isdir(manifests):
+        # drop manifest changes of last sync, so that init can update it
+        try:
+            ret = subprocess.call(['git', 'reset', '-q', '--hard'],
+                                  cwd=manifests)
+        except OSError as err:
+            raise GbsError('failed to reset %s: %s' % (manifests, err))
+        if ret != 0:
+            raise GbsError('failed to reset %s' % manifests)
+    run(['repo', 'init', '-u', 'https://git.tizen.org/cgit/scm/manifest',
+         '-b', 'tizen', '-m', 'unified_standard.xml'])
+
+    in_file = os.path.join(manifests, 'unified_standard.xml')
+    tree = ET.parse(in_file)
+    for elem in tree.getroot().findall('include'):
+        name = elem.get('name', '')
+        if 'metadata.xml' in name or 'prebuilt.xml' in name:
+            tree.getroot().remove(elem)
+    tree.write(in_file)
 
-    shutil.move(out_file, in_file)
     r = requests.get(manifest_url)
     if r.status_code == 404:
         log.error("manifest %s not found" %manifest_url)
         return
 
-    old = path + '/.repo/manifests/unified/standard/projects.xml'
-    new = path + '/.repo/manifests/unified/standard/projects.xml.new'
-    with open(new, "w") as f:
-        f.write(r.content)
-
     log.info('use %s as projects.xml' %manifest_url)
-    with open(new, 'r') as f:
-        with open(old, 'w') as i:
-            for line in f.readlines():
-                if exclude_pkgs != None:
-                    if 'revision' in line:
-                        k = line.index('"', line.index('path'))
-                        abs_path = line[k + 1:line.index('"', k + 1)]
-                        if abs_path in exclude_pkgs:
-                            continue
-
-                    i.write(line)
-
-                if pkgs != None:
-                    if 'revision' in line:
-                        k = line.index('"', line.index('path'))
-                        abs_path = line[k + 1:line.index('"', k + 1)]
-                        if abs_path not in pkgs:
-                            continue
-
-                    i.write(line)
-
-    cmd = 'repo sync'
-    with Workdir(path):
-        ret = os.system(cmd)
-        if ret != 0:
-            raise GbsError("failed to run %s in %s" % (' '.join(cmd), path))
+    content, projects = filter_manifest(r.content, exclude_pkgs, pkgs)
+    with open(os.path.join(manifests, 'unified', 'standard', 'projects.xml'),
+              'w') as fobj:
+        fobj.write(content)
+    prune_projects(path, [prj for prj, _rev in projects])
+
+    changed = get_changed_projects(path, projects)
+    if not changed:
+        log.info('all %d projects are up to date' % len(projects))
+        return
+    log.info('syncing %d of %d projects' % (len(changed), len(projects)))
+
+    cmd = ['repo', 'sync', '-j%d' % (jobs or multiprocessing.cpu_count())]
+    if len(changed) < len(projects):
+        cmd += changed
+    run(cmd)
 
-def prepare_fullbuild_source(profile, pkgs, url, download_path):
+def copy_local_projects(paths, path):
+    """
+    Copy local git projects into sync path, replacing copies left by
+    the last build, which are listed in LOCAL_PROJECTS file of path.
+    """
+    listfile = os.path.join(path, LOCAL_PROJECTS)
+    try:
+        with open(listfile) as fobj:
+            last = fobj.read().split()
+    except IOError:
+        last = []
+    for name in last:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    names = []
+    for project in paths:
+        name = os.path.basename(project)
+        shutil.copytree(project, os.path.join(path, name))
+        names.append(name)
+    with open(listfile, 'w') as fobj:
+        fobj.write('\n'.join(names))
+
+def prepare_fullbuild_source(profile, pkgs, url, download_path, jobs=None):
     """
     prepare full build source
     """
-    sync_source(pkgs, None, url, download_path)
+    sync_source(pkgs, None, url, download_path, jobs)
 
-def prepare_depsbuild_source(gnmapper, profile, arch, pkgs, url, download_path):
+def fetch_depends_from_graph(depends_url, pkgs):
+    """
+    Get packages depending on each of pkgs from dependency graph files
+    under depends_url, fetching them concurrently over pooled connections.
+    Unchanged files are revalidated against an on-disk cache.
+    Returns: dict of package name => set of depending packages.
+    """
+    cache = FileCache(os.path.join(os.environ['TIZEN_BUILD_ROOT'], 'local',
+                                   'gbscache', 'depends'))
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=DEPENDS_THREADS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def fetch(pkg):
+        """Fetch graph of pkg, return content or None."""
+        depurl = depends_url + pkg + '.full_edges.vis_input.js'
+        entry = cache.get(depurl)
+        headers = {}
+        if entry and entry.meta.get('etag'):
+            headers['If-None-Match'] = entry.meta['etag']
+        if entry and entry.meta.get('last_modified'):
+            headers['If-Modified-Since'] = entry.meta['last_modified']
+        try:
+            resp = session.get(depurl, headers=headers)
+        except requests.exceptions.RequestException as err:
+            if entry:
+                log.warning('failed to get %s: %s, use cached one' %
+                            (depurl, err))
+                with open(entry.filepath('graph.js')) as fobj:
+                    return fobj.read()
+            log.error('get depends from %s failed: %s' % (depurl, err))
+            return None
+        if resp.status_code == 304 and entry:
+            with open(entry.filepath('graph.js')) as fobj:
+                return fobj.read()
+        if resp.status_code != 200:
+            log.error('get depends from %s failed' % depurl)
+            return None
+
+        tmpdir = Temp(directory=True)
+        tmpfile = os.path.join(tmpdir.path, 'graph.js')
+        with open(tmpfile, 'w') as fobj:
+            fobj.write(resp.content)
+        cache.put(depurl, [tmpfile],
+                  {'etag': resp.headers.get('etag'),
+                   'last_modified': resp.headers.get('last-modified')})
+        return resp.content
+
+    threads = ThreadPool(min(len(pkgs), DEPENDS_THREADS) or 1)
+    try:
+        contents = threads.map_async(fetch, pkgs).get(0xFFFF)
+    finally:
+        threads.terminate()
+        session.close()
+
+    depends = {}
+    for pkg, content in zip(pkgs, contents):
+        if content is None:
+            continue
+        depends[pkg] = set()
+        for match in re.findall("label: '.*'", content):
+            dep = match[match.index("'") + 1:match.rindex("'")]
+            if dep != pkg:
+                depends[pkg].add(dep)
+    return depends
+
+def prepare_depsbuild_source(gnmapper, profile, arch, pkgs, url, download_path,
+                             pkgxml=None, jobs=None):
     """
     prepare deps build source
     """
     deps = set([])
     deps_path = []
     try:
-        for pkg in pkgs:
-            depurl = profile.depends.url + pkg + '.full_edges.vis_input.js'
-            r = requests.get(depurl)
-            if r.status_code == 404:
-                log.error('get depends from %s failed' %depurl)
-                continue
-
-            match = re.findall("label: '.*'", r.content)
-            if not match:
-                continue
-
-            for m in match:
-                dep = m[m.index("'") + 1:m.rindex("'")]
-                if dep == pkg:
-                    continue
-
-                if dep not in deps:
-                    deps.add(dep)
+        # compute what depends on local packages from pkgs xml, and only
+        # fall back to dependency graphs on server for unknown packages
+        remote_pkgs = pkgs
+        if pkgxml:
+            # pkgdep of revpkgdepends.xml are packages depending on it
+            reverse = 'revpkgdepends' in os.path.basename(
+                urlparse.urlsplit(str(profile.pkgs.url)).path)
+            graph = PkgDependsGraph(pkgxml, reverse)
+            remote_pkgs = [pkg for pkg in pkgs if pkg not in graph]
+            for pkg in pkgs:
+                if pkg in graph:
+                    deps.update(graph.get_reverse_depends(pkg))
+
+        if remote_pkgs:
+            for pkg_deps in fetch_depends_from_graph(profile.depends.url,
+                                                     remote_pkgs).values():
+                deps.update(pkg_deps)
 
         log.info("what depends on number:%d --> %s" %(len(deps), deps))
-        for pkg in deps:
+        for pkg in sorted(deps):
             gerrit_name = gnmapper.get_gerritname_by_obsname(pkg)
             if gerrit_name == None:
                 log.warning('can not get gerrit name for pkg:%s' %pkg)
                 continue
 
-            deps_path.append(gnmapper.get_gerritname_by_obsname(pkg))
+            deps_path.append(gerrit_name)
     except OSCError as err:
         raise GbsError(str(err))
 
-    sync_source(None, deps_path, url, download_path)
+    sync_source(None, deps_path, url, download_path, jobs)
 
 def prepare_depanneur_cmd(args, buildarch, profile, workdir):
     '''Prepare depanneur commond'''
@@ -674,6 +1013,100 @@ def prepare_depanneur_cmd(args, buildarch, profile, workdir):
 
     return cmd
 
+def read_name_list(names, list_file):
+    """
+    Get names of comma separated names option and list file option, the
+    file has one name for one line.
+    Returns: set of names.
+    """
+    result = set(name.strip() for name in (names or '').split(',')
+                 if name.strip())
+    if list_file:
+        if not os.path.exists(list_file):
+            raise GbsError('specified list file %s not exists' % list_file)
+        with open(list_file) as fobj:
+            result.update(line.strip() for line in fobj if line.strip())
+    return result
+
+def select_export_paths(args, workdir, paths):
+    """
+    Select git projects to pre-export the same way depanneur selects
+    packages to build: projects in package list and projects of specs in
+    binary list are selected, projects with all specs excluded are
+    skipped. With --deps or --rdeps all projects are selected, depanneur
+    needs the other packages to find dependencies.
+    Returns: list of selected paths.
+    """
+    if args.deps or args.rdeps:
+        return paths
+    pkgs = read_name_list(args.package_list, args.package_from_file)
+    binaries = read_name_list(args.binary_list, args.binary_from_file)
+    excluded = read_name_list(args.exclude, args.exclude_from_file)
+    if not (pkgs or binaries or excluded):
+        return paths
+
+    # package dirs are relative to current dir or to workdir
+    pkg_paths = set()
+    for pkg in pkgs:
+        pkg_paths.add(os.path.abspath(pkg))
+        pkg_paths.add(os.path.abspath(os.path.join(workdir, pkg)))
+    names = {}
+    if binaries or excluded:
+        names = get_binary_names_of_packages(args, paths)
+
+    selected = []
+    for path in paths:
+        spec_names = set(names.get(path, []))
+        if (pkgs or binaries) and os.path.abspath(path) not in pkg_paths \
+                and not spec_names & binaries:
+            continue
+        if spec_names and spec_names <= excluded:
+            continue
+        selected.append(path)
+    return selected
+
+def pre_export_sources(args, workdir):
+    """
+    Export sources of packages selected to build under workdir in
+    parallel, so depanneur builds the exported packages instead of
+    exporting them one by one.
+    Returns: directory of exported packages.
+    """
+    if args.incremental:
+        raise Usage('--pre-export can\'t be specified together with '
+                    '--incremental')
+    if args.not_export_source:
+        raise Usage('--pre-export can\'t be specified together with '
+                    '--not-export-source')
+    if args.export_only:
+        raise Usage('--pre-export can\'t be specified together with '
+                    '--export-only, please use gbs export instead')
+    if args.style != 'git':
+        raise Usage('--pre-export can only be used with git style')
+
+    paths = GitDirFinder(workdir).paths
+    if not paths:
+        raise GbsError('no git projects found under %s' % workdir)
+    paths = select_export_paths(args, workdir, paths)
+    if not paths:
+        raise GbsError('no packages selected to build under %s' % workdir)
+
+    export_dir = os.path.join(os.environ['TIZEN_BUILD_ROOT'], 'local',
+                              'exported')
+    if os.path.exists(export_dir):
+        shutil.rmtree(export_dir)
+    export_args = copy.copy(args)
+    export_args.outdir = export_dir
+    export_args.outdir_directly = False
+    export_args.source_rpm = False
+    export_args.jobs = None
+    export_packages(export_args, paths)
+
+    # exported packages are spec files with sources, not git projects
+    args.not_export_source = True
+    args.style = 'tar'
+    return export_dir
+
 def init_buildroot(args, profile):
     '''init build root'''
     if args.buildroot:
@@ -709,10 +1142,12 @@ def main(args):
             raise GbsError("git project can't be found for --spec, "
                            "give it in argument or cd into it")
 
+    depanneur_cwd = None
     repos_map = {}
     if not args.conf:
         if args.full_build or args.deps_build:
-            repos_map = create_autoconf(args.arch, args.snapshot, args.full_build)
+            repos_map = create_autoconf(args.arch, args.snapshot,
+                                        args.full_build, args.offline)
             log.info("Create ~/.gbs.conf.auto using reference binary id")
 
     read_localconf(workdir)
@@ -729,12 +1164,24 @@ def main(args):
                        (buildarch, ','.join(SUPPORTEDARCHS)))
 
     profile = get_profile(args)
+    build_root = init_buildroot(args, profile)
+    # transform variables from shell to python convention ${xxx} -> %(xxx)s
+    build_root = re.sub(r'\$\{([^}]+)\}', r'%(\1)s', build_root)
+    sanitized_profile_name = re.sub("[^a-zA-Z0-9:._-]", "_", profile.name)
+    build_root = build_root % {'tmpdir': TMPDIR,
+                               'profile': sanitized_profile_name}
+    os.environ['TIZEN_BUILD_ROOT'] = os.path.abspath(build_root)
+
     if args.full_build or args.deps_build:
         if profile.source == None:
             raise GbsError('full build/deps build option must specify source repo in gbs.conf')
 
-        download_path = Temp(prefix=os.path.expanduser('~/gbs-build'),
-                     directory=True)
+        # keep synced sources between builds, only changed projects
+        # need to be synced again
+        download_path = os.path.join(os.environ['TIZEN_BUILD_ROOT'], 'local',
+                                     'sources')
+        if not os.path.isdir(download_path):
+            os.makedirs(download_path)
         local_pkgs = []
         gitf = GitDirFinder(workdir)
 
@@ -744,8 +1191,9 @@ def main(args):
         cache = Temp(prefix=os.path.join(TMPDIR, 'gbscache'),
                      directory=True)
         cachedir = cache.path
-        repoparser = RepoParser([SafeURL(profile_repo)], cachedir)
-        distconf = os.path.join(download_path.path, '%s.conf' % profile_name)
+        repoparser = RepoParser([SafeURL(profile_repo)], cachedir,
+                                get_repo_metacache())
+        distconf = os.path.join(download_path, '%s.conf' % profile_name)
 
         if repoparser.buildconf is None:
             raise GbsError('failed to get build conf from repos, please '
@@ -762,13 +1210,19 @@ def main(args):
 
         profile.buildconf = distconf
 
-        r = requests.get(profile.pkgs.url)
+        r = requests.get(profile.pkgs.url, stream=True)
         if r.status_code == 404:
             raise GbsError('get pkg xml from %s failed' %profile.pkgs.url)
+        pkgxml = os.path.join(cachedir, 'pkgs.xml')
+        with open(pkgxml, 'wb') as fobj:
+            for chunk in r.iter_content(1024 * 1024):
+                fobj.write(chunk)
         exclude_pkgs = []
         if args.exclude:
             exclude_pkgs = args.exclude.split(',')
-        gnmapper = GerritNameMapper(r.content, repoparser.primaryxml)
+        namecache = FileCache(os.path.join(os.environ['TIZEN_BUILD_ROOT'],
+                                           'local', 'gbscache', 'gerritnames'))
+        gnmapper = GerritNameMapper(pkgxml, repoparser.primary, namecache)
         for spec_file in gitf.specs:
             try:
                 spec = SpecFile(spec_file)
@@ -786,29 +1240,25 @@ def main(args):
             except GbpError as err:
                 log.warning('gbp parse spec failed. %s' % err)
 
-
-        gnmapper = GerritNameMapper(r.content, repoparser.primaryxml)
+        # repo sync is network bound, use at least one job per cpu
+        sync_jobs = max(args.threads, multiprocessing.cpu_count())
         if args.full_build:
-            prepare_fullbuild_source(profile, local_pkgs, profile.source.url, download_path.path)
+            prepare_fullbuild_source(profile, local_pkgs, profile.source.url,
+                                     download_path, sync_jobs)
         else:
             if len(local_pkgs) == 0:
                 raise GbsError('deps build option must has local packages')
 
-            prepare_depsbuild_source(gnmapper, profile, args.arch, local_pkgs, profile.source.url, download_path.path)
+            prepare_depsbuild_source(gnmapper, profile, args.arch, local_pkgs,
+                                     profile.source.url, download_path,
+                                     pkgxml, sync_jobs)
 
-        for path in gitf.paths:
-            shutil.copytree(path, os.path.join(download_path.path, os.path.basename(path)))
+        copy_local_projects(gitf.paths, download_path)
 
-        workdir = download_path.path
-        curdir = os.getcwd()
-        os.chdir(workdir)
+        workdir = download_path
+        # run depanneur in downloaded sources, without changing cwd of gbs
+        depanneur_cwd = workdir
 
-    build_root = init_buildroot(args, profile)
-    # transform variables from shell to python convention ${xxx} -> %(xxx)s
-    build_root = re.sub(r'\$\{([^}]+)\}', r'%(\1)s', build_root)
-    sanitized_profile_name = re.sub("[^a-zA-Z0-9:._-]", "_", profile.name)
-    build_root = build_root % {'tmpdir': TMPDIR,
-                               'profile': sanitized_profile_name}
     if profile.exclude_packages:
         log.info('the following packages have been excluded build from gbs '
                  'config:\n   %s' % '\n   '.join(profile.exclude_packages))
@@ -816,15 +1266,16 @@ def main(args):
             args.exclude += ',' + ','.join(profile.exclude_packages)
         else:
             args.exclude = ','.join(profile.exclude_packages)
-    os.environ['TIZEN_BUILD_ROOT'] = os.path.abspath(build_root)
+
+    if args.pre_export:
+        workdir = pre_export_sources(args, workdir)
+        depanneur_cwd = workdir
 
     #prepare depanneur commond
     cmd = prepare_depanneur_cmd(args, buildarch, profile, workdir)
 
     log.debug("running command: %s" % ' '.join(cmd))
-    retcode = os.system(' '.join(cmd))
-    if args.full_build or args.deps_build:
-        os.chdir(curdir)
+    retcode = run_depanneur(cmd, args.build_events, depanneur_cwd)
     if retcode != 0:
         raise GbsError('some packages failed to be built')
     else:
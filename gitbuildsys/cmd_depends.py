@@ -41,7 +41,8 @@ from gbp import rpm
 from gbp.rpm import SpecFile
 from gbp.errors import GbpError
 
-from gitbuildsys.cmd_build import CHANGE_PERSONALITY, SUPPORTEDARCHS, formalize_build_conf, get_profile, get_local_archs
+from gitbuildsys.cmd_build import CHANGE_PERSONALITY, SUPPORTEDARCHS, formalize_build_conf, get_profile, get_local_archs, \
+                                  get_repo_metacache
 
 
 USERID = pwd.getpwuid(os.getuid())[0]
@@ -100,7 +101,7 @@ def prepare_repos_and_build_conf(args, arch, profile):
     if arch not in archs:
         log.warning('No local package repository for arch %s' % arch)
 
-    repoparser = RepoParser(repos, cachedir)
+    repoparser = RepoParser(repos, cachedir, get_repo_metacache())
     repourls = repoparser.get_repos_by_arch(arch)
     if not repourls:
         raise GbsError('no available repositories found for arch %s under the '
@@ -21,14 +21,21 @@
 
 import os
 import re
+import pwd
+import copy
 import shutil
 import glob
 import errno
+import hashlib
+import subprocess
+import multiprocessing
 from urlparse import urlparse
 
 from gitbuildsys import utils
+from gitbuildsys.cache import FileCache, link_or_copy
+from gitbuildsys.compression import Compression
 from gitbuildsys.conf import configmgr
-from gitbuildsys.errors import GbsError, Usage
+from gitbuildsys.errors import CmdError, GbsError, Usage
 from gitbuildsys.log import LOGGER as log
 
 from gbp.scripts.buildpackage_rpm import main as gbp_build
@@ -36,6 +43,15 @@ from gbp.rpm.git import GitRepositoryError, RpmGitRepository
 import gbp.rpm as rpm
 from gbp.errors import GbpError
 
+# tarballs of a few big packages for several revisions
+EXPORT_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+# options which don't change exported files
+UNCACHED_GBP_OPTS = ('--git-export-dir=', '--git-tmp-dir=', '--git-verbose')
+
+RE_VCS_TAG = re.compile(r'^VCS:(.*)$', re.I)
+# %if/%ifarch wrapped %patch macro, generated from gbp-rpm commands
+RE_PATCH_COND = re.compile(r'^%if(arch)?\s.*\n%patch', re.M)
+
 
 def mkdir_p(path):
     """
@@ -211,9 +227,124 @@ def create_gbp_export_args(repo, commit, export_dir, tmp_dir, spec, args,
 
     return argv
 
+def get_export_cache_dir():
+    """
+    Get export cache dir in local/gbscache of the build root, like the other
+    caches. gbs export uses the build root gbs build would use.
+    """
+    if 'TIZEN_BUILD_ROOT' in os.environ:
+        build_root = os.environ['TIZEN_BUILD_ROOT']
+    else:
+        build_root = configmgr.get('buildroot', 'general')
+        profile_name = 'profile.current'
+        if configmgr.is_profile_oriented():
+            profile = configmgr.get_current_profile()
+            build_root = profile.buildroot or build_root
+            profile_name = profile.name
+        build_root = os.path.expanduser(build_root)
+        # shell style variables ${xxx} -> %(xxx)s
+        build_root = re.sub(r'\$\{([^}]+)\}', r'%(\1)s', build_root)
+        tmpdir = os.path.join(configmgr.get('tmpdir', 'general'),
+                              '%s-gbs' % pwd.getpwuid(os.getuid())[0])
+        build_root = build_root % {
+            'tmpdir': tmpdir,
+            'profile': re.sub("[^a-zA-Z0-9:._-]", "_", profile_name)}
+    return os.path.join(os.path.abspath(build_root), 'local', 'gbscache',
+                        'export')
+
+
+def get_export_cache_key(repo, commit, gbp_args, args):
+    """
+    Get cache key of exported sources. The key covers the exported commit,
+    orphan packaging, upstream and pristine-tar branches, tags and all
+    export options.
+    Returns: key tuple, or None if the export can't be cached.
+    """
+    if commit == 'WC.UNTRACKED':
+        return None
+
+    reader = utils.get_git_reader(repo.path)
+    revs = (commit, configmgr.get('packaging_branch', 'orphan-devel'),
+            configmgr.get_arg_conf(args, 'upstream_branch'), 'pristine-tar')
+    shas = [reader.info('%s^0' % rev)[0] if rev else None for rev in revs]
+    if not shas[0]:
+        return None
+    proc = subprocess.Popen(['git', 'show-ref', '--tags'], cwd=repo.path,
+                            stdout=subprocess.PIPE)
+    tags = proc.communicate()[0]
+
+    options = [arg for arg in gbp_args[1:]
+               if not arg.startswith(UNCACHED_GBP_OPTS)]
+    fallback = configmgr.get_arg_conf(args, 'fallback_to_native')
+    return tuple(['export', hashlib.sha1(tags).hexdigest(), fallback] +
+                 shas + options)
+
+
+def get_packaging_files(repo, gbp_args, args):
+    """Get names of files in packaging dir of exported revision."""
+    export_rev = [arg.split('=', 1)[1] for arg in gbp_args
+                  if arg.startswith('--git-export=')][-1]
+    entries = utils.get_git_reader(repo.path).listdir(get_packaging_dir(args),
+                                                      export_rev)
+    return set(name for name, _objtype in entries or [])
+
+
+def restore_export(entry, export_dir, packaging_files):
+    """
+    Restore cached export to export_dir. Generated tarball and patches are
+    hardlinked, packaging files are copied as they might be rewritten.
+    """
+    for fname in entry.files():
+        src = entry.filepath(fname)
+        dst = os.path.join(export_dir, fname)
+        if fname in packaging_files:
+            shutil.copy2(src, dst)
+        else:
+            link_or_copy(src, dst)
+
+
+def store_export(cache, key, gbp_args, export_dir, tmp_dir, packaging_files):
+    """Store exported files to the cache, return True on success."""
+    files = []
+    copydir = os.path.join(tmp_dir, 'export-cache')
+    mkdir_p(copydir)
+    for fname in os.listdir(export_dir):
+        path = os.path.join(export_dir, fname)
+        if not os.path.isfile(path):
+            return False
+        if fname in packaging_files:
+            # cache its own copy, export_dir one might be rewritten
+            shutil.copy2(path, copydir)
+            path = os.path.join(copydir, fname)
+        files.append(path)
+    return cache.put(key, files, {'gbp_args': gbp_args}) is not None
+
+
+def get_compression(gbp_args):
+    """
+    Get compression backend of exported archives selected by the profile.
+    Archives are always compressed the default way with pristine-tar, as it
+    needs exactly the same output.
+    """
+    if '--git-pristine-tar' in gbp_args or \
+            not configmgr.is_profile_oriented():
+        return Compression('default')
+    profile = configmgr.get_current_profile()
+    return Compression(profile.compression or 'default',
+                       profile.compression_threads)
+
+
+def run_gbp(gbp_args):
+    """Run git-buildpackage with compression backend of the profile."""
+    with get_compression(gbp_args):
+        return gbp_build(gbp_args)
+
+
 def export_sources(repo, commit, export_dir, spec, args, create_tarball=True):
     """
-    Export packaging files using git-buildpackage
+    Export packaging files using git-buildpackage, or from the export cache
+    if the same revisions were exported with the same options before.
+    Returns: git-buildpackage arguments of the successful export.
     """
     tmp = utils.Temp(prefix='gbp_', dirn=configmgr.get('tmpdir', 'general'),
                      directory=True)
@@ -221,8 +352,22 @@ def export_sources(repo, commit, export_dir, spec, args, create_tarball=True):
     gbp_args = create_gbp_export_args(repo, commit, export_dir, tmp.path,
                                       spec, args, force_native=False,
                                       create_tarball=create_tarball)
+    cache = FileCache(get_export_cache_dir(), EXPORT_CACHE_SIZE)
+    key = get_export_cache_key(repo, commit, gbp_args, args)
+    if key:
+        # parallel compressors don't give the same bytes
+        key += (get_compression(gbp_args).backend,)
+    entry = cache.get(key) if key else None
+    if entry:
+        log.debug('export cache hit for %s: %s' % (spec, entry.path))
+        restore_export(entry, export_dir,
+                       get_packaging_files(repo, gbp_args, args))
+        return entry.meta['gbp_args']
+    if key:
+        log.debug('export cache miss for %s' % spec)
+
     try:
-        ret = gbp_build(gbp_args)
+        ret = run_gbp(gbp_args)
         if ret == 2 and not is_native_pkg(repo, args):
             errmsg = ("Generating upstream tarball and/or generating patches "
                       "failed. GBS tried this as you have upstream branch in "
@@ -243,7 +388,7 @@ def export_sources(repo, commit, export_dir, spec, args, create_tarball=True):
                                                   tmp.path, spec, args,
                                                   force_native=True,
                                                   create_tarball=create_tarball)
-                ret = gbp_build(gbp_args)
+                ret = run_gbp(gbp_args)
             else:
                 log.error(errmsg)
         if ret:
@@ -251,6 +396,117 @@ def export_sources(repo, commit, export_dir, spec, args, create_tarball=True):
     except GitRepositoryError as excobj:
         raise GbsError("Repository error: %s" % excobj)
 
+    if key and store_export(cache, key, gbp_args, export_dir, tmp.path,
+                            get_packaging_files(repo, gbp_args, args)):
+        log.debug('exported files of %s are cached' % spec)
+    return gbp_args
+
+
+def get_vcs_tag(specfile):
+    """Get value of VCS tag of spec file, None if not found."""
+    with open(specfile) as fobj:
+        for line in fobj:
+            match = RE_VCS_TAG.match(line)
+            if match:
+                return match.group(1).strip()
+    return None
+
+
+def get_upstream(specfile):
+    """Get upstream version and tarball name of rpm.SpecFile specfile."""
+    orig = specfile.orig_src['filename'] if specfile.orig_src else None
+    return specfile.upstreamversion, orig
+
+
+def render_specs(export_dir, main_spec, rest_specs, patch_export):
+    """
+    Render rest_specs already dumped to export_dir against the upstream
+    tarball and patches exported together with main_spec, instead of running
+    the whole git-buildpackage export again for every spec. Specs of another
+    upstream version or tarball than main_spec get their own patches only
+    from a separate export.
+    Returns: False if the specs need a separate export, True otherwise.
+    """
+    main_path = os.path.join(export_dir, os.path.basename(main_spec))
+    for spec in [main_spec] + list(rest_specs):
+        with open(os.path.join(export_dir, os.path.basename(spec))) as fobj:
+            if RE_PATCH_COND.search(fobj.read()):
+                # conditions of patches are only known by git-buildpackage
+                return False
+    try:
+        main_specfile = rpm.SpecFile(main_path)
+        patches = [os.path.basename(patch.path) for patch in
+                   main_specfile.patchseries()]
+        vcs = get_vcs_tag(main_path)
+        specfiles = []
+        for spec in rest_specs:
+            specfile = rpm.SpecFile(os.path.join(export_dir,
+                                                 os.path.basename(spec)))
+            if get_upstream(specfile) != get_upstream(main_specfile):
+                log.warning('upstream of %s differs from %s, exporting it '
+                            'separately' % (os.path.basename(spec),
+                                            os.path.basename(main_spec)))
+                return False
+            specfiles.append(specfile)
+        for specfile in specfiles:
+            if patch_export:
+                specfile.update_patches(patches, {})
+            if vcs:
+                specfile.set_tag('VCS', None, vcs)
+            specfile.write_spec_file()
+    except GbpError as err:
+        log.debug("failed to render spec files: %s" % err)
+        return False
+    return True
+
+
+def export_worker(args):
+    """
+    Export one package in a worker process.
+    Returns: error message, or None on success.
+    """
+    try:
+        export_package(args)
+    except CmdError as err:
+        return str(err.args[0])
+    except Exception as err:
+        return 'unexpected error: %s' % err
+    return None
+
+
+def export_packages(args, paths):
+    """
+    Export packages of git projects at paths to args.outdir, args.jobs
+    packages are exported at the same time in worker processes.
+    """
+    if len(paths) > 1 and args.spec:
+        raise Usage("--spec can't be used when exporting multiple packages")
+    if len(paths) > 1 and getattr(args, 'outdir_directly', False):
+        raise Usage("--outdir-directly can't be used when exporting "
+                    "multiple packages")
+
+    pkg_args = []
+    for path in paths:
+        pkg = copy.copy(args)
+        pkg.gitdir = path
+        pkg_args.append(pkg)
+
+    jobs = min(args.jobs or multiprocessing.cpu_count(), len(paths))
+    log.info('exporting %d packages with %d jobs' % (len(paths), jobs))
+    # every package in a new process, local .gbs.conf is loaded globally
+    pool = multiprocessing.Pool(jobs, maxtasksperchild=1)
+    try:
+        errors = pool.map_async(export_worker, pkg_args, 1).get(0xFFFF)
+    finally:
+        pool.terminate()
+
+    failed = [(path, err) for path, err in zip(paths, errors) if err]
+    for path, err in failed:
+        log.error('failed to export %s: %s' % (path, err))
+    if failed:
+        raise GbsError('%d of %d packages failed to be exported' %
+                       (len(failed), len(paths)))
+
 
 def main(args):
     """gbs export entry point."""
@@ -258,6 +514,20 @@ def main(args):
     if args.commit and args.include_all:
         raise Usage("--commit can't be specified together with --include-all")
     log.debug("export begin")
+    try:
+        RpmGitRepository(args.gitdir)
+    except GitRepositoryError as err:
+        # not a git project, export all packages under it
+        paths = utils.GitDirFinder(args.gitdir).paths
+        if not paths:
+            raise GbsError(str(err))
+        return export_packages(args, paths)
+
+    export_package(args)
+
+
+def export_package(args):
+    """Export package of git project args.gitdir."""
     workdir = args.gitdir
     try:
         repo = RpmGitRepository(workdir)
@@ -273,9 +543,11 @@ def main(args):
     # spec file at hand
     if args.commit:
         commit = args.commit
-    elif args.include_all:
+    elif args.include_all and utils.worktree_status(workdir):
         commit = 'WC.UNTRACKED'
     else:
+        # clean working tree is exported from HEAD, which needs no
+        # temporary index and can be got from the export cache
         commit = 'HEAD'
     orphan_packaging = configmgr.get('packaging_branch', 'orphan-devel')
     spec_commit_id = orphan_packaging if orphan_packaging else commit
@@ -303,7 +575,14 @@ def main(args):
     tracked_branches = track_export_branches(repo, args)
 
     with utils.Workdir(workdir):
-        export_sources(repo, commit, export_dir, main_spec, args)
+        gbp_args = export_sources(repo, commit, export_dir, main_spec, args)
+
+        # all specs are dumped to export_dir together with main spec, only
+        # patches and VCS tag need updating unless srpm is built for each
+        if rest_specs and not args.source_rpm and \
+                render_specs(export_dir, main_spec, rest_specs,
+                             '--git-patch-export' in gbp_args):
+            rest_specs = []
 
         if rest_specs:
             # backup updated spec file
@@ -20,11 +20,16 @@
 """
 
 import os
+import sys
 import glob
+import copy
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from gitbuildsys import utils
 
-from gitbuildsys.errors import Usage, ObsError, GbsError
+from gitbuildsys.errors import Usage, ObsError, GbsError, CmdError
 from gitbuildsys.conf import configmgr, encode_passwd
 from gitbuildsys.oscapi import OSC, OSCError
 from gitbuildsys.cmd_export import export_sources, get_packaging_dir
@@ -48,34 +53,35 @@ user=%(user)s
 passx=%(passwdx)s
 """
 
-
-def main(args):
-    """gbs remotebuild entry point."""
-
-    obsconf = get_profile(args).obs
-
-    if not obsconf or not obsconf.url:
-        raise GbsError('no obs api found, please add it to gbs conf '
-                       'and try again')
-
-    apiurl = obsconf.url
-
-    if not apiurl.user:
-        raise GbsError('empty user is not allowed for remotebuild, please '
-                       'add user/passwd to gbs conf, and try again')
-
-    if args.commit and args.include_all:
-        raise Usage('--commit can\'t be specified together with '
-                    '--include-all')
-
-    obs_repo = args.repository
-    obs_arch = args.arch
-
-    if args.buildlog and None in (obs_repo, obs_arch):
-        raise GbsError('please specify arch(-A) and repository(-R)')
-
+# number of packages diffed and committed at the same time
+SUBMIT_THREADS = 4
+
+# seconds between build result polls of --watch, doubled while nothing
+# changes up to the maximum
+WATCH_INTERVAL = 5
+WATCH_MAX_INTERVAL = 120
+# consecutive failed polls before --watch gives up
+WATCH_MAX_ERRORS = 5
+# consecutive polls without any build result before --watch gives up,
+# package is unknown or project has no repos to build for
+WATCH_MAX_EMPTY = 3
+
+# build results which won't change without a new build
+SETTLED_STATES = ('succeeded', 'failed', 'unresolvable', 'broken',
+                  'disabled', 'excluded')
+FAILED_STATES = ('failed', 'unresolvable', 'broken')
+# exit code of --watch when some builds failed
+WATCH_FAILED = 2
+
+
+def get_package(args, gitdir):
+    """
+    Get git repository, commit to export, spec and package name of git
+    project at gitdir.
+    Returns: (repo, commit, relative spec path, package name).
+    """
     try:
-        repo = RpmGitRepository(args.gitdir)
+        repo = RpmGitRepository(gitdir)
     except GitRepositoryError as err:
         raise GbsError(str(err))
 
@@ -90,9 +96,11 @@ def main(args):
 
     if args.commit:
         commit = args.commit
-    elif args.include_all:
+    elif args.include_all and utils.worktree_status(workdir):
         commit = 'WC.UNTRACKED'
     else:
+        # clean working tree is exported from HEAD, which needs no
+        # temporary index and can be got from the export cache
         commit = 'HEAD'
 
     relative_spec = utils.guess_spec(workdir, packaging_dir,
@@ -119,7 +127,301 @@ def main(args):
 
     if not spec.name:
         raise GbsError("can't get correct name.")
-    package = spec.name
+
+    return repo, commit, relative_spec, spec.name
+
+
+def export_package(args, repo, commit, relative_spec, exportdir):
+    """
+    Export package sources to exportdir.
+    Returns: commit message to submit with.
+    """
+    with utils.Workdir(repo.path):
+        export_sources(repo, commit, exportdir, relative_spec, args)
+
+    try:
+        return repo.get_commit_info(args.commit or 'HEAD')['subject']
+    except GitRepositoryError as exc:
+        raise GbsError('failed to get commit info: %s' % exc)
+
+
+def export_worker(job):
+    """
+    Export one package of a tree in a worker process, job is (args, gitdir,
+    exportdir).
+    Returns: (package name, commit message, error message).
+    """
+    args, gitdir, exportdir = job
+    try:
+        repo, commit, relative_spec, package = get_package(args, gitdir)
+        os.makedirs(exportdir)
+        commit_msg = export_package(args, repo, commit, relative_spec,
+                                    exportdir)
+    except CmdError as err:
+        return None, None, str(err.args[0])
+    except Exception as err:
+        return None, None, 'unexpected error: %s' % err
+    return package, commit_msg, None
+
+
+def prepare_project(api, target_prj, base_prj):
+    """
+    Create target project if it doesn't exist.
+    Returns: build repos of the project, None if it's created.
+    """
+    build_repos = None
+    try:
+        log.info('checking status of obs project: %s ...' % target_prj)
+        if not api.exists(target_prj):
+            log.info('creating new project %s' % (target_prj))
+            api.create_project(target_prj, base_prj)
+        else:
+            build_repos = api.get_repos_of_project(target_prj)
+            if not build_repos:
+                log.warning("no available build repos for %s" % target_prj)
+    except OSCError as err:
+        raise GbsError(str(err))
+    return build_repos
+
+
+def submit_package(api, target_prj, package, exportdir, commit_msg,
+                   build_repos, obs_arch):
+    """
+    Commit changed files in exportdir to package of target project, or
+    trigger rebuild if nothing changed.
+    Returns: 'committed', 'rebuilt' or 'unchanged'.
+    """
+    files = glob.glob("%s/*" % exportdir)
+    try:
+        if api.exists(target_prj, package):
+            _old, _not_changed, changed, new = api.diff_files(target_prj,
+                                                              package, files)
+            commit_files = changed + new
+        else:
+            log.info('creating new package %s/%s' % (target_prj, package))
+            api.create_package(target_prj, package)
+            # new project - submitting all local files
+            commit_files = files
+    except OSCError as err:
+        raise GbsError(str(err))
+
+    if not commit_files:
+        if build_repos:
+            log.warning("no local changes found. Triggering rebuild")
+            api.rebuild(target_prj, package, obs_arch)
+            return 'rebuilt'
+        else:
+            log.warning("no local changes found. can't trigger rebuild "
+                        "as no available build repos found")
+            return 'unchanged'
+
+    log.info('commit packaging files to build server ...')
+    commit_files = [(fpath, fpath in commit_files) for fpath in files]
+    try:
+        count, size, seconds = api.commit_files(target_prj, package,
+                                                commit_files, commit_msg)
+    except ObsError as exc:
+        raise GbsError('commit packages fail: %s, please check the '
+                       'permission of target project:%s' %
+                       (exc, target_prj))
+
+    log.info('%d files, %.1f MB uploaded in %.1fs (%.1f MB/s)' %
+             (count, size / 1048576.0, seconds,
+              size / 1048576.0 / max(seconds, 0.001)))
+    return 'committed'
+
+
+def find_packages(args):
+    """
+    Find git projects under args.gitdir, filtered by --package-list.
+    Returns: list of git project paths.
+    """
+    paths = utils.GitDirFinder(args.gitdir).paths
+    if args.package_list:
+        wanted = set(name.strip() for name in args.package_list.split(',')
+                     if name.strip())
+        paths = [path for path in paths
+                 if os.path.basename(path) in wanted or
+                 os.path.relpath(path, args.gitdir) in wanted]
+        found = set(os.path.basename(path) for path in paths) | \
+                set(os.path.relpath(path, args.gitdir) for path in paths)
+        for name in sorted(wanted - found):
+            log.warning('package %s not found in %s' % (name, args.gitdir))
+    return paths
+
+
+def submit_packages(args, api, paths, exportdir, target_prj, base_prj,
+                    obs_arch):
+    """
+    Export packages of git projects at paths in worker processes, then diff
+    and commit them to target project at the same time.
+    """
+    if args.spec:
+        raise Usage("--spec can't be used when submitting multiple packages")
+
+    jobs = []
+    for index, path in enumerate(paths):
+        pkg_args = copy.copy(args)
+        pkg_args.gitdir = path
+        jobs.append((pkg_args, path,
+                     os.path.join(exportdir, 'pkg%d' % index)))
+
+    log.info('exporting %d packages ...' % len(paths))
+    # every package in a new process, local .gbs.conf is loaded globally
+    pool = multiprocessing.Pool(min(len(jobs), args.jobs or
+                                    multiprocessing.cpu_count()),
+                                maxtasksperchild=1)
+    try:
+        exported = pool.map_async(export_worker, jobs, 1).get(0xFFFF)
+    finally:
+        pool.terminate()
+
+    build_repos = prepare_project(api, target_prj, base_prj)
+
+    def submit(job):
+        """diff and commit one exported package"""
+        (_args, _path, pkg_exportdir), (package, commit_msg, error) = job
+        if error:
+            return package, 'export failed: %s' % error
+        try:
+            return package, submit_package(api, target_prj, package,
+                                           pkg_exportdir, commit_msg,
+                                           build_repos, obs_arch)
+        except CmdError as err:
+            return package, 'failed: %s' % err.args[0]
+
+    threads = ThreadPool(min(len(jobs), SUBMIT_THREADS))
+    try:
+        results = threads.map_async(submit, zip(jobs, exported)).get(0xFFFF)
+    finally:
+        threads.terminate()
+
+    summary = []
+    failed = 0
+    for path, (package, result) in zip(paths, results):
+        if result not in ('committed', 'rebuilt', 'unchanged'):
+            failed += 1
+        summary.append('%-40s%-30s%s' % (os.path.relpath(path, args.gitdir),
+                                         package or '-', result))
+    log.info('remotebuild summary of %s:\n%s' %
+             (target_prj, '\n'.join(summary)))
+    log.info('follow the link to monitor the build progress:\n'
+             '%s/project/show?project=%s'
+             % (api.apiurl.replace('api', 'build'), target_prj))
+    if failed:
+        raise GbsError('%d of %d packages failed to be submitted' %
+                       (failed, len(paths)))
+
+
+def watch_status(api, target_prj, package, interval=WATCH_INTERVAL,
+                 max_interval=WATCH_MAX_INTERVAL):
+    """
+    Poll build results of package until builds of all repos and archs are
+    settled, logging only the changes.
+    Returns: 0 if all builds succeeded, WATCH_FAILED otherwise.
+    """
+    state = None
+    known = {}
+    errors = 0
+    empty = 0
+    wait = interval
+    while True:
+        try:
+            # server holds the request until results differ from state
+            new_state, results = api.get_last_results(target_prj, package,
+                                                      state)
+        except ObsError as err:
+            errors += 1
+            if errors >= WATCH_MAX_ERRORS:
+                raise GbsError(str(err))
+            log.warning('%s, retrying in %ds' % (err, wait))
+            time.sleep(wait)
+            wait = min(wait * 2, max_interval)
+            continue
+        errors = 0
+
+        changed = False
+        for key in sorted(results):
+            if results[key] != known.get(key):
+                repo, arch, flavor = key
+                stat, dirty = results[key]
+                log.info('%-15s%-15s%-30s%s' % (repo, arch, flavor,
+                                                stat + (' (outdated)'
+                                                        if dirty else '')))
+                changed = True
+        known = results
+        if results:
+            empty = 0
+
+        if not results:
+            empty += 1
+            if empty >= WATCH_MAX_EMPTY:
+                raise GbsError('no build results of %s/%s, please check '
+                               'the package is submitted and the project '
+                               'has repositories' % (target_prj, package))
+            log.warning('no build results from build server')
+        elif all(stat in SETTLED_STATES and not dirty
+                 for stat, dirty in results.itervalues()):
+            failed = ['%s/%s/%s' % key for key in sorted(results)
+                      if results[key][0] in FAILED_STATES]
+            if failed:
+                log.error('build failed for: %s' % ', '.join(failed))
+                return WATCH_FAILED
+            log.info('all builds of %s/%s succeeded' % (target_prj, package))
+            return 0
+
+        if changed or new_state != state:
+            wait = interval
+        else:
+            wait = min(wait * 2, max_interval)
+        state = new_state
+        time.sleep(wait)
+
+
+def main(args):
+    """gbs remotebuild entry point."""
+
+    obsconf = get_profile(args).obs
+
+    if not obsconf or not obsconf.url:
+        raise GbsError('no obs api found, please add it to gbs conf '
+                       'and try again')
+
+    apiurl = obsconf.url
+
+    if not apiurl.user:
+        raise GbsError('empty user is not allowed for remotebuild, please '
+                       'add user/passwd to gbs conf, and try again')
+
+    if args.commit and args.include_all:
+        raise Usage('--commit can\'t be specified together with '
+                    '--include-all')
+
+    obs_repo = args.repository
+    obs_arch = args.arch
+
+    if args.buildlog and None in (obs_repo, obs_arch):
+        raise GbsError('please specify arch(-A) and repository(-R)')
+
+    if args.watch and not args.status:
+        raise Usage('--watch can only be used with --status')
+
+    if args.follow and not args.buildlog:
+        raise Usage('--follow can only be used with --buildlog')
+
+    paths = None
+    try:
+        RpmGitRepository(args.gitdir)
+    except GitRepositoryError as err:
+        # not a git project, submit all packages under it
+        paths = find_packages(args)
+        if not paths:
+            raise GbsError(str(err))
+        if args.buildlog or args.status:
+            raise Usage('--buildlog and --status need a git project')
+
+    if paths is None:
+        repo, commit, relative_spec, package = get_package(args, args.gitdir)
 
     base_prj = None
     if args.base_obsprj:
@@ -153,7 +455,12 @@ def main(args):
     tmpf = utils.Temp(dirn=exportdir, prefix='.oscrc', content=oscrc)
     oscrcpath = tmpf.path
 
-    api = OSC(apiurl, oscrc=oscrcpath)
+    try:
+        cache_ttl = int(configmgr.get('obs_cache_ttl', 'general'))
+    except ValueError:
+        raise GbsError('obs_cache_ttl should be an integer')
+
+    api = OSC(apiurl, oscrc=oscrcpath, cache_ttl=cache_ttl)
 
     try:
         if args.buildlog:
@@ -175,10 +482,16 @@ def main(args):
                                                   status[obs_repo][obs_arch]))
             log.info('build log for %s/%s/%s/%s' % (target_prj, package,
                                                     obs_repo, obs_arch))
-            print(api.get_buildlog(target_prj, package, obs_repo, obs_arch))
+            for data in api.iter_buildlog(target_prj, package, obs_repo,
+                                          obs_arch, follow=args.follow):
+                sys.stdout.write(data)
+                sys.stdout.flush()
 
             return 0
 
+        if args.status and args.watch:
+            return watch_status(api, target_prj, package)
+
         if args.status:
             results = []
 
@@ -195,60 +508,26 @@ def main(args):
                 log.info('no build results from build server')
             return 0
 
-    except OSCError as err:
-        raise GbsError(str(err))
+        if paths is not None:
+            return submit_packages(args, api, paths, exportdir, target_prj,
+                                   base_prj, obs_arch)
 
-    with utils.Workdir(workdir):
-        export_sources(repo, commit, exportdir, relative_spec, args)
+        commit_msg = export_package(args, repo, commit, relative_spec,
+                                    exportdir)
 
-    try:
-        commit_msg = repo.get_commit_info(args.commit or 'HEAD')['subject']
-    except GitRepositoryError as exc:
-        raise GbsError('failed to get commit info: %s' % exc)
+        build_repos = prepare_project(api, target_prj, base_prj)
+        result = submit_package(api, target_prj, package, exportdir,
+                                commit_msg, build_repos, obs_arch)
+        if result == 'unchanged':
+            return 0
+        if result == 'committed':
+            log.info('local changes submitted to build server successfully')
 
-    files = glob.glob("%s/*" % exportdir)
-    build_repos = None
-    try:
-        log.info('checking status of obs project: %s ...' % target_prj)
-        if not api.exists(target_prj):
-            log.info('creating new project %s' % (target_prj))
-            api.create_project(target_prj, base_prj)
-        else:
-            build_repos = api.get_repos_of_project(target_prj)
-            if not build_repos:
-                log.warning("no available build repos for %s" % target_prj)
-        if api.exists(target_prj, package):
-            _old, _not_changed, changed, new = api.diff_files(target_prj,
-                                                              package, files)
-            commit_files = changed + new
-        else:
-            log.info('creating new package %s/%s' % (target_prj, package))
-            api.create_package(target_prj, package)
-            # new project - submitting all local files
-            commit_files = files
+        log.info('follow the link to monitor the build progress:\n'
+                 '%s/package/show?package=%s&project=%s'
+                 % (apiurl.replace('api', 'build'), package, target_prj))
     except OSCError as err:
         raise GbsError(str(err))
-
-    if not commit_files:
-        if build_repos:
-            log.warning("no local changes found. Triggering rebuild")
-            api.rebuild(target_prj, package, obs_arch)
-        else:
-            log.warning("no local changes found. can't trigger rebuild "
-                        "as no available build repos found")
-            return 0
-    else:
-        log.info('commit packaging files to build server ...')
-        commit_files = [(fpath, fpath in commit_files) for fpath in files]
-        try:
-            api.commit_files(target_prj, package, commit_files, commit_msg)
-        except ObsError as exc:
-            raise GbsError('commit packages fail: %s, please check the '
-                           'permission of target project:%s' %
-                           (exc, target_prj))
-
-        log.info('local changes submitted to build server successfully')
-
-    log.info('follow the link to monitor the build progress:\n'
-             '%s/package/show?package=%s&project=%s'
-             % (apiurl.replace('api', 'build'), package, target_prj))
+    finally:
+        api.meta_cache.save()
+        api.log_stats()
@@ -0,0 +1,197 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+This module provides compression backends for source archives exported by
+git-buildpackage.
+
+git-buildpackage compresses the archive by piping 'git archive' into the
+compressor named after the Source of the spec file (gzip, bzip2, xz...),
+looked up from PATH. A backend puts wrappers of those commands in front of
+PATH, which run the selected compressor with the same output format and
+record time and sizes of every compression.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+
+from gitbuildsys.errors import GbsError
+from gitbuildsys.log import LOGGER as log
+
+BLOCK_SIZE = 1024 * 1024
+
+# compression type: candidates of (command, thread options), output of
+# every candidate can be decompressed by the original command
+PARALLEL_COMMANDS = {
+    'gzip': [('pigz', ['-p', '%(threads)d'])],
+    'bzip2': [('lbzip2', ['-n', '%(threads)d']),
+              ('pbzip2', ['-p%(threads)d'])],
+    'xz': [('xz', ['-T', '%(threads)d'])],
+    'zstd': [('zstd', ['-T%(threads)d'])],
+    }
+
+BACKENDS = ('default', 'serial', 'parallel')
+
+WRAPPER = '''#!%(python)s
+import sys
+sys.path.insert(0, %(path)r)
+from gitbuildsys.compression import run_wrapper
+sys.exit(run_wrapper(%(name)r, %(cmd)r, %(stats)r))
+'''
+
+
+def find_command(name, path=None):
+    """Find executable name in path (default: PATH), None if not found."""
+    for dirname in (path or os.environ.get('PATH', '')).split(os.pathsep):
+        fname = os.path.join(dirname, name)
+        if os.path.isfile(fname) and os.access(fname, os.X_OK):
+            return fname
+    return None
+
+
+def run_wrapper(name, cmd, statsfile):
+    """
+    Run compressor cmd with arguments of this process. When compressing
+    stdin to stdout, data is copied through this process to count sizes.
+    Returns: exit code of the compressor.
+    """
+    args = sys.argv[1:]
+    if '-c' not in args or [arg for arg in args if not arg.startswith('-')] \
+            or set(args) & set(['-d', '--decompress', '-t', '-l']):
+        return subprocess.call(cmd + args)
+
+    start = time.time()
+    proc = subprocess.Popen(cmd + args, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE)
+    sizes = {'input': 0, 'output': 0}
+
+    def feed():
+        """copy stdin to the compressor"""
+        try:
+            for data in iter(lambda: os.read(0, BLOCK_SIZE), ''):
+                sizes['input'] += len(data)
+                proc.stdin.write(data)
+        finally:
+            proc.stdin.close()
+
+    thread = threading.Thread(target=feed)
+    thread.start()
+    for data in iter(lambda: proc.stdout.read(BLOCK_SIZE), ''):
+        sizes['output'] += len(data)
+        sys.stdout.write(data)
+    sys.stdout.flush()
+    thread.join()
+    retcode = proc.wait()
+
+    with open(statsfile, 'a') as fobj:
+        fobj.write(json.dumps({'type': name, 'command': cmd[0],
+                               'seconds': time.time() - start,
+                               'input': sizes['input'],
+                               'output': sizes['output'],
+                               'retcode': retcode}) + '\n')
+    return retcode
+
+
+class Compression(object):
+    """
+    Compression backend for exported source archives, used as context
+    manager around git-buildpackage export.
+
+    'serial' runs the same compressors git-buildpackage would, 'parallel'
+    runs multithreaded ones (pigz, lbzip2/pbzip2, xz -T, zstd -T) where
+    available. Both report time and ratio of every compression.
+    """
+
+    def __init__(self, backend='parallel', threads=0):
+        if backend not in BACKENDS:
+            raise GbsError('unknown compression backend: %s, supported '
+                           'are: %s' % (backend, ', '.join(BACKENDS)))
+        self.backend = backend
+        self.threads = threads or multiprocessing.cpu_count()
+        self.bindir = None
+        self.old_path = None
+        self.stats = []
+
+    def commands(self, path=None):
+        """
+        Get commands to wrap.
+        Returns: dict of compression type: command line list.
+        """
+        commands = {}
+        for name, candidates in PARALLEL_COMMANDS.iteritems():
+            original = find_command(name, path)
+            if self.backend == 'serial':
+                candidates = []
+            for cmd, opts in candidates:
+                found = find_command(cmd, path)
+                if found:
+                    commands[name] = [found] + \
+                        [opt % {'threads': self.threads} for opt in opts]
+                    break
+            else:
+                if original:
+                    commands[name] = [original]
+        return commands
+
+    def __enter__(self):
+        if self.backend == 'default':
+            return self
+        self.bindir = tempfile.mkdtemp(prefix='.gbs-compress-')
+        statsfile = os.path.join(self.bindir, 'stats')
+        pkgpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for name, cmd in self.commands().iteritems():
+            wrapper = os.path.join(self.bindir, name)
+            with open(wrapper, 'w') as fobj:
+                fobj.write(WRAPPER % {'python': sys.executable,
+                                      'path': pkgpath, 'name': name,
+                                      'cmd': cmd, 'stats': statsfile})
+            os.chmod(wrapper, 0o755)
+        self.old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = os.pathsep.join([self.bindir, self.old_path])
+        return self
+
+    def __exit__(self, *_args):
+        if not self.bindir:
+            return
+        os.environ['PATH'] = self.old_path
+        try:
+            with open(os.path.join(self.bindir, 'stats')) as fobj:
+                self.stats = [json.loads(line) for line in fobj]
+        except (IOError, ValueError):
+            self.stats = []
+        shutil.rmtree(self.bindir, True)
+        self.bindir = None
+        self.report()
+
+    def report(self):
+        """Log time and ratio of compressions."""
+        for stat in self.stats:
+            ratio = 100.0 * stat['output'] / stat['input'] \
+                    if stat['input'] else 0
+            log.info('%s compressed %d bytes to %d bytes (%.1f%%) in %.1fs '
+                     'with %s' % (stat['type'], stat['input'], stat['output'],
+                                  ratio, stat['seconds'],
+                                  os.path.basename(stat['command'])))
+
@@ -182,6 +182,7 @@ class ConfigMgr(object):
                             'packaging_dir': 'packaging',
                             'work_dir': '.',
                             'fallback_to_native': '',
+                            'obs_cache_ttl': '0',
                            },
                 'orphan-devel': {'packaging_branch': '',
                                 },
@@ -522,6 +523,8 @@ class Profile(object):
         self.buildroot = None
         self.buildconf = None
         self.exclude_packages = []
+        self.compression = None
+        self.compression_threads = 0
 
     def add_repo(self, repoconf):
         '''add a repo to repo list of the profile'''
@@ -729,6 +732,14 @@ class BizConfigManager(ConfigMgr):
             for pkg in exclude_val.split(','):
                 if pkg.strip():
                     profile.exclude_packages.append(pkg.strip())
+        profile.compression = self.get_optional_item(name, 'compression')
+        threads = self.get_optional_item(name, 'compression_threads')
+        if threads:
+            try:
+                profile.compression_threads = int(threads)
+            except ValueError:
+                raise errors.ConfigError('compression_threads of %s should '
+                                         'be a number: %s' % (name, threads))
 
         return profile
 
@@ -23,33 +23,168 @@ Only APIs which are required by cmd_remotebuild present here.
 """
 
 import os
-import re
+import json
+import errno
+import time
+import random
+import socket
+import tempfile
+import threading
+import httplib
 import urllib2
 import M2Crypto
 from M2Crypto.SSL.Checker import SSLVerificationError
 import ssl
 
 from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 from urllib import quote_plus, pathname2url
+from urlparse import urlsplit
 
 from xml.etree import cElementTree as ET
 
-from gitbuildsys.utils import hexdigest
+from gitbuildsys.utils import DigestCache
 from gitbuildsys.errors import ObsError
-from gitbuildsys.log import waiting
+from gitbuildsys.log import waiting, DEBUG
 from gitbuildsys.log import LOGGER as logger
 
 from osc import conf, core
 
+# attempts of a request on transient errors
+HTTP_RETRIES = 5
+# retries of all requests of an OSC instance, so that an unavailable server
+# is not retried by every request
+HTTP_RETRY_BUDGET = 50
+# seconds of backoff before first retry, doubled by every retry
+HTTP_BACKOFF = 1
+HTTP_MAX_BACKOFF = 60
+# HTTP errors retried, others are final
+RETRY_HTTP_CODES = (408, 429, 500, 502, 503, 504)
+# requests retried after they may have reached the server, POST like
+# rebuild and commit is only retried if it was never sent
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT')
+
+# build log is requested in chunks and read in blocks of these sizes
+BUILDLOG_CHUNK = 8 * 1024 * 1024
+BUILDLOG_BLOCK = 64 * 1024
+# seconds between polls of build log being written
+BUILDLOG_INTERVAL = 5
+# build states in which build log still grows
+BUILDING_STATES = ('scheduled', 'dispatching', 'building', 'finishing',
+                   'signing')
+# control characters removed from build log, except newline
+CONTROL_CHARS = ''.join([chr(i) for i in range(10) + range(11, 32)])
+
+
 class OSCError(Exception):
-    """Local exception class."""
-    pass
+    """Local exception class, code is HTTP status code of the error."""
+    def __init__(self, msg, code=None):
+        Exception.__init__(self, msg)
+        self.code = code
+
+
+class MetaCache(object):
+    """
+    OBS metadata got by one gbs run, like project/package meta, project
+    config and file lists, keyed by (apiurl, project, package, kind). Data
+    None means it doesn't exist. With ttl, entries not older than ttl
+    seconds are saved to a json file and used by next runs.
+    """
+
+    def __init__(self, ttl=0, cachefile='~/.cache/gbs/obs-meta.json'):
+        self.ttl = ttl
+        self.cachefile = os.path.expanduser(cachefile) \
+                         if cachefile and ttl else None
+        self.entries = {}
+        self.hits = 0
+        self.changed = False
+        self._lock = threading.Lock()
+        if self.cachefile:
+            try:
+                with open(self.cachefile) as fobj:
+                    entries = json.load(fobj)
+                for entry in entries:
+                    if entry['time'] <= time.time() - ttl:
+                        continue
+                    # json gives unicode, data is sent and parsed as str
+                    entry['key'] = tuple(self.encode(part)
+                                         for part in entry['key'])
+                    entry['data'] = self.encode(entry['data'])
+                    self.entries[entry['key']] = entry
+            except (IOError, ValueError, KeyError, TypeError):
+                self.entries = {}
+
+    @staticmethod
+    def encode(value):
+        """Encode unicode value loaded from cache file to UTF-8 str."""
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+    def get(self, key):
+        """
+        Get cached data of key.
+        Returns: (found, data).
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            self.hits += 1
+            return True, entry['data']
+
+    def set(self, key, data):
+        """Cache data of key."""
+        with self._lock:
+            self.entries[key] = {'key': key, 'data': data,
+                                 'time': time.time()}
+            self.changed = True
+
+    def invalidate(self, apiurl, prj, pkg=None, kind=None):
+        """
+        Remove entries of project, or of package if pkg is given, or only
+        entries of that kind if kind is given.
+        """
+        with self._lock:
+            for key in self.entries.keys():
+                if key[:2] == (apiurl, prj) and \
+                        (pkg is None or key[2] == pkg) and \
+                        (kind is None or key[3] == kind):
+                    del self.entries[key]
+                    self.changed = True
+
+    def save(self):
+        """Save entries younger than ttl to the cache file."""
+        if not self.cachefile or not self.changed:
+            return
+        with self._lock:
+            entries = [entry for entry in self.entries.itervalues()
+                       if entry['time'] > time.time() - self.ttl]
+        tmpfile = None
+        try:
+            dirname = os.path.dirname(self.cachefile)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            fdesc, tmpfile = tempfile.mkstemp(prefix='.obs-meta-',
+                                              dir=dirname)
+            with os.fdopen(fdesc, 'w') as fobj:
+                json.dump(entries, fobj)
+            os.rename(tmpfile, self.cachefile)
+        except (IOError, OSError, ValueError, UnicodeError) as err:
+            # data which is not UTF-8 can't be saved as json
+            logger.debug("can't save OBS metadata cache: %s" % err)
+            if tmpfile and os.path.exists(tmpfile):
+                os.unlink(tmpfile)
 
 
 class OSC(object):
     """Interface to OSC API"""
 
-    def __init__(self, apiurl=None, oscrc=None):
+    # number of files uploaded at the same time
+    UPLOAD_THREADS = 4
+
+    def __init__(self, apiurl=None, oscrc=None, cache_ttl=0,
+                 cachedir='~/.cache/gbs'):
         if oscrc:
             try:
                 conf.get_config(override_conffile=oscrc)
@@ -70,28 +205,138 @@ class OSC(object):
         else:
             self.apiurl = conf.config['apiurl']
 
+        # md5 of local files, shared by diff_files and commit_files
+        cachedir = os.path.expanduser(cachedir)
+        self.digests = DigestCache(os.path.join(cachedir, 'digests.json'))
+
+        # meta, project config and file lists got from OBS
+        self.meta_cache = MetaCache(cache_ttl,
+                                    os.path.join(cachedir, 'obs-meta.json'))
+
+        # requests, retries and seconds of every endpoint
+        self.stats = defaultdict(lambda: [0, 0, 0.0])
+        self.retry_budget = HTTP_RETRY_BUDGET
+        self.lock = threading.Lock()
+
     @staticmethod
-    def core_http(method, url, data=None, filep=None):
-        """Wrapper above core.<http_METHOD> to catch exceptions."""
+    def endpoint(method, url):
+        """
+        Get endpoint of request for statistics, e.g. 'GET source/_meta'
+        for GET of /source/<prj>/<pkg>/_meta.
+        """
+        parts = urlsplit(url).path.strip('/').split('/')
+        return '%s %s' % (method.func_name.split('_')[-1],
+                          '/'.join(parts[:1] + [part for part in parts[1:]
+                                                if part.startswith('_')]))
+
+    @staticmethod
+    def retry_delay(count, err=None):
+        """
+        Get seconds to wait before retry count, Retry-After of err if
+        server sent it, or exponential backoff with jitter.
+        """
+        if isinstance(err, urllib2.HTTPError):
+            retry_after = err.info().get('Retry-After', '').strip()
+            if retry_after.isdigit():
+                return min(int(retry_after), HTTP_MAX_BACKOFF)
+        delay = min(HTTP_BACKOFF * 2 ** (count - 1), HTTP_MAX_BACKOFF)
+        return random.uniform(delay / 2.0, delay)
 
-        # Workarounded osc bug. http_GET sometimes returns empty response
-        # Usually next try succeeds, so let's try 3 times
-        for count in (1, 2, 3):
+    @staticmethod
+    def unsent(err):
+        """Check if request failed with err before it was sent."""
+        reason = getattr(err, 'reason', err)
+        return isinstance(reason, socket.gaierror) or \
+               (isinstance(reason, socket.error) and
+                reason.errno == errno.ECONNREFUSED)
+
+    def core_http(self, method, url, data=None, filep=None):
+        """
+        Wrapper above core.<http_METHOD> to catch exceptions. Transient
+        errors are retried with backoff, as long as retry budget lasts.
+        Requests which are not idempotent are only retried if they were
+        not sent.
+        """
+        endpoint = self.endpoint(method, url)
+        idempotent = endpoint.split()[0] in IDEMPOTENT_METHODS
+        start = time.time()
+        count = 0
+        while True:
+            count += 1
             try:
-                return method(url, data=data, file=filep)
+                resp = method(url, data=data, file=filep)
+                error = None
+            except urllib2.HTTPError as err:
+                error = OSCError(str(err), err.code)
+                retry = idempotent and err.code in RETRY_HTTP_CODES
+            except SSLVerificationError as err:
+                error = OSCError('SSL verification error: %s' % err)
+                retry = False
             except (urllib2.URLError, M2Crypto.m2urllib2.URLError,
-                    M2Crypto.SSL.SSLError, ssl.SSLError) as err:
-                if count == 3:
-                    raise OSCError(str(err))
-
-        raise OSCError('Got empty response from %s %s' % \
-                       (method.func_name.split('_')[-1], url))
+                    M2Crypto.SSL.SSLError, ssl.SSLError, socket.error,
+                    httplib.HTTPException) as err:
+                error = OSCError(str(err))
+                retry = idempotent or self.unsent(err)
+
+            with self.lock:
+                stats = self.stats[endpoint]
+                if error and retry and count < HTTP_RETRIES and \
+                        self.retry_budget > 0:
+                    self.retry_budget -= 1
+                    stats[1] += 1
+                else:
+                    retry = False
+                    stats[0] += 1
+                    stats[2] += time.time() - start
+
+            if not error:
+                return resp
+            if not retry:
+                raise error
+            delay = self.retry_delay(count, err)
+            logger.debug('%s %s failed: %s, retrying in %.1fs' %
+                         (endpoint.split()[0], url, error, delay))
+            time.sleep(delay)
+
+    def cached_get(self, kind, prj, pkg, url):
+        """
+        GET url of kind of metadata of prj/pkg through metadata cache, not
+        found is cached too.
+        Returns: response data.
+        """
+        key = (self.apiurl, prj, pkg or '', kind)
+        found, data = self.meta_cache.get(key)
+        if not found:
+            try:
+                data = self.core_http(core.http_GET, url).read()
+            except OSCError as err:
+                if err.code != 404:
+                    raise
+                data = None
+            self.meta_cache.set(key, data)
+        if data is None:
+            raise OSCError('HTTP Error 404: Not Found', 404)
+        return data
+
+    def log_stats(self):
+        """Log requests, retries and latency of every endpoint."""
+        if logger.level != DEBUG:
+            return
+        logger.debug('%d OBS metadata requests saved by cache' %
+                     self.meta_cache.hits)
+        for endpoint, (requests, retries, seconds) in \
+                sorted(self.stats.iteritems()):
+            logger.debug('%-30s%5d requests%5d retries%9.3fs average' %
+                         (endpoint, requests, retries,
+                          seconds / max(requests, 1)))
 
     def get_repos_of_project(self, project):
         """Get dictionary name: list of archs for project repos"""
         repos = defaultdict(list)
-        for repo in core.get_repos_of_project(self.apiurl, project):
-            repos[repo.name].append(repo.arch)
+        meta = ET.fromstring(self.get_meta(project))
+        for repo in meta.findall('repository'):
+            for arch in repo.findall('arch'):
+                repos[repo.get('name')].append(arch.text)
         return repos
 
     def get_tags(self, project, tags):
@@ -160,9 +405,8 @@ class OSC(object):
 
         try:
             # Create project and set its meta
-            core.edit_meta('prj', path_args=quote_plus(target), data=meta)
-        except (urllib2.URLError, M2Crypto.m2urllib2.URLError,
-                M2Crypto.SSL.SSLError) as err:
+            self.set_meta(meta, target)
+        except OSCError as err:
             raise ObsError("Can't set meta for %s: %s" % (target, str(err)))
 
         # don't need set project config if no src project
@@ -170,17 +414,18 @@ class OSC(object):
             return
 
         # copy project config
+        url = core.make_meta_url("prjconf", quote_plus(src), self.apiurl)
         try:
-            config = core.show_project_conf(self.apiurl, src)
-        except (urllib2.URLError, M2Crypto.m2urllib2.URLError,
-                M2Crypto.SSL.SSLError) as err:
+            config = self.cached_get('prjconf', src, '', url)
+        except OSCError as err:
             raise ObsError("Can't get config from project %s: %s" \
                            % (src, str(err)))
 
         url = core.make_meta_url("prjconf", quote_plus(target),
                                  self.apiurl, False)
         try:
-            self.core_http(core.http_PUT, url, data=''.join(config))
+            self.core_http(core.http_PUT, url, data=config)
+            self.meta_cache.invalidate(self.apiurl, target, '', 'prjconf')
         except OSCError as err:
             raise ObsError("can't copy config from %s to %s: %s" \
                            % (src, target, err))
@@ -195,39 +440,33 @@ class OSC(object):
         url = core.makeurl(self.apiurl, ['source', prj], query)
         try:
             self.core_http(core.http_DELETE, url)
+            self.meta_cache.invalidate(self.apiurl, prj)
         except OSCError as err:
             raise ObsError("can't delete project %s: %s" % (prj, err))
 
     def exists(self, prj, pkg=''):
         """Check if project or package exists."""
-        metatype, path_args = self.get_path(prj, pkg)
-        err = None
         try:
-            core.meta_exists(metatype=metatype, path_args=path_args,
-                             create_new=False, apiurl=self.apiurl)
-        except urllib2.HTTPError as err:
+            self.get_meta(prj, pkg)
+        except OSCError as err:
             if err.code == 404:
                 return False
-        except (urllib2.URLError, M2Crypto.m2urllib2.URLError, \
-                M2Crypto.SSL.SSLError) as err:
-            pass
-        except SSLVerificationError:
-            raise ObsError("SSL verification error.")
-        if err:
             raise ObsError("can't check if %s/%s exists: %s" % (prj, pkg, err))
 
         return True
 
     def rebuild(self, prj, pkg, arch):
         """Rebuild package."""
+        query = {'cmd': 'rebuild', 'package': pkg}
+        if arch:
+            query['arch'] = arch
+        url = core.makeurl(self.apiurl, ['build', prj], query=query)
         try:
-            return core.rebuild(self.apiurl, prj, pkg, repo=None, arch=arch)
-        except (urllib2.URLError, M2Crypto.m2urllib2.URLError, \
-                M2Crypto.SSL.SSLError) as err:
+            resp = self.core_http(core.http_POST, url)
+            return ET.fromstring(resp.read()).get('code')
+        except OSCError as err:
             raise ObsError("Can't trigger rebuild for %s/%s: %s" % \
                            (prj, pkg, str(err)))
-        except SSLVerificationError:
-            raise ObsError("SSL verification error.")
 
     def diff_files(self, prj, pkg, paths):
         """
@@ -242,24 +481,32 @@ class OSC(object):
         changed, not changed and new are lists of local filepaths
         """
         # Get list of files from the OBS
-        rfiles = core.meta_get_filelist(self.apiurl, prj, pkg, verbose=True,
-                                        expand=True)
+        url = core.makeurl(self.apiurl, ['source', prj, pkg],
+                           query={'expand': 1, 'rev': 'latest'})
+        rfiles = ET.fromstring(self.cached_get('filelist', prj, pkg, url))
 
         old, not_changed, changed, new = [], [], [], []
 
-        if not rfiles:
+        # Helper dictionary helps to avoid looping over remote files
+        rdict = dict((entry.get('name'), (int(entry.get('size')),
+                                          entry.get('md5')))
+                     for entry in rfiles.findall('entry'))
+
+        if not rdict:
             # no remote files - all local files are new
             return old, not_changed, changed, paths[:]
 
-        # Helper dictionary helps to avoid looping over remote files
-        rdict = dict((fobj.name, (fobj.size, fobj.md5)) for fobj in rfiles)
+        # only files with the same size need to be hashed
+        md5s = self.digests.md5_many(
+            [lpath for lpath in paths if os.path.basename(lpath) in rdict and
+             rdict[os.path.basename(lpath)][0] == os.path.getsize(lpath)])
+        self.digests.save()
 
         for lpath in paths:
             lname = os.path.basename(lpath)
             if lname in rdict:
-                lsize = os.path.getsize(lpath)
-                rsize, rmd5 = rdict[lname]
-                if rsize == lsize and rmd5 == core.dgst(lpath):
+                rmd5 = rdict[lname][1]
+                if md5s.get(lpath) == rmd5:
                     not_changed.append(lpath)
                 else:
                     changed.append(lpath)
@@ -271,9 +518,29 @@ class OSC(object):
 
         return rdict.keys(), not_changed, changed, new
 
+    def upload_file(self, prj, pkg, fpath):
+        """
+        Upload file to the package. Large files are streamed from disk by
+        osc.
+        Returns: size of uploaded file.
+        """
+        put_url = core.makeurl(self.apiurl,
+                               ['source', prj, pkg,
+                                pathname2url(os.path.basename(fpath))],
+                               query="rev=repository")
+        try:
+            self.core_http(core.http_PUT, put_url, filep=fpath)
+        except OSCError as err:
+            raise OSCError('failed to upload %s: %s' % (fpath, err), err.code)
+        return os.path.getsize(fpath)
+
     @waiting
     def commit_files(self, prj, pkg, files, message):
-        """Commits files to OBS."""
+        """
+        Commits files to OBS, files flagged for commit are uploaded at the
+        same time.
+        Returns: (number of uploaded files, bytes, seconds).
+        """
 
         query = {'cmd': 'commitfilelist',
                  'user': conf.get_apiurl_usr(self.apiurl),
@@ -281,25 +548,34 @@ class OSC(object):
                  'keeplink': 1}
         url = core.makeurl(self.apiurl, ['source', prj, pkg], query=query)
 
+        md5s = self.digests.md5_many([fpath for fpath, _ in files])
+        self.digests.save()
         xml = "<directory>"
         for fpath, _ in files:
-            with open(fpath) as fhandle:
-                xml += '<entry name="%s" md5="%s"/>' % \
-                       (os.path.basename(fpath), hexdigest(fhandle))
+            xml += '<entry name="%s" md5="%s"/>' % \
+                   (os.path.basename(fpath), md5s[fpath])
         xml += "</directory>"
 
+        upload = [fpath for fpath, commit_flag in files if commit_flag]
+        start = time.time()
         try:
             self.core_http(core.http_POST, url, data=xml)
-            for fpath, commit_flag in files:
-                if commit_flag:
-                    put_url = core.makeurl(
-                        self.apiurl, ['source', prj, pkg,
-                                      pathname2url(os.path.basename(fpath))],
-                        query="rev=repository")
-                    self.core_http(core.http_PUT, put_url, filep=fpath)
+            sizes = []
+            if upload:
+                threads = ThreadPool(min(len(upload), self.UPLOAD_THREADS))
+                try:
+                    sizes = threads.map_async(
+                        lambda fpath: self.upload_file(prj, pkg, fpath),
+                        upload).get(0xFFFF)
+                finally:
+                    threads.terminate()
             self.core_http(core.http_POST, url, data=xml)
         except OSCError as err:
             raise ObsError("can't commit files to %s/%s: %s" % (prj, pkg, err))
+        finally:
+            self.meta_cache.invalidate(self.apiurl, prj, pkg, 'filelist')
+
+        return len(upload), sum(sizes), time.time() - start
 
     def create_package(self, prj, pkg):
         """Create package in the project."""
@@ -312,43 +588,116 @@ class OSC(object):
             self.core_http(core.http_PUT, url, data=meta)
         except OSCError as err:
             raise ObsError("can't create %s/%s: %s" % (prj, pkg, err))
+        finally:
+            self.meta_cache.invalidate(self.apiurl, prj, pkg)
 
     def get_results(self, prj, pkg):
         """Get package build results."""
         results = defaultdict(dict)
+        url = core.makeurl(self.apiurl, ['build', prj, '_result'],
+                           query={'package': pkg})
         try:
-            build_status = core.get_results(self.apiurl, prj, pkg)
-        except (urllib2.URLError, M2Crypto.m2urllib2.URLError,
-                M2Crypto.SSL.SSLError) as err:
+            root = ET.fromstring(self.core_http(core.http_GET, url).read())
+        except OSCError as err:
             raise ObsError("can't get %s/%s build results: %s" \
                            % (prj, pkg, str(err)))
 
-        # This regular expression is created for parsing the
-        # results of of core.get_results()
-        stat_re = re.compile(r'^(?P<repo>\S+)\s+(?P<arch>\S+)\s+'
-                             '(?P<status>\S*)$')
-        for res in build_status:
-            match = stat_re.match(res)
-            if match:
-                results[match.group('repo')][match.group('arch')] = \
-                    match.group('status')
-            else:
-                logger.warning('not valid build status received: %s' % res)
+        for result in root.findall('result'):
+            status = result.find('status')
+            if status is None:
+                logger.warning('not valid build status received: %s' %
+                               ET.tostring(result))
+                continue
+            results[result.get('repository')][result.get('arch')] = \
+                status.get('code')
 
         return results
 
-    def get_buildlog(self, prj, pkg, repo, arch):
-        """Get package build log from OBS."""
-
+    def get_last_results(self, prj, pkg, oldstate=None):
+        """
+        Get results of the last build of package and its multibuild flavors.
+        With oldstate, server answers when the results differ from that
+        state, or when its wait times out.
+        Returns: (state, dict of (repo, arch, package): (status, dirty)).
+        """
+        query = {'package': pkg, 'lastbuild': 1, 'multibuild': 1,
+                 'locallink': 1}
+        if oldstate:
+            query['oldstate'] = oldstate
+        url = core.makeurl(self.apiurl, ['build', prj, '_result'],
+                           query=query)
+        try:
+            root = ET.fromstring(self.core_http(core.http_GET, url).read())
+        except OSCError as err:
+            raise ObsError("can't get %s/%s build results: %s" \
+                           % (prj, pkg, err))
+        except SyntaxError as err:
+            raise ObsError("invalid build results of %s/%s: %s" \
+                           % (prj, pkg, err))
+
+        results = {}
+        for result in root.findall('result'):
+            dirty = result.get('dirty') is not None or \
+                    result.get('state') != result.get('code')
+            for status in result.findall('status'):
+                key = (result.get('repository'), result.get('arch'),
+                       status.get('package'))
+                results[key] = (status.get('code'), dirty)
+        return root.get('state'), results
+
+    def get_build_status(self, prj, pkg, repo, arch):
+        """Get package build status of one repo/arch."""
         url = core.makeurl(self.apiurl, ['build', prj, repo, arch, pkg,
-                                         '_log?nostream=1&start=0'])
+                                         '_status'])
         try:
-            log = self.core_http(core.http_GET, url).read()
+            root = ET.fromstring(self.core_http(core.http_GET, url).read())
         except OSCError as err:
-            raise ObsError("can't get %s/%s build log: %s" % (prj, pkg, err))
+            raise ObsError("can't get %s/%s build status: %s" \
+                           % (prj, pkg, err))
+        except SyntaxError as err:
+            raise ObsError("invalid build status of %s/%s: %s" \
+                           % (prj, pkg, err))
+        return root.get('code')
+
+    def iter_buildlog(self, prj, pkg, repo, arch, follow=False,
+                      interval=BUILDLOG_INTERVAL):
+        """
+        Get package build log from OBS in chunks, with control characters
+        removed. With follow, keep polling for new log while the package is
+        being built.
+        Returns: generator of log data.
+        """
+        offset = 0
+        while True:
+            url = core.makeurl(self.apiurl, ['build', prj, repo, arch, pkg,
+                                             '_log'],
+                               query={'nostream': 1, 'start': offset,
+                                      'end': offset + BUILDLOG_CHUNK})
+            try:
+                resp = self.core_http(core.http_GET, url)
+                size = 0
+                for data in iter(lambda: resp.read(BUILDLOG_BLOCK), ''):
+                    size += len(data)
+                    yield data.translate(None, CONTROL_CHARS)
+            except OSCError as err:
+                raise ObsError("can't get %s/%s build log: %s" \
+                               % (prj, pkg, err))
+            offset += size
+
+            if size >= BUILDLOG_CHUNK:
+                continue
+            if not follow:
+                break
+            if self.get_build_status(prj, pkg, repo, arch) not in \
+                    BUILDING_STATES:
+                # get log written after the last request
+                follow = False
+                continue
+            time.sleep(interval)
 
-        return log.translate(None, "".join([chr(i) for i in \
-                                            range(10) + range(11, 32)]))
+    def get_buildlog(self, prj, pkg, repo, arch):
+        """Get package build log from OBS."""
+        return ''.join(self.iter_buildlog(prj, pkg, repo, arch))
 
     @staticmethod
     def get_path(prj, pkg=None):
@@ -364,13 +713,16 @@ class OSC(object):
         """Get project/package meta."""
         metatype, path_args = self.get_path(prj, pkg)
         url = core.make_meta_url(metatype, path_args, self.apiurl)
-        return self.core_http(core.http_GET, url).read()
+        return self.cached_get('meta', prj, pkg, url)
 
     def set_meta(self, meta, prj, pkg=None):
         """Set project/package meta."""
         metatype, path_args = self.get_path(prj, pkg)
         url = core.make_meta_url(metatype, path_args, self.apiurl)
-        return self.core_http(core.http_PUT, url, data=meta)
+        try:
+            return self.core_http(core.http_PUT, url, data=meta)
+        finally:
+            self.meta_cache.invalidate(self.apiurl, prj, pkg or '', 'meta')
 
     def get_description(self, prj, pkg=None):
         """Get project/package description."""
@@ -16,24 +16,52 @@
 # with this program; if not, write to the Free Software Foundation, Inc., 59
 # Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
-"""Helpers, convenience utils, common APIs."""
+"""
+Helpers, convenience utils, common APIs.
+
+Concurrency contract: git and file system helpers in this module, such as
+guess_spec, show_file_from_rev, file_exists_in_rev, glob_in_rev and
+GitCatFile, never change the working directory of the process. They take
+the repository path explicitly and are safe to call from several threads
+at once, given absolute paths. Shared state (the cat-file readers) is
+guarded by locks. Only Workdir changes the process wide working directory;
+it holds a process wide lock while inside, so code needing it (like gbp
+export) is serialized and should be kept out of thread pools.
+"""
 
 import os
 import re
 import gzip
+import json
+import mmap
 import glob
 import tempfile
 import shutil
 import pycurl
 import hashlib
+import time
 import fnmatch
 import signal
 import subprocess
 import argparse
+import atexit
+import sqlite3
+import threading
 import xml.etree.ElementTree as ET
-from collections import defaultdict
+import xml.etree.cElementTree as cET
+from collections import defaultdict, OrderedDict
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 from gitbuildsys.errors import UrlError, GbsError
+from gitbuildsys.cache import FileCache, link_or_copy
 from gitbuildsys.log import LOGGER as log
 
 from gbp.rpm.git import RpmGitRepository, GitRepositoryError
@@ -49,44 +77,57 @@ class Workdir(object):
             # do something here
         # here you're again in the same dir as before
     """
+    # working directory is process wide, let one thread use it at a time
+    _lock = threading.RLock()
+
     def __init__(self, path):
         self._newdir = path
-        self._cwd = os.getcwd()
+        self._cwd = None
 
     def __enter__(self):
-        os.chdir(self._newdir)
+        self._lock.acquire()
+        try:
+            self._cwd = os.getcwd()
+            os.chdir(self._newdir)
+        except OSError:
+            self._lock.release()
+            raise
 
     def __exit__(self, _type, _value, _tb):
-        os.chdir(self._cwd)
+        try:
+            os.chdir(self._cwd)
+        finally:
+            self._lock.release()
 
-def guess_spec(git_path, packaging_dir, given_spec, commit_id='WC.UNTRACKED'):
-    """Guess spec file from project name if not given."""
+def guess_spec(git_path, packaging_dir, given_spec, commit_id='WC.UNTRACKED',
+               reader=None):
+    """
+    Guess spec file from project name if not given.
+    reader is an optional GitCatFile of git_path to read the revision,
+    the shared reader of git_path is used by default.
+    """
     git_path = os.path.abspath(git_path)
 
     if commit_id == 'WC.UNTRACKED':
-        if os.path.islink(packaging_dir):
-            packaging_dir = os.readlink(packaging_dir)
+        if os.path.islink(os.path.join(git_path, packaging_dir)):
+            packaging_dir = os.readlink(os.path.join(git_path, packaging_dir))
         check = lambda fname, dir_only=False: os.path.exists(os.path.join(
             git_path, fname))
         glob_ = lambda pattern: glob_in_inc(git_path, packaging_dir, pattern)
         msg = 'No such spec file %s'
     else:
-        git_object = commit_id + ':' + packaging_dir
-        cmd = ['git', 'show', git_object]
-        try:
-            with Workdir(git_path):
-                outp = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        except (subprocess.CalledProcessError, OSError):
-            raise GbsError("failed to run %s in %s" % (' '.join(cmd), git_path))
-        output = outp.communicate()[0]
-        if not output.startswith('tree %s' % git_object):
+        reader = reader or get_git_reader(git_path)
+        objtype, output = reader.read(commit_id + ':' + packaging_dir)
+        if objtype != 'tree':
             # packaging_dir is a symlink
-            packaging_dir = output
-        check = lambda fname, dir_only=False: file_exists_in_rev(git_path,
-                                                                 fname,
-                                                                 commit_id, \
-                                                              dir_only=dir_only)
-        glob_ = lambda pattern: glob_in_rev(git_path, pattern, commit_id)
+            packaging_dir = output or ''
+        check = lambda fname, dir_only=False: reader.exists(fname, commit_id,
+                                                            dir_only)
+        def glob_(pattern):
+            path = os.path.dirname(pattern)
+            entries = reader.listdir(path, commit_id) or []
+            return fnmatch.filter([os.path.join(path, name)
+                                   for name, _type in entries], pattern)
         msg = "No such spec file %%s in %s" % commit_id
 
     spec = None
@@ -191,8 +232,11 @@ class PageNotFound(Exception):
 class URLGrabber(object):
     '''grab an url and save to local file'''
 
-    def __init__(self, connect_timeout=30):
+    def __init__(self, connect_timeout=30, abort=None):
         '''create Curl object and set one-time options'''
+        self.response_headers = {}
+        # threading.Event to stop transfers running out of the main thread
+        self.abort = abort
         curl = pycurl.Curl()
         curl.setopt(pycurl.FAILONERROR, True)
         curl.setopt(pycurl.FOLLOWLOCATION, True)
@@ -202,7 +246,8 @@ class URLGrabber(object):
         #curl.setopt(pycurl.VERBOSE, 1)
         self.curl = curl
 
-    def change_url(self, url, outfile, user, passwd, no_cache=False):
+    def change_url(self, url, outfile, user, passwd, no_cache=False,
+                   headers=None):
         '''change options for individual url'''
 
         curl = self.curl
@@ -214,12 +259,24 @@ class URLGrabber(object):
             if passwd:
                 userpwd = '%s:%s' % (user, passwd)
             curl.setopt(pycurl.USERPWD, userpwd)
-        httpheader = []
+        httpheader = list(headers or [])
         if no_cache:
             httpheader.append('Pragma: no-cache')
             httpheader.append('Cache-Control: no-cache')
             log.debug("disable HTTP caching")
-        curl.setopt(pycurl.HTTPHEADER, httpheader)
+        if httpheader:
+            curl.setopt(pycurl.HTTPHEADER, httpheader)
+        else:
+            # empty list doesn't reset headers of previous url
+            curl.unsetopt(pycurl.HTTPHEADER)
+        self.response_headers = {}
+        curl.setopt(pycurl.HEADERFUNCTION, self._store_header)
+
+    def _store_header(self, line):
+        '''collect headers of the last response'''
+        if ':' in line:
+            key, value = line.split(':', 1)
+            self.response_headers[key.strip().lower()] = value.strip()
 
     def perform(self):
         '''do the real Curl perform work'''
@@ -230,6 +287,8 @@ class URLGrabber(object):
         def progressing(*_args):
             '''Returning a non-zero value from this callback will cause libcurl
             to abort the transfer and return CURLE_ABORTED_BY_CALLBACK.'''
+            if self.abort is not None and self.abort.is_set():
+                return -1
             return -1 if stop[0] else 0
 
         def handler(_signum, _frame):
@@ -239,7 +298,11 @@ class URLGrabber(object):
 
         curl.setopt(pycurl.PROGRESSFUNCTION, progressing)
         curl.setopt(pycurl.NOPROGRESS, False)
-        original_handler = signal.signal(signal.SIGINT, handler)
+        # signal handler can only be set in main thread
+        in_main_thread = isinstance(threading.current_thread(),
+                                    threading._MainThread)
+        if in_main_thread:
+            original_handler = signal.signal(signal.SIGINT, handler)
         try:
             curl.perform()
         except pycurl.error as err:
@@ -268,39 +331,137 @@ class URLGrabber(object):
                 raise UrlError('URL error on %s: (%s: "%s")' %
                                (curl.url, errcode, errmsg))
         finally:
-            signal.signal(signal.SIGINT, original_handler)
+            if in_main_thread:
+                signal.signal(signal.SIGINT, original_handler)
 
     def __del__(self):
         """Close curl object."""
         self.curl.close()
         self.curl = None
 
-    def grab(self, url, filename, user=None, passwd=None, no_cache=False):
-        """Grab url to file."""
+    def grab(self, url, filename, user=None, passwd=None, no_cache=False,
+             headers=None):
+        """
+        Grab url to file.
+        Returns: HTTP code of the response.
+        """
 
         log.debug("fetching %s => %s" % (url, filename))
 
         with open(filename, 'w') as outfile:
-            self.change_url(url, outfile, user, passwd, no_cache)
+            self.change_url(url, outfile, user, passwd, no_cache, headers)
             self.perform()
 
+        return self.curl.getinfo(pycurl.HTTP_CODE)
+
+
+def checksum_matches(fname, checksum):
+    """Check if file content matches (type, hexdigest) checksum."""
+    ctype, value = checksum
+    # 'sha' is used as alias of sha1 in old repomd.xml
+    if ctype == 'sha':
+        ctype = 'sha1'
+    try:
+        hashobj = hashlib.new(ctype)
+    except ValueError:
+        log.debug('unknown checksum type: %s' % ctype)
+        return False
+    with open(fname, 'rb') as fobj:
+        while True:
+            data = fobj.read(1024 * 1024)
+            if not data:
+                break
+            hashobj.update(data)
+    return hashobj.hexdigest() == value
+
+
+class RepoMetaCache(FileCache):
+    """
+    Persistent cache of repository metadata, keyed by url.
+
+    Files with checksum listed in repomd.xml, such as primary and build
+    conf, are reused without network access while the checksum matches.
+    Others, such as repomd.xml itself, are revalidated with conditional
+    requests using ETag and Last-Modified of the cached copy.
+    """
+
+    def fetch(self, grabber, url, fname, no_cache=False, checksum=None):
+        """
+        Fetch url to fname through the cache.
+        Returns: fname. Raises PageNotFound if url doesn't exist.
+        """
+        key = str(url)
+        entry = self.get(key)
+        cached = entry.filepath(entry.meta['name']) if entry else None
+        # fname may be a hardlink of cached file, never write through it
+        if os.path.exists(fname):
+            os.unlink(fname)
+
+        if entry and checksum and entry.meta.get('checksum') == \
+                list(checksum):
+            log.debug('repo metadata cache hit: %s' % url)
+            link_or_copy(cached, fname)
+            return fname
+
+        headers = []
+        if entry and not checksum:
+            if entry.meta.get('etag'):
+                headers.append('If-None-Match: %s' % entry.meta['etag'])
+            if entry.meta.get('last_modified'):
+                headers.append('If-Modified-Since: %s' %
+                               entry.meta['last_modified'])
+        try:
+            code = grabber.grab(url, fname, url.user, url.passwd, no_cache,
+                                headers)
+        except UrlError as err:
+            if not entry:
+                raise
+            log.warning('%s, using cached copy' % err)
+            link_or_copy(cached, fname)
+            return fname
+
+        if code == 304 and entry:
+            log.debug('repo metadata not modified: %s' % url)
+            link_or_copy(cached, fname)
+            return fname
+
+        meta = {'name': os.path.basename(fname),
+                'etag': grabber.response_headers.get('etag'),
+                'last_modified': grabber.response_headers.get('last-modified')}
+        if checksum:
+            if not checksum_matches(fname, checksum):
+                log.warning('checksum mismatch of %s, not caching it' % url)
+                return fname
+            meta['checksum'] = list(checksum)
+        self.put(key, [fname], meta)
+        return fname
+
 
 class RepoParser(object):
     """Repository parser for generate real repourl and build config."""
 
-    def __init__(self, repos, cachedir):
+    # max number of concurrent connections used to prefetch metadata
+    PREFETCH_THREADS = 8
+
+    def __init__(self, repos, cachedir, metacache=None):
         self.cachedir = cachedir
+        self.metacache = metacache
         self.repourls = defaultdict(list)
         self.buildconf = None
-        self.primaryxml = None
+        # file name of primary xml of the last standard repo
+        self.primary = None
         self.standardrepos = []
         self.urlgrabber = URLGrabber()
+        # fetched url => file name, or None if url does not exist
+        self._fetched = {}
+        self._local = threading.local()
+        self._abort = threading.Event()
 
         self.localrepos, remotes = self.split_out_local_repo(repos)
         self.parse(remotes)
 
     @staticmethod
-    def _parse_build_xml(build_xml):
+    def _parse_build_xml(build_xml, quiet=False):
         """
         Parse build.xml.
         Returns: dictionary with buildconf, repos and archs.
@@ -311,7 +472,8 @@ class RepoParser(object):
         try:
             etree = ET.parse(build_xml)
         except ET.ParseError:
-            log.warning('Not well formed xml: %s' % build_xml)
+            if not quiet:
+                log.warning('Not well formed xml: %s' % build_xml)
             return
 
         meta = {}
@@ -321,8 +483,10 @@ class RepoParser(object):
         build_version = root.get('version')
         # It's new format of repo structure if 'version' exists
         if build_version:
-            log.warning('new format repo structure has not been supportted '
-                        'well, please upgrade your gbs to latest version')
+            if not quiet:
+                log.warning('new format repo structure has not been '
+                            'supportted well, please upgrade your gbs to '
+                            'latest version')
             return None
 
         buildelem = root.find('buildconf')
@@ -359,20 +523,161 @@ class RepoParser(object):
                 if self.is_standard_repo(repourl):
                     self.repourls[arch].append(repourl)
 
-    def fetch(self, url, no_cache=False):
+    def _get_urlgrabber(self):
+        """Get URLGrabber of current thread, so connections are reused."""
+        if isinstance(threading.current_thread(), threading._MainThread):
+            return self.urlgrabber
+        if not hasattr(self._local, 'urlgrabber'):
+            self._local.urlgrabber = URLGrabber(abort=self._abort)
+        return self._local.urlgrabber
+
+    def fetch(self, url, no_cache=False, checksum=None):
         """
-        Fetch url.
+        Fetch url, through metadata cache if there is. Every url is
+        fetched only once, later calls get the result of the first one.
         Returns: file name if fetch succeds, else None.
         """
-        fname = os.path.join(self.cachedir, os.path.basename(url))
+        key = str(url)
+        if key in self._fetched:
+            return self._fetched[key]
 
+        # different repos have files with same names, such as repomd.xml
+        fdir = os.path.join(self.cachedir,
+                            hashlib.sha1(os.path.dirname(key)).hexdigest())
+        try:
+            os.makedirs(fdir)
+        except OSError:
+            # may be created by other thread already
+            if not os.path.isdir(fdir):
+                raise
+        fname = os.path.join(fdir, os.path.basename(url))
+
+        urlgrabber = self._get_urlgrabber()
         try:
-            self.urlgrabber.grab(url, fname, url.user, url.passwd, no_cache)
+            if self.metacache:
+                fname = self.metacache.fetch(urlgrabber, url, fname,
+                                             no_cache, checksum)
+            else:
+                urlgrabber.grab(url, fname, url.user, url.passwd, no_cache)
         except PageNotFound:
-            return
+            fname = None
 
+        self._fetched[key] = fname
         return fname
 
+    def _prefetch(self, urls):
+        """
+        Fetch urls concurrently. Errors are ignored here, urls failed
+        are fetched again by the sequential parsing which reports them.
+        """
+        todo = []
+        seen = set(self._fetched)
+        for url, checksum in urls:
+            if str(url) not in seen:
+                seen.add(str(url))
+                todo.append((url, checksum))
+        if not todo:
+            return
+
+        def fetch_one(item):
+            """Fetch one url in worker thread."""
+            url, checksum = item
+            try:
+                # repomd.xml is always fetched with no_cache in parse()
+                self.fetch(url, url.endswith('repodata/repomd.xml'), checksum)
+            except (UrlError, KeyboardInterrupt, IOError, OSError) as err:
+                log.debug('prefetching %s failed: %s' % (url, err))
+
+        pool = ThreadPool(min(self.PREFETCH_THREADS, len(todo)))
+        try:
+            # wait with timeout, so that KeyboardInterrupt can be caught
+            pool.map_async(fetch_one, todo).get(0xFFFF)
+        except KeyboardInterrupt:
+            self._abort.set()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+
+    def _repomd_locations(self, repo):
+        """
+        Get locations of build conf and primary from prefetched repomd.xml.
+        Returns: dict of data type => (url, checksum).
+        """
+        repomd_file = self._fetched.get(str(repo.pathjoin(
+            'repodata/repomd.xml')))
+        if not repomd_file:
+            return {}
+        try:
+            root = ET.parse(repomd_file).getroot()
+        except ET.ParseError:
+            return {}
+        xmlns = re.sub('repomd$', '', root.tag)
+        locations = {}
+        for datatype in ('build', 'primary'):
+            href, checksum = self._get_repomd_location(root, xmlns, datatype)
+            if href:
+                locations[datatype] = (repo.pathjoin(href), checksum)
+        return locations
+
+    def _fetched_build_meta(self, url):
+        """Parse prefetched builddata/build.xml under url."""
+        build_xml = self._fetched.get(str(url.pathjoin('builddata/build.xml')))
+        if build_xml:
+            return self._parse_build_xml(build_xml, quiet=True)
+
+    def prefetch(self, remotes):
+        """
+        Concurrently fetch metadata which parse() is going to use, in
+        three rounds: repomd.xml of all repos, then files referenced by
+        repomd.xml and build.xml, then repos and build conf listed in
+        build.xml.
+        """
+        self._prefetch([(repo.pathjoin('repodata/repomd.xml'), None)
+                        for repo in remotes])
+
+        urls = []
+        for repo in remotes:
+            if self._fetched.get(str(repo.pathjoin('repodata/repomd.xml'))):
+                locations = self._repomd_locations(repo)
+                urls.extend(locations.values())
+                # build.xml is only needed if no build conf in repomd.xml
+                latest_repo_url = repo.pathjoin('../../../../')
+                if 'build' not in locations and \
+                        latest_repo_url.find('../') < 0:
+                    urls.append((latest_repo_url.pathjoin(
+                        'builddata/build.xml'), None))
+            else:
+                urls.append((repo.pathjoin('builddata/build.xml'), None))
+        self._prefetch(urls)
+
+        urls = []
+        for repo in remotes:
+            if self._fetched.get(str(repo.pathjoin('repodata/repomd.xml'))):
+                latest_repo_url = repo.pathjoin('../../../../')
+                if latest_repo_url.find('../') >= 0:
+                    continue
+                meta = self._fetched_build_meta(latest_repo_url)
+                if meta and meta.get('buildconf'):
+                    urls.append((latest_repo_url.pathjoin(
+                        'builddata/%s' % meta['buildconf']), None))
+                continue
+
+            meta = self._fetched_build_meta(repo)
+            if not meta:
+                urls.append((repo.pathjoin('build.xml'), None))
+                continue
+            for arch in meta.get('archs', []):
+                for name in meta.get('repos', []):
+                    urls.append((repo.pathjoin(
+                        'repos/%s/%s/packages/repodata/repomd.xml' % (name,
+                                                                      arch)),
+                                 None))
+            if meta.get('buildconf'):
+                urls.append((repo.pathjoin('builddata/%s' %
+                                           meta['buildconf']), None))
+        self._prefetch(urls)
+
     def is_standard_repo(self, repo):
         """Check if repo is standard repo with repodata/repomd.xml exist."""
 
@@ -406,7 +711,8 @@ class RepoParser(object):
             release = release.replace('-', '')
             target_conf = os.path.join(os.path.dirname(fname),
                                        '%s.conf' % release)
-            os.rename(fname, target_conf)
+            # copy, as fetched file may be returned again by fetch()
+            shutil.copy(fname, target_conf)
             self.buildconf = target_conf
 
     def _fetch_build_conf_new(self, baseurl):
@@ -425,14 +731,10 @@ class RepoParser(object):
 
         # get namespace of repomd element
         xmlns = re.sub('repomd$', '', root.tag)
-        location_elem = None
-        for elem in root.findall('%sdata' % xmlns):
-            if elem.attrib['type'] == 'build':
-                location_elem = elem.find('%slocation' % xmlns)
-                break
-        if location_elem is not None and 'href' in location_elem.attrib:
-            buildconf_url = baseurl.pathjoin(location_elem.attrib['href'])
-            fname = self.fetch(buildconf_url)
+        href, checksum = self._get_repomd_location(root, xmlns, 'build')
+        if href:
+            buildconf_url = baseurl.pathjoin(href)
+            fname = self.fetch(buildconf_url, checksum=checksum)
             if fname:
                 if fname[-3:] == '.gz':
                     fh_gz = gzip.open(fname, 'r')
@@ -445,20 +747,32 @@ class RepoParser(object):
                 fh_gz.close()
                 buildconf_fh.close()
                 self.buildconf = buildconf_file
+        href, checksum = self._get_repomd_location(root, xmlns, 'primary')
+        if href:
+            primary_url = baseurl.pathjoin(href)
+            fname = self.fetch(primary_url, checksum=checksum)
+            if fname:
+                self.primary = fname
+
+    @staticmethod
+    def _get_repomd_location(root, xmlns, datatype):
+        """
+        Get location and checksum of given data type from repomd.xml root.
+        Returns: (href, (checksum type, checksum)), or (None, None).
+        """
         for elem in root.findall('%sdata' % xmlns):
-            if elem.attrib['type'] == 'primary':
-                location_elem = elem.find('%slocation' % xmlns)
+            if elem.attrib['type'] != datatype:
+                continue
+            location_elem = elem.find('%slocation' % xmlns)
+            if location_elem is None or 'href' not in location_elem.attrib:
                 break
-        if location_elem is not None and 'href' in location_elem.attrib:
-            primary_url = baseurl.pathjoin(location_elem.attrib['href'])
-            fname = self.fetch(primary_url)
-            if fname:
-                if fname[-3:] == '.gz':
-                    fh_gz = gzip.open(fname, 'r')
-                else:
-                    fh_gz = open(fname, 'r')
-                self.primaryxml = fh_gz.read()
-                fh_gz.close()
+            checksum = None
+            checksum_elem = elem.find('%schecksum' % xmlns)
+            if checksum_elem is not None and checksum_elem.text:
+                checksum = (checksum_elem.attrib.get('type', 'sha256'),
+                            checksum_elem.text.strip())
+            return location_elem.attrib['href'], checksum
+        return None, None
 
     def parse(self, remotes):
         """Parse each remote repo, try to fetch build.xml and build.conf"""
@@ -492,6 +806,10 @@ class RepoParser(object):
                                    'and please specify real RPM repo with '\
                                    'repodata under it.')
 
+        # network access is done here concurrently, the sequential
+        # processing below gets fetched files from memory, which keeps
+        # the selection order of repourls and buildconf
+        self.prefetch(remotes)
         for repo in remotes:
             deal_with_one_repo(repo)
 
@@ -538,31 +856,74 @@ class RepoParser(object):
 class GitRefMappingParser(object):
     """git-ref-mapping parser for get reference binary id."""
 
+    # don't fetch git-ref-mapping again within this many seconds
+    SYNC_TTL = 60 * 60
+
     def __init__(self, giturl='https://git.tizen.org/cgit/scm/git-ref-mapping'):
         self._giturl = giturl
+        self.workdir = os.path.expanduser('~/.ref-gbs/git-ref-mapping/')
+        self.refxml = os.path.join(self.workdir, 'git-ref-mapping.xml')
+        self._stamp = os.path.join(self.workdir, '.git', 'gbs-last-sync')
 
-    def parse(self):
-        cmd = []
-        workdir = os.path.expanduser('~/.ref-gbs/git-ref-mapping/')
-        refxml = os.path.expanduser('~/.ref-gbs/git-ref-mapping/git-ref-mapping.xml')
-        if os.path.exists(refxml):
-            cmd = ['git', 'pull']
-        else:
-            if not os.path.exists(workdir):
-                    os.makedirs(workdir)
-
-            cmd = ['git', 'clone', self._giturl, workdir]
+    def _git(self, args):
+        """Run git command in workdir, return its exit code and output."""
+        cmd = ['git'] + args
         try:
-            with Workdir(workdir):
-                output = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-                output.wait()
+            proc = subprocess.Popen(cmd, cwd=self.workdir,
+                                    stdout=subprocess.PIPE)
+            output = proc.communicate()[0]
         except (subprocess.CalledProcessError, OSError):
-            raise GbsError("failed to run %s in %s" % (' '.join(cmd), workdir))
+            raise GbsError("failed to run %s in %s" % (' '.join(cmd),
+                                                       self.workdir))
+        if proc.returncode != 0:
+            log.warning("failed to run %s in %s" % (' '.join(cmd),
+                                                    self.workdir))
+        return proc.returncode, output
+
+    def sync(self, offline=False, ttl=SYNC_TTL):
+        """
+        Shallow fetch latest git-ref-mapping, unless it has been fetched
+        within ttl seconds or offline is set.
+        """
+        if os.path.exists(self.refxml):
+            if offline:
+                return
+            try:
+                if time.time() - os.path.getmtime(self._stamp) < ttl:
+                    return
+            except OSError:
+                pass
+            synced = (self._git(['fetch', '--depth', '1', 'origin',
+                                 'HEAD'])[0] == 0 and
+                      self._git(['reset', '--hard', 'FETCH_HEAD'])[0] == 0)
+        elif offline:
+            raise GbsError('git-ref-mapping is not available in offline '
+                           'mode, please run once without --offline')
+        else:
+            if not os.path.exists(self.workdir):
+                os.makedirs(self.workdir)
+            synced = self._git(['clone', '--depth', '1', self._giturl,
+                                self.workdir])[0] == 0
+
+        # only successful sync suppresses fetching again within ttl
+        if synced and os.path.exists(os.path.dirname(self._stamp)):
+            open(self._stamp, 'w').close()
+
+    def head(self):
+        """Get commit id of local git-ref-mapping."""
+        if not os.path.exists(self.refxml):
+            return None
+        return self._git(['rev-parse', 'HEAD'])[1].strip()
 
+    def parse(self):
+        """
+        Parse local git-ref-mapping, call sync first to update it.
+        Returns: dict of OBS project to reference project id.
+        """
         try:
-            etree = ET.parse(refxml)
-        except ET.ParseError:
-            log.warning('Not well formed xml: %s' % refxml)
+            etree = ET.parse(self.refxml)
+        except (ET.ParseError, IOError):
+            log.warning('Not well formed xml: %s' % self.refxml)
             return
 
         root = etree.getroot()
@@ -580,6 +941,17 @@ class GitRefMappingParser(object):
         return meta
 
 class GitDirFinder(object):
+    """
+    Find git projects and their packaging specs under a directory.
+
+    Projects are read from .repo/project.list if the directory is in a
+    repo checkout, otherwise the tree is walked in parallel without
+    descending into git projects.
+    """
+
+    # number of directories to scan at the same time
+    WALK_THREADS = 8
+
     def __init__(self, dir=None):
         self.paths = []
         self.specs = []
@@ -587,89 +959,300 @@ class GitDirFinder(object):
             self.find(dir)
 
     def find(self, dir):
-        if os.path.isdir(os.path.join(dir, '.git')):
-                self.paths.append(dir)
-                f = glob.glob('%s/packaging/*.spec' % dir)
-                self.specs.extend(f)
-                return
+        paths = self.find_in_project_list(dir)
+        if paths is None:
+            paths = self.walk(dir)
+        for path in paths:
+            self.paths.append(path)
+            self.specs.extend(sorted(glob.glob('%s/packaging/*.spec' % path)))
+
+    @staticmethod
+    def find_in_project_list(dir):
+        """
+        Get git projects under dir from .repo/project.list of the repo
+        checkout dir belongs to.
+        Returns: list of project paths, or None if it's not a repo checkout.
+        """
+        dir = os.path.abspath(dir)
+        top = dir
+        while not os.path.isfile(os.path.join(top, '.repo', 'project.list')):
+            if os.path.dirname(top) == top:
+                return None
+            top = os.path.dirname(top)
+
+        paths = []
+        with open(os.path.join(top, '.repo', 'project.list')) as fobj:
+            for line in fobj:
+                path = os.path.join(top, line.strip())
+                if not line.strip() or not (path == dir or
+                                            path.startswith(dir + os.sep)):
+                    continue
+                if os.path.isdir(os.path.join(path, '.git')):
+                    paths.append(path)
+        return paths
+
+    @staticmethod
+    def _scan(dir):
+        """
+        Scan one directory.
+        Returns: (True, []) if dir is a git project, else (False, subdirs).
+        """
+        subdirs = []
+        try:
+            if scandir:
+                for entry in scandir(dir):
+                    if entry.is_dir():
+                        if entry.name == '.git':
+                            return True, []
+                        subdirs.append(entry.path)
+            else:
+                for name in os.listdir(dir):
+                    path = os.path.join(dir, name)
+                    if os.path.isdir(path):
+                        if name == '.git':
+                            return True, []
+                        subdirs.append(path)
+        except OSError as err:
+            log.debug('failed to scan %s: %s' % (dir, err))
+        return False, subdirs
+
+    def walk(self, dir):
+        """Find git projects under dir level by level."""
+        paths = []
+        level = [dir]
+        pool = ThreadPool(self.WALK_THREADS)
+        try:
+            while level:
+                results = pool.map_async(self._scan, level).get(0xFFFF)
+                next_level = []
+                for path, (is_git, subdirs) in zip(level, results):
+                    if is_git:
+                        paths.append(path)
+                    else:
+                        next_level.extend(subdirs)
+                level = next_level
+        finally:
+            pool.terminate()
+        return sorted(paths)
+
+def open_xml(fname):
+    """Open xml file which may be gzipped."""
+    if fname.endswith('.gz'):
+        return gzip.open(fname, 'rb')
+    return open(fname, 'rb')
+
+def iter_xml_elements(fname, tag):
+    """
+    Iterate elements with given local tag name in xml file by streaming
+    parse. Elements are cleared after being consumed, so memory usage
+    doesn't depend on file size.
+    """
+    with open_xml(fname) as fobj:
+        context = cET.iterparse(fobj, events=('start', 'end'))
+        _event, root = next(context)
+        for event, elem in context:
+            if event == 'end' and re.sub(r'^{.*}', '', elem.tag) == tag:
+                yield elem
+                root.clear()
 
-        files = os.listdir(dir)
-        for file in files:
-            d = os.path.join(dir, file)
-            git_d = os.path.join(d, '.git')
-            if os.path.isdir(d):
-                if os.path.isdir(git_d):
-                    self.paths.append(d)
-                    f = glob.glob('%s/packaging/*.spec' % d)
-                    self.specs.extend(f)
-                else:
-                    self.find(d)
 
 class GerritNameMapper(object):
-    def __init__(self, pkgxml, primaryxml):
-        self._pkg2src = {}
-        self._pkg2subpkgs = {}
-        self._src2gerrit = {}
-        self._src2pkg = {}
-        self.parse_pkgxml(pkgxml)
-        self.parse_primaryxml(primaryxml)
+    """
+    Map obs package names to source names and gerrit paths.
 
-    def parse_pkgxml(self, pkgxml):
+    The mapping is parsed from pkgs xml (revpkgdepends.xml) and primary
+    xml into a sqlite index, which is stored in cache keyed by checksums
+    of both files, then queried lazily.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE pkg2src (pkg TEXT PRIMARY KEY, src TEXT)',
+        'CREATE TABLE src2pkg (src TEXT PRIMARY KEY, pkg TEXT)',
+        'CREATE TABLE pkg2subpkg (pkg TEXT PRIMARY KEY, subpkg TEXT)',
+        'CREATE TABLE src2gerrit (src TEXT PRIMARY KEY, gerrit TEXT)',
+        ]
+
+    def __init__(self, pkgxml, primaryxml, cache=None):
+        """
+        pkgxml and primaryxml are file names of pkgs xml and primary xml,
+        primaryxml may be gzipped. cache is a FileCache to store index.
+        """
+        self._tmpdir = None
+        key = None
+        if cache is not None:
+            key = ('gerritnames', self.checksum(pkgxml),
+                   self.checksum(primaryxml))
+            entry = cache.get(key)
+            if entry and 'index.db' in entry.files():
+                self._connect(entry.filepath('index.db'))
+                return
+
+        self._tmpdir = tempfile.mkdtemp(prefix='gbs-gerritnames-')
+        dbfile = os.path.join(self._tmpdir, 'index.db')
+        self._connect(dbfile)
+        for sql in self.SCHEMA:
+            self._db.execute(sql)
+        complete = self.parse_pkgxml(pkgxml)
+        complete = self.parse_primaryxml(primaryxml) and complete
+        if cache is not None and complete:
+            cache.put(key, [dbfile])
+
+    def _connect(self, dbfile):
+        """Open index database."""
+        self._db = sqlite3.connect(dbfile)
+        self._db.text_factory = str
+
+    def __del__(self):
+        if getattr(self, '_tmpdir', None):
+            self._db.close()
+            shutil.rmtree(self._tmpdir, True)
+
+    @staticmethod
+    def checksum(fname):
+        """Get sha1 of file content, None if file doesn't exist."""
+        if not fname or not os.path.exists(fname):
+            return None
+        sha1 = hashlib.sha1()
+        with open(fname, 'rb') as fobj:
+            for data in iter(lambda: fobj.read(1024 * 1024), b''):
+                sha1.update(data)
+        return sha1.hexdigest()
+
+    def _parse(self, fname, name, handler):
+        """Fill index from fname by handler, return True on success."""
+        if not fname:
+            log.warning('No %s available' % name)
+            return False
         try:
-            root = ET.fromstring(pkgxml)
-        except ET.ParseError:
-            log.warning('Not well formed xml pkgxml')
-            return
+            handler(fname)
+        except (SyntaxError, IOError) as err:
+            log.warning('Not well formed xml %s: %s' % (name, err))
+            self._db.rollback()
+            return False
+        self._db.commit()
+        return True
 
-        lst_node = root.getiterator("package")
-        for node in lst_node:
-            if node.attrib.has_key("name"):
-                for child in node.getchildren():
+    def parse_pkgxml(self, pkgxml):
+        """Index source and first binary subpackage of each package."""
+        def insert(fname):
+            for node in iter_xml_elements(fname, 'package'):
+                if 'name' not in node.attrib:
+                    continue
+                name = node.attrib['name']
+                for child in node:
                     if child.tag == 'source':
-                        self._pkg2src[node.attrib['name']] = child.text
-                        self._src2pkg[child.text] = node.attrib['name']
+                        self._db.execute('INSERT OR REPLACE INTO pkg2src '
+                                         'VALUES (?, ?)', (name, child.text))
+                        self._db.execute('INSERT OR REPLACE INTO src2pkg '
+                                         'VALUES (?, ?)', (child.text, name))
                     if child.tag == 'subpkg':
-                        if child.text.endswith('debugsource') or child.text.endswith('debuginfo'):
+                        if child.text.endswith('debugsource') or \
+                           child.text.endswith('debuginfo'):
                             continue
 
-                        self._pkg2subpkgs[node.attrib['name']] = child.text
+                        self._db.execute('INSERT OR REPLACE INTO pkg2subpkg '
+                                         'VALUES (?, ?)', (name, child.text))
                         break
+        return self._parse(pkgxml, 'pkgxml', insert)
 
     def parse_primaryxml(self, primaryxml):
-        try:
-            root = ET.fromstring(primaryxml)
-        except ET.ParseError:
-            log.warning('Not well formed xml primaryxml')
-            return
-
-        xmlns = re.sub('metadata$', '', root.tag)
-        for elem in root.findall('%spackage' % xmlns):
-            name = elem.find('%sname' % xmlns).text
-            vcs = elem.find('%sversion' % xmlns).attrib['vcs']
-            self._src2gerrit[name] = vcs[:vcs.index('#')]
+        """Index gerrit path of each source package."""
+        def insert(fname):
+            for elem in iter_xml_elements(fname, 'package'):
+                xmlns = re.sub('package$', '', elem.tag)
+                name = elem.findtext('%sname' % xmlns)
+                version = elem.find('%sversion' % xmlns)
+                vcs = version is not None and version.attrib.get('vcs')
+                if name and vcs:
+                    self._db.execute('INSERT OR REPLACE INTO src2gerrit '
+                                     'VALUES (?, ?)', (name, vcs.split('#')[0]))
+        return self._parse(primaryxml, 'primaryxml', insert)
+
+    def _query(self, table, column, key, value):
+        """Look up value by key in table."""
+        if value is None:
+            return None
+        row = self._db.execute('SELECT %s FROM %s WHERE %s = ?' %
+                               (column, table, key), (value,)).fetchone()
+        return row[0] if row else None
 
     def get_gerritname_by_obsname(self, obsname):
-        src = self._pkg2src.get(obsname)
+        src = self._query('pkg2src', 'src', 'pkg', obsname)
         if src == None:
             return None
 
-        name = self._src2gerrit.get(src)
+        name = self._query('src2gerrit', 'gerrit', 'src', src)
         if name == None:
-            src = self._pkg2subpkgs.get(obsname)
-            name = self._src2gerrit.get(src)
+            src = self._query('pkg2subpkg', 'subpkg', 'pkg', obsname)
+            name = self._query('src2gerrit', 'gerrit', 'src', src)
 
         return name
 
     def get_gerritname_by_srcname(self, srcname):
-        name = self._src2gerrit.get(srcname)
+        name = self._query('src2gerrit', 'gerrit', 'src', srcname)
         if name == None:
-            pkg = self._src2pkg.get(srcname)
+            pkg = self._query('src2pkg', 'pkg', 'src', srcname)
             name = self.get_gerritname_by_obsname(pkg)
 
         return name
 
     def get_pkgname_by_srcname(self, srcname):
-        return self._src2pkg.get(srcname)
+        return self._query('src2pkg', 'pkg', 'src', srcname)
+
+class PkgDependsGraph(object):
+    """
+    Reverse dependency graph of obs packages, built from builddepinfo xml.
+    In revpkgdepends.xml, which gbs.conf.auto points pkgs to, 'pkgdep' of
+    a package lists packages depending on it. In pkgdepends.xml, which
+    bsr reads, it lists packages the package depends on, reverse is False
+    for it. Sub packages are mapped to their main packages.
+    """
+
+    def __init__(self, pkgxml, reverse=True):
+        self._rdeps = {}
+        pkgdeps = {}
+        sub2main = {}
+        try:
+            for node in iter_xml_elements(pkgxml, 'package'):
+                name = node.attrib.get('name')
+                if name is None:
+                    continue
+                pkgdeps[name] = []
+                for child in node:
+                    if child.tag == 'pkgdep':
+                        pkgdeps[name].append(child.text)
+                    elif child.tag == 'subpkg':
+                        sub2main[child.text] = name
+        except (SyntaxError, IOError) as err:
+            log.warning('Not well formed xml pkgxml: %s' % err)
+            return
+
+        # main package names take precedence over sub package names
+        sub2main.update((name, name) for name in pkgdeps)
+        self._rdeps = dict((name, set()) for name in pkgdeps)
+        for name, deps in pkgdeps.iteritems():
+            for dep in deps:
+                if dep not in sub2main:
+                    continue
+                if reverse:
+                    self._rdeps[name].add(sub2main[dep])
+                else:
+                    self._rdeps[sub2main[dep]].add(name)
+
+    def __contains__(self, pkg):
+        return pkg in self._rdeps
+
+    def get_reverse_depends(self, pkg):
+        """Get all packages depending on pkg directly or indirectly."""
+        found = set()
+        todo = [pkg]
+        while todo:
+            for dep in self._rdeps.get(todo.pop(), ()):
+                if dep not in found:
+                    found.add(dep)
+                    todo.append(dep)
+        found.discard(pkg)
+        return found
 
 def read_localconf(workdir):
     """Read local configuration file from project directory."""
@@ -700,6 +1283,66 @@ class SearchConfAction(argparse.Action):
         read_localconf(workdir)
         setattr(namespace, self.dest, value)
 
+_WORKTREE_STATUS = {}
+_WORKTREE_STATUS_LOCK = threading.Lock()
+
+def parse_status_v2(output):
+    """
+    Parse output of 'git status --porcelain=v2 -z'.
+    Returns: dict of status flag: list of paths, flags and paths are in the
+    same format as gbp's GitRepository.status() gives.
+    """
+    result = defaultdict(list)
+    elements = output.split('\0')
+    while elements:
+        element = elements.pop(0)
+        if not element:
+            continue
+        if element.startswith('? '):
+            result['??'].append(element[2:])
+        elif element.startswith('! '):
+            result['!!'].append(element[2:])
+        elif element[0] in '12u':
+            # ordinary, renamed/copied and unmerged entries differ in number
+            # of fields before path
+            fields = element.split(' ', {'1': 8, '2': 9, 'u': 10}[element[0]])
+            flag = fields[1].replace('.', ' ')
+            path = fields[-1]
+            if element[0] == '2':
+                # original path follows, like 'old\0new' of gbp
+                path = elements.pop(0) + '\0' + path
+            result[flag].append(path)
+    return result
+
+
+def worktree_status(git_path, refresh=False):
+    """
+    Get status of working tree of git repository at git_path, with one
+    'git status' scan, using untracked cache and fsmonitor if configured.
+    Result is memoized for the process, refresh forces a new scan.
+    Returns: dict of status flag: list of paths, empty if tree is clean.
+    """
+    git_path = os.path.abspath(git_path)
+    with _WORKTREE_STATUS_LOCK:
+        if git_path in _WORKTREE_STATUS and not refresh:
+            return _WORKTREE_STATUS[git_path]
+
+    env = dict(os.environ, LC_ALL='C')
+    proc = subprocess.Popen(['git', 'status', '--porcelain=v2', '-z'],
+                            cwd=git_path, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    out, _err = proc.communicate()
+    if proc.returncode == 0:
+        status = parse_status_v2(out)
+    else:
+        # git older than 2.11 doesn't support porcelain v2
+        status = RpmGitRepository(git_path).status()
+
+    with _WORKTREE_STATUS_LOCK:
+        _WORKTREE_STATUS[git_path] = status
+    return status
+
+
 def git_status_checker(git, opts):
     """
     Perform git repository status check.
@@ -708,17 +1351,19 @@ def git_status_checker(git, opts):
     try:
         if opts.commit:
             git.rev_parse(opts.commit)
-        is_clean = git.is_clean()[0]
-        status = git.status()
+        status = worktree_status(git.path)
     except (GbpError, GitRepositoryError) as err:
         raise GbsError(str(err))
+    is_clean = not status
 
-    untracked_files = status['??']
+    untracked_files = status.get('??', [])
     uncommitted_files = []
     for stat in status:
         if stat == '??':
             continue
-        uncommitted_files.extend(status[stat])
+        # renames are 'old\0new', show them like 'git status --porcelain'
+        uncommitted_files.extend(path.replace('\0', ' -> ')
+                                 for path in status[stat])
 
     if not is_clean and not opts.include_all:
         if untracked_files:
@@ -748,14 +1393,295 @@ def hexdigest(fhandle, block_size=4096):
     return md5obj.hexdigest()
 
 
+def file_md5(path):
+    """Calculate md5 of file at path, reading it through mmap."""
+    md5obj = hashlib.new('md5')
+    with open(path, 'rb') as fobj:
+        if os.fstat(fobj.fileno()).st_size:
+            mapped = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                md5obj.update(mapped)
+            finally:
+                mapped.close()
+    return md5obj.hexdigest()
+
+
+class DigestCache(object):
+    """
+    md5 digests of local files, saved to a json file. Files are identified
+    by device, inode, size and mtime instead of path, so hardlinks of a
+    hashed file, like tarballs restored from the export cache into a new
+    export dir, are not hashed again.
+    """
+
+    # number of files to hash at the same time, hashlib releases the GIL
+    HASH_THREADS = 4
+    # number of most recently used digests to keep
+    MAX_ENTRIES = 4096
+    # digests of files modified so many seconds before hashing them are
+    # not kept, a change in the same time could keep size and mtime
+    RACY_SECONDS = 2
+
+    def __init__(self, cachefile='~/.cache/gbs/digests.json'):
+        self.cachefile = os.path.expanduser(cachefile) if cachefile else None
+        self.digests = {}
+        self.changed = False
+        self._lock = threading.Lock()
+        if self.cachefile:
+            try:
+                with open(self.cachefile) as fobj:
+                    self.digests = json.load(fobj)
+            except (IOError, ValueError):
+                pass
+
+    @staticmethod
+    def file_key(path):
+        """
+        Get identity of file content at path.
+        Returns: (key, mtime in seconds).
+        """
+        stat = os.stat(path)
+        # python 2 has no st_mtime_ns, its float mtime is as precise as
+        # double allows
+        mtime_ns = getattr(stat, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(round(stat.st_mtime * 1000000000))
+        return '%d:%d:%d:%d' % (stat.st_dev, stat.st_ino, stat.st_size,
+                                mtime_ns), stat.st_mtime
+
+    def md5(self, path):
+        """Get md5 of file at path, from cache if it's not changed."""
+        start = time.time()
+        key, mtime = self.file_key(path)
+        with self._lock:
+            entry = self.digests.get(key)
+            if entry:
+                entry['used'] = time.time()
+                self.changed = True
+                return entry['md5']
+
+        digest = file_md5(path)
+        if mtime < start - self.RACY_SECONDS:
+            with self._lock:
+                self.digests[key] = {'md5': digest, 'used': time.time()}
+                self.changed = True
+        return digest
+
+    def md5_many(self, paths):
+        """
+        Get md5 of files at paths, several files are hashed at once.
+        Returns: dict of path: md5.
+        """
+        threads = ThreadPool(min(len(paths), self.HASH_THREADS) or 1)
+        try:
+            digests = threads.map_async(self.md5, paths).get(0xFFFF)
+        finally:
+            threads.terminate()
+        return dict(zip(paths, digests))
+
+    def save(self):
+        """Save most recently used digests to the cache file."""
+        if not self.cachefile or not self.changed:
+            return
+        with self._lock:
+            keys = sorted(self.digests, key=lambda key:
+                          self.digests[key]['used'])[-self.MAX_ENTRIES:]
+            digests = dict((key, self.digests[key]) for key in keys)
+        try:
+            dirname = os.path.dirname(self.cachefile)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            fdesc, tmpfile = tempfile.mkstemp(prefix='.digests-', dir=dirname)
+            with os.fdopen(fdesc, 'w') as fobj:
+                json.dump(digests, fobj)
+            os.rename(tmpfile, self.cachefile)
+        except (IOError, OSError) as err:
+            log.debug('failed to save digest cache %s: %s' %
+                      (self.cachefile, err))
+            return
+        self.changed = False
+
+
+class GitCatFile(object):
+    """
+    Read objects of a git repository through long-lived
+    'git cat-file --batch' and '--batch-check' processes, instead of running
+    git for each file. Parsed tree objects are kept in a LRU cache.
+    """
+
+    # max number of parsed trees to keep
+    TREE_CACHE_SIZE = 256
+
+    def __init__(self, git_path):
+        self.git_path = os.path.abspath(git_path)
+        self._procs = {}
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _start(self, mode):
+        """Start cat-file process of mode if it's not running."""
+        if mode not in self._procs:
+            try:
+                self._procs[mode] = subprocess.Popen(
+                    ['git', 'cat-file', mode], cwd=self.git_path,
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            except OSError as err:
+                raise GbsError('failed to run git cat-file in %s: %s' %
+                               (self.git_path, str(err)))
+        return self._procs[mode]
+
+    def _request(self, mode, obj):
+        """
+        Send obj to cat-file process of mode.
+        Returns: (process, [sha, type, size]), fields is None if obj doesn't
+        exist.
+        """
+        proc = self._start(mode)
+        proc.stdin.write(obj + '\n')
+        proc.stdin.flush()
+        header = proc.stdout.readline()
+        if not header:
+            self._stop()
+            raise GbsError('git cat-file in %s exited unexpectedly' %
+                           self.git_path)
+        fields = header.split()
+        if len(fields) != 3:
+            # '<obj> missing' or '<obj> ambiguous'
+            return proc, None
+        return proc, fields
+
+    def info(self, obj):
+        """
+        Get sha and type of git object without reading it.
+        Returns: (sha, type), or (None, None) if obj doesn't exist.
+        """
+        if '\n' in obj:
+            return None, None
+        with self._lock:
+            fields = self._request('--batch-check', obj)[1]
+        if fields is None:
+            return None, None
+        return fields[0], fields[1]
+
+    def read(self, obj):
+        """
+        Read git object, obj can be any name like 'HEAD:packaging/a.spec'.
+        Returns: (type, content), or (None, None) if obj doesn't exist.
+        """
+        if '\n' in obj:
+            return None, None
+        with self._lock:
+            proc, fields = self._request('--batch', obj)
+            if fields is None:
+                return None, None
+            content = proc.stdout.read(int(fields[2]))
+            # skip trailing newline
+            proc.stdout.read(1)
+        return fields[1], content
+
+    def show(self, relative_path, commit_id):
+        """Get content of a file in given revision, None if not found."""
+        objtype, content = self.read('%s:%s' % (commit_id, relative_path))
+        if objtype != 'blob':
+            return None
+        return content
+
+    def exists(self, relative_path, commit_id, dir_only=False):
+        """Check if path exists in given revision."""
+        objtype = self.info('%s:%s' % (commit_id, relative_path))[1]
+        if dir_only:
+            return objtype == 'tree'
+        return objtype is not None
+
+    def listdir(self, relative_path, commit_id):
+        """
+        List entries of a directory in given revision.
+        Returns: list of (name, objtype) in git order, None if path is not a
+        directory.
+        """
+        sha, objtype = self.info('%s:%s' % (commit_id,
+                                            relative_path.rstrip('/')))
+        if objtype != 'tree':
+            return None
+        with self._lock:
+            if sha in self._trees:
+                entries = self._trees.pop(sha)
+                self._trees[sha] = entries
+                return list(entries)
+
+        content = self.read(sha)[1]
+        entries = []
+        pos = 0
+        while pos < len(content):
+            space = content.index(' ', pos)
+            nul = content.index('\0', space)
+            mode = content[pos:space]
+            if mode == '40000':
+                entry_type = 'tree'
+            elif mode == '160000':
+                entry_type = 'commit'
+            else:
+                entry_type = 'blob'
+            entries.append((content[space + 1:nul], entry_type))
+            # binary object id follows the name
+            pos = nul + 1 + len(sha) / 2
+
+        with self._lock:
+            self._trees[sha] = entries
+            while len(self._trees) > self.TREE_CACHE_SIZE:
+                self._trees.popitem(last=False)
+        return list(entries)
+
+    def _stop(self):
+        """Stop cat-file processes, caller must hold the lock."""
+        for proc in self._procs.values():
+            try:
+                proc.stdin.close()
+                proc.wait()
+            except (IOError, OSError):
+                pass
+        self._procs = {}
+
+    def close(self):
+        """Stop cat-file processes."""
+        with self._lock:
+            self._stop()
+
+    def __del__(self):
+        self.close()
+
+
+_GIT_READERS = OrderedDict()
+_GIT_READERS_LOCK = threading.Lock()
+# max number of repositories to keep cat-file processes for
+GIT_READERS_SIZE = 8
+
+def get_git_reader(git_path):
+    """Get shared GitCatFile of git repository at git_path."""
+    git_path = os.path.abspath(git_path)
+    with _GIT_READERS_LOCK:
+        reader = _GIT_READERS.pop(git_path, None) or GitCatFile(git_path)
+        _GIT_READERS[git_path] = reader
+        # evicted reader may still be used by other threads, it's closed
+        # when the last reference to it is dropped
+        while len(_GIT_READERS) > GIT_READERS_SIZE:
+            _GIT_READERS.popitem(last=False)
+    return reader
+
+def close_git_readers():
+    """Stop cat-file processes of all shared readers."""
+    with _GIT_READERS_LOCK:
+        while _GIT_READERS:
+            _GIT_READERS.popitem()[1].close()
+
+atexit.register(close_git_readers)
+
+
 def show_file_from_rev(git_path, relative_path, commit_id):
     """Get a single file content from given git revision."""
-    args = ['git', 'show', '%s:%s' % (commit_id, relative_path)]
     try:
-        with Workdir(git_path):
-            return  subprocess.Popen(args,
-                                     stdout=subprocess.PIPE).communicate()[0]
-    except (subprocess.CalledProcessError, OSError) as err:
+        return get_git_reader(git_path).show(relative_path, commit_id)
+    except GbsError as err:
         log.debug('failed to checkout %s from %s:%s' % (relative_path,
                                                         commit_id, str(err)))
     return None
@@ -763,21 +1689,8 @@ def show_file_from_rev(git_path, relative_path, commit_id):
 
 def file_exists_in_rev(git_path, relative_path, commit_id, dir_only=False):
     """Check if file exists in given given revision."""
-    git_opts = ['--name-only']
-    if dir_only:
-        git_opts += ['-d']
-    args = ['git', 'ls-tree', commit_id, relative_path]
-    args.extend(git_opts)
-
-    try:
-        with Workdir(git_path):
-            output = subprocess.Popen(args,
-                                      stdout=subprocess.PIPE).communicate()[0]
-    except (subprocess.CalledProcessError, OSError) as err:
-        raise GbsError('failed to check existence of %s in %s:%s' % (
-            relative_path, commit_id, str(err)))
-
-    return output != ''
+    return get_git_reader(git_path).exists(relative_path, commit_id,
+                                           dir_only=dir_only)
 
 
 def glob_in_inc(git_path, packaging_dir, pattern):
@@ -794,17 +1707,9 @@ def glob_in_rev(git_path, pattern, commit_id):
     """Glob pattern in given revision."""
 
     path = os.path.dirname(pattern)
-    args = ['git', 'ls-tree', '--name-only', commit_id, '%s/' % path]
-
-    try:
-        with Workdir(git_path):
-            output = subprocess.Popen(args,
-                                      stdout=subprocess.PIPE).communicate()[0]
-    except (subprocess.CalledProcessError, OSError) as err:
-        raise GbsError('failed to glob %s in %s:%s' % (
-            pattern, commit_id, str(err)))
-
-    return fnmatch.filter(output.splitlines(), pattern)
+    entries = get_git_reader(git_path).listdir(path, commit_id) or []
+    return fnmatch.filter([os.path.join(path, name)
+                           for name, _type in entries], pattern)
 
 
 def get_editor_cmd():
@@ -0,0 +1,287 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Benchmark of remotebuild against the in-process fake OBS.
+
+Generated packages of different size and file count go through the steps
+of remotebuild: export, upload to a new package, diff of unchanged files,
+update of one changed file and watching build status. Time, OBS requests
+and bytes sent to and received from OBS are recorded for every step.
+
+Request counts don't depend on the machine, so a run can be saved and used
+as baseline of later runs, which fail if more requests are made:
+
+  $ python tests/benchmark_remotebuild.py --save baseline.json
+  $ python tests/benchmark_remotebuild.py --baseline baseline.json
+
+Caches of gbs and osc are kept in a temporary HOME, so every run is cold.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gitbuildsys import log
+from gitbuildsys.errors import CmdError
+from gitbuildsys.cmd_remotebuild import get_package, export_package, \
+     prepare_project, submit_package, watch_status
+
+from fakeobs import FakeOBS
+
+# name, number of source files, bytes of every file
+SHAPES = (
+    ('small', 5, 16 * 1024),
+    ('many-files', 500, 2 * 1024),
+    ('large', 2, 32 * 1024 * 1024),
+    )
+
+STEPS = ('export', 'upload', 'diff', 'update', 'status')
+
+PROJECT = 'home:test:gbs'
+
+SPEC = '''Name: %(name)s
+Version: 1.0
+Release: 0
+Summary: benchmark package
+License: GPL-2.0
+Source0: %%{name}-%%{version}.tar.gz
+
+%%description
+Benchmark package with %(files)d files of %(size)d bytes.
+
+%%prep
+%%setup -q
+
+%%build
+
+%%install
+
+%%files
+'''
+
+# build results served while watching build status
+RESULTS = [[('standard', 'i586', 'building', 'scheduled')],
+           [('standard', 'i586', 'building', 'building')],
+           [('standard', 'i586', 'published', 'succeeded')]]
+
+
+def make_package(topdir, name, files, size):
+    """
+    Create git project of package with files of random data.
+    Returns: path of git project.
+    """
+    gitdir = os.path.join(topdir, name)
+    os.makedirs(os.path.join(gitdir, 'packaging'))
+    with open(os.path.join(gitdir, 'packaging', '%s.spec' % name), 'w') \
+            as fobj:
+        fobj.write(SPEC % {'name': name, 'files': files, 'size': size})
+    for index in range(files):
+        with open(os.path.join(gitdir, 'src%d.dat' % index), 'wb') as fobj:
+            fobj.write(os.urandom(size))
+    for cmd in (['git', 'init', '-q'], ['git', 'add', '.'],
+                ['git', 'commit', '-q', '-m', 'benchmark']):
+        subprocess.check_call(cmd, cwd=gitdir)
+    return gitdir
+
+
+def copy_sources(gitdir, exportdir):
+    """Copy spec and source files as they are, instead of exporting."""
+    for root, _dirs, files in os.walk(gitdir):
+        if '.git' in root.split(os.sep):
+            continue
+        for fname in files:
+            shutil.copy(os.path.join(root, fname), exportdir)
+
+
+def remotebuild_args(gitdir):
+    """Get default remotebuild arguments for git project."""
+    return argparse.Namespace(
+        gitdir=gitdir, target_obsprj=PROJECT, base_obsprj=None,
+        profile=None, spec=None, commit=None, no_patch_export=False,
+        buildlog=False, status=False, watch=False, follow=False,
+        repository=None, arch=None, include_all=False,
+        fallback_to_native=None, upstream_branch=None, upstream_tag=None,
+        squash_patches_until=None, packaging_dir=None, package_list='',
+        jobs=None, source_rpm=False, with_submodules=False, debug=False,
+        verbose=False, conf=None)
+
+
+class Recorder(object):
+    """Record time, OBS requests and bytes of benchmark steps."""
+
+    def __init__(self, obs):
+        self.obs = obs
+        self.results = {}
+
+    def run(self, package, step, func, *args):
+        """Run step of package, record what it costs."""
+        before = self.obs.totals()
+        start = time.time()
+        result = func(*args)
+        seconds = time.time() - start
+        after = self.obs.totals()
+        self.results.setdefault(package, {})[step] = {
+            'seconds': seconds,
+            'requests': after[0] - before[0],
+            'sent': after[1] - before[1],
+            'received': after[2] - before[2]}
+        return result
+
+
+def upload(api, package, exportdir, commit_msg):
+    """
+    Submit exported files to a new package, like remotebuild does.
+    Returns: build repos of the project.
+    """
+    build_repos = prepare_project(api, PROJECT, None)
+    submit_package(api, PROJECT, package, exportdir, commit_msg, build_repos,
+                   'i586')
+    return build_repos
+
+
+def benchmark_package(recorder, api, topdir, shape, export):
+    """Run steps of remotebuild for package of shape."""
+    name, files, size = shape
+    gitdir = make_package(topdir, name, files, size)
+    exportdir = os.path.join(topdir, '%s-export' % name)
+    os.mkdir(exportdir)
+
+    if export:
+        args = remotebuild_args(gitdir)
+        repo, commit, spec, package = get_package(args, gitdir)
+        commit_msg = recorder.run(name, 'export', export_package, args,
+                                  repo, commit, spec, exportdir)
+    else:
+        copy_sources(gitdir, exportdir)
+        package, commit_msg = name, 'benchmark'
+
+    build_repos = recorder.run(name, 'upload', upload, api, package,
+                               exportdir, commit_msg)
+    recorder.run(name, 'diff', api.diff_files, PROJECT, package,
+                 [os.path.join(exportdir, fname)
+                  for fname in sorted(os.listdir(exportdir))])
+
+    spec = os.path.join(exportdir, '%s.spec' % name)
+    with open(spec, 'a') as fobj:
+        fobj.write('# changed\n')
+    recorder.run(name, 'update', submit_package, api, PROJECT, package,
+                 exportdir, 'update', build_repos, 'i586')
+
+    recorder.obs.polls = 0
+    recorder.obs.results = RESULTS
+    recorder.run(name, 'status', watch_status, api, PROJECT, package, 0, 0)
+
+
+def report(results):
+    """Print results of all packages and steps."""
+    print('%-12s%-8s%10s%10s%12s%12s' % ('package', 'step', 'seconds',
+                                         'requests', 'sent KB',
+                                         'received KB'))
+    for name, _files, _size in SHAPES:
+        for step in STEPS:
+            if step not in results.get(name, {}):
+                continue
+            stat = results[name][step]
+            print('%-12s%-8s%10.3f%10d%12.1f%12.1f' %
+                  (name, step, stat['seconds'], stat['requests'],
+                   stat['sent'] / 1024.0, stat['received'] / 1024.0))
+
+
+def compare(results, baseline):
+    """
+    Compare request counts with baseline.
+    Returns: list of regressions.
+    """
+    regressions = []
+    for name in sorted(results):
+        for step in sorted(results[name]):
+            base = baseline.get(name, {}).get(step)
+            if base and results[name][step]['requests'] > base['requests']:
+                regressions.append('%s %s: %d requests, baseline %d' %
+                                   (name, step,
+                                    results[name][step]['requests'],
+                                    base['requests']))
+    return regressions
+
+
+def main(argv):
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description='benchmark remotebuild '
+                                     'against fake OBS')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds every OBS request takes')
+    parser.add_argument('--no-export', action='store_true',
+                        help="don't export packages with git-buildpackage, "
+                        "upload source files as they are")
+    parser.add_argument('--save', help='save results to json file')
+    parser.add_argument('--baseline',
+                        help='json file of results to compare request '
+                        'counts with')
+    args = parser.parse_args(argv[1:])
+
+    log.setup(verbose=False)
+    log.LOGGER.setLevel(log.WARNING)
+
+    topdir = tempfile.mkdtemp(prefix='gbs-benchmark-')
+    home = os.environ.get('HOME')
+    os.environ['HOME'] = topdir
+    obs = FakeOBS(latency=args.latency).start()
+    try:
+        obs.add_project(PROJECT)
+        api = obs.make_api(topdir)
+        recorder = Recorder(obs)
+        for shape in SHAPES:
+            benchmark_package(recorder, api, topdir, shape,
+                              not args.no_export)
+    except CmdError as err:
+        print('benchmark failed: %s' % err)
+        return 1
+    finally:
+        obs.stop()
+        if home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = home
+        shutil.rmtree(topdir)
+
+    report(recorder.results)
+    if args.save:
+        with open(args.save, 'w') as fobj:
+            json.dump(recorder.results, fobj, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as fobj:
+            regressions = compare(recorder.results, json.load(fobj))
+        for regression in regressions:
+            print('regression: %s' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
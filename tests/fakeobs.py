@@ -0,0 +1,390 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+In-process fake of the OBS API used by remotebuild, for unit tests and
+benchmarks of cmd_remotebuild and oscapi without a live OBS.
+
+Served API:
+  GET/PUT /source/<prj>/_meta, /source/<prj>/<pkg>/_meta
+  GET/PUT /source/<prj>/_config
+  DELETE  /source/<prj>
+  GET     /source/<prj>/<pkg>                        file list
+  PUT     /source/<prj>/<pkg>/<file>                 upload
+  POST    /source/<prj>/<pkg>?cmd=commitfilelist
+  POST    /build/<prj>?cmd=rebuild
+  GET     /build/<prj>/_result
+  GET     /build/<prj>/<repo>/<arch>/<pkg>/_status, _log
+"""
+
+import os
+import re
+import time
+import hashlib
+import threading
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+from collections import defaultdict
+from urllib import unquote
+from xml.etree import cElementTree as ET
+
+from gitbuildsys.conf import encode_passwd
+from gitbuildsys.oscapi import OSC
+from gitbuildsys.cmd_remotebuild import OSCRC_TEMPLATE
+
+# uploaded files are read and hashed in blocks of this size
+BLOCK_SIZE = 64 * 1024
+
+PROJECT_META = '<project name="%s"><title/><description/>%s</project>'
+REPOSITORY = '<repository name="%s">%s</repository>'
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server handling every request in a thread"""
+    daemon_threads = True
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Dispatch requests to FakeOBS of the server"""
+
+    def handle_request(self, method):
+        """Serve request by FakeOBS, counting bytes on the wire."""
+        obs = self.server.obs
+        url = urlparse.urlsplit(self.path)
+        path = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = dict((key, values[-1]) for key, values in
+                     urlparse.parse_qs(url.query).iteritems())
+        length = int(self.headers.get('Content-Length') or 0)
+
+        if obs.latency:
+            time.sleep(obs.latency)
+        error = obs.injected_error(method, url.path)
+        if error:
+            code, headers, body = error[0], error[1], ''
+            # skip request data, we don't read it
+            self.rfile.read(length)
+        else:
+            try:
+                code, headers, body = obs.serve(method, path, query,
+                                                self.rfile, length)
+            except KeyError:
+                code, headers, body = 404, {}, \
+                    '<status code="unknown"><summary>%s not found' \
+                    '</summary></status>' % url.path
+        obs.record(method, path, query, length, len(body))
+
+        self.send_response(code)
+        for header in headers.iteritems():
+            self.send_header(*header)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """serve GET"""
+        self.handle_request('GET')
+
+    def do_PUT(self):
+        """serve PUT"""
+        self.handle_request('PUT')
+
+    def do_POST(self):
+        """serve POST"""
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        """serve DELETE"""
+        self.handle_request('DELETE')
+
+    def log_message(self, *_args):
+        """be quiet"""
+        pass
+
+
+class FakeOBS(object):
+    """
+    Fake OBS API server running in threads of this process.
+
+    Projects, packages and files are kept in memory. Uploaded files are
+    kept only as md5 and size, so large files don't use memory. Build
+    results, build status and build log are scripted by the user:
+
+    results: list of result snapshots, one is served per _result request
+             and the last one is repeated. A snapshot is a list of
+             (repo, arch, repo state, package status[, dirty]).
+    statuses: list of (package status, log data), one is served per
+              _status request and log data is appended to buildlog then.
+    buildlog: build log data.
+
+    Every request sleeps latency seconds. Errors are injected with fail().
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.projects = {}
+        self.results = []
+        self.statuses = []
+        self.buildlog = ''
+        self.polls = 0
+        self.requests = []
+        # requests, bytes received and bytes sent of every endpoint
+        self.stats = defaultdict(lambda: [0, 0, 0])
+        self.errors = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def apiurl(self):
+        """API url of running server."""
+        return 'http://127.0.0.1:%d' % self.server.server_port
+
+    def start(self):
+        """Start server in a thread."""
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.obs = self
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        if self.server:
+            self.server.shutdown()
+            self.thread.join()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_args):
+        self.stop()
+
+    def make_api(self, tmpdir, cache_ttl=0):
+        """
+        Create OSC API of this server with oscrc and gbs caches in tmpdir.
+        Returns: OSC instance.
+        """
+        oscrc = os.path.join(tmpdir, 'oscrc')
+        with open(oscrc, 'w') as fobj:
+            fobj.write(OSCRC_TEMPLATE % {'apiurl': self.apiurl,
+                                         'user': 'test',
+                                         'passwdx': encode_passwd('secret'),
+                                         'http_debug': 0, 'debug': 0})
+        os.chmod(oscrc, 0600)
+        return OSC(self.apiurl, oscrc=oscrc, cache_ttl=cache_ttl,
+                   cachedir=os.path.join(tmpdir, 'cache'))
+
+    def fail(self, code, method=None, path='', count=1, headers=None):
+        """
+        Answer next count requests of method (default: any) to paths
+        matching regular expression path with HTTP error code.
+        """
+        with self.lock:
+            self.errors.extend([(method, re.compile(path), code,
+                                 headers or {})] * count)
+
+    def injected_error(self, method, path):
+        """
+        Get first injected error matching request, it's used up.
+        Returns: (code, headers) or None.
+        """
+        with self.lock:
+            for index, (emethod, regexp, code, headers) in \
+                    enumerate(self.errors):
+                if emethod in (None, method) and regexp.search(path):
+                    del self.errors[index]
+                    return code, headers
+        return None
+
+    def record(self, method, path, query, received, sent):
+        """Log request and count it for its endpoint, see OSC.endpoint."""
+        endpoint = '%s %s' % (method, '/'.join(
+            path[:1] + [part for part in path[1:] if part.startswith('_')]))
+        with self.lock:
+            self.requests.append((method, '/'.join(path), query))
+            stats = self.stats[endpoint]
+            stats[0] += 1
+            stats[1] += received
+            stats[2] += sent
+
+    def totals(self):
+        """
+        Get total requests, bytes received and bytes sent by server.
+        Returns: (requests, received, sent).
+        """
+        with self.lock:
+            return tuple(sum(values) for values in zip(*self.stats.values())) \
+                   or (0, 0, 0)
+
+    def add_project(self, prj, repos=(('standard', ('i586',)),)):
+        """Create project with repos, list of (name, archs)."""
+        meta = PROJECT_META % (prj, ''.join(
+            REPOSITORY % (name, ''.join('<arch>%s</arch>' % arch
+                                        for arch in archs))
+            for name, archs in repos))
+        with self.lock:
+            self.projects[prj] = {'meta': meta, 'config': '',
+                                  'packages': {}}
+
+    def package(self, prj, pkg):
+        """Get package of project, raises KeyError if not found."""
+        return self.projects[prj]['packages'][pkg]
+
+    def serve(self, method, path, query, rfile, length):
+        """
+        Serve OBS API request, KeyError means not found.
+        Returns: (HTTP code, headers, body).
+        """
+        if path[0] == 'source':
+            return self.serve_source(method, path[1:], query, rfile, length)
+        if path[0] == 'build':
+            return self.serve_build(method, path[1:], query)
+        raise KeyError(path[0])
+
+    def serve_source(self, method, path, query, rfile, length):
+        """Serve /source requests."""
+        data = None
+        if method in ('PUT', 'POST') and \
+                not (len(path) == 3 and not path[2].startswith('_')):
+            data = rfile.read(length)
+        prj = path[0]
+
+        if len(path) == 1 and method == 'DELETE':
+            with self.lock:
+                del self.projects[prj]
+            return 200, {}, '<status code="ok"/>'
+
+        if path[1:] == ['_meta']:
+            if method == 'PUT':
+                with self.lock:
+                    self.projects.setdefault(prj, {'config': '',
+                                                   'packages': {}})
+                    self.projects[prj]['meta'] = data
+                return 200, {}, '<status code="ok"/>'
+            return 200, {}, self.projects[prj]['meta']
+
+        if path[1:] == ['_config']:
+            if method == 'PUT':
+                self.projects[prj]['config'] = data
+                return 200, {}, '<status code="ok"/>'
+            return 200, {}, self.projects[prj]['config']
+
+        pkg = path[1]
+        if path[2:] == ['_meta']:
+            if method == 'PUT':
+                with self.lock:
+                    packages = self.projects[prj]['packages']
+                    packages.setdefault(pkg, {'files': {}, 'uploaded': {},
+                                              'rev': 0})
+                    packages[pkg]['meta'] = data
+                return 200, {}, '<status code="ok"/>'
+            return 200, {}, self.package(prj, pkg)['meta']
+
+        package = self.package(prj, pkg)
+        if len(path) == 3 and method == 'PUT':
+            # stream uploaded file, only md5 and size are kept
+            md5 = hashlib.md5()
+            left = length
+            while left:
+                block = rfile.read(min(left, BLOCK_SIZE))
+                if not block:
+                    break
+                md5.update(block)
+                left -= len(block)
+            with self.lock:
+                package['uploaded'][path[2]] = (md5.hexdigest(),
+                                                length - left)
+            return 200, {}, '<status code="ok"/>'
+
+        if len(path) == 2 and method == 'POST' and \
+                query.get('cmd') == 'commitfilelist':
+            return self.commit(prj, pkg, package, data)
+
+        if len(path) == 2 and method == 'GET':
+            entries = ''.join('<entry name="%s" md5="%s" size="%d"/>' %
+                              (name, md5, size) for name, (md5, size) in
+                              sorted(package['files'].iteritems()))
+            return 200, {}, '<directory name="%s" rev="%d">%s</directory>' % \
+                   (pkg, package['rev'], entries)
+        raise KeyError(pkg)
+
+    def commit(self, prj, pkg, package, data):
+        """Commit file list, listing files missing on server."""
+        entries = [(entry.get('name'), entry.get('md5'))
+                   for entry in ET.fromstring(data).findall('entry')]
+        with self.lock:
+            known = dict((name, md5) for name, (md5, _size) in
+                         package['files'].items() +
+                         package['uploaded'].items())
+            missing = [name for name, md5 in entries
+                       if known.get(name) != md5]
+            if missing:
+                return 200, {}, '<directory name="%s" error="missing">' \
+                       '%s</directory>' % (pkg, ''.join(
+                           '<entry name="%s"/>' % name for name in missing))
+            sizes = dict((name, size) for name, (_md5, size) in
+                         package['files'].items() +
+                         package['uploaded'].items())
+            package['files'] = dict((name, (md5, sizes[name]))
+                                    for name, md5 in entries)
+            package['uploaded'] = {}
+            package['rev'] += 1
+            return 200, {}, '<directory name="%s" rev="%d"/>' % \
+                   (pkg, package['rev'])
+
+    def serve_build(self, method, path, query):
+        """Serve /build requests."""
+        prj = path[0]
+        if len(path) == 1 and method == 'POST' and \
+                query.get('cmd') == 'rebuild':
+            self.package(prj, query['package'])
+            return 200, {}, '<status code="ok"/>'
+
+        if path[1:] == ['_result']:
+            with self.lock:
+                self.polls += 1
+                index = min(self.polls, len(self.results)) - 1
+                snapshot = self.results[index] if self.results else []
+            body = ''.join(
+                '<result project="%s" repository="%s" arch="%s" code="%s" '
+                'state="%s"%s><status package="%s" code="%s"/></result>' %
+                (prj, result[0], result[1], result[2], result[2],
+                 ' dirty="true"' if result[4:] and result[4] else '',
+                 query.get('package', ''), result[3])
+                for result in snapshot)
+            return 200, {}, '<resultlist state="%d">%s</resultlist>' % \
+                   (index, body)
+
+        if len(path) == 5 and path[4] == '_status':
+            with self.lock:
+                status, data = self.statuses.pop(0)
+                self.buildlog += data
+            return 200, {}, '<status package="%s" code="%s"/>' % \
+                   (path[3], status)
+
+        if len(path) == 5 and path[4] == '_log':
+            start = int(query.get('start', 0))
+            end = int(query['end']) if 'end' in query else None
+            return 200, {}, self.buildlog[start:end]
+        raise KeyError(prj)
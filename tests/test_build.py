@@ -0,0 +1,395 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for helpers of gbs build"""
+
+import os
+import gzip
+import shutil
+import argparse
+import tempfile
+import unittest
+import subprocess
+
+from mock import patch
+
+from gitbuildsys.errors import GbsError, Usage
+from gitbuildsys.cmd_build import get_local_archs, filter_manifest, \
+     get_changed_projects, copy_local_projects, pre_export_sources, \
+     prepare_depanneur_opts, sync_source
+
+
+REPOMD = '''<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <checksum type="sha256">%s</checksum>
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+</repomd>
+'''
+
+PACKAGE = '''<package type="rpm">
+    <name>%s</name>
+    <arch>%s</arch>
+  </package>'''
+
+PRIMARY = '''<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" packages="%d">
+  %s
+</metadata>
+'''
+
+
+class LocalArchsTest(unittest.TestCase):
+    '''Test get_local_archs'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-build-')
+        self.repo = os.path.join(self.tmpdir, 'repo')
+        os.makedirs(os.path.join(self.repo, 'repodata'))
+        self.buildroot = os.path.join(self.tmpdir, 'buildroot')
+        self.env = patch.dict(os.environ,
+                              {'TIZEN_BUILD_ROOT': self.buildroot})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _write_repo(self, checksum, archs):
+        '''write repomd.xml and primary of packages with given archs'''
+        with open(os.path.join(self.repo, 'repodata', 'repomd.xml'),
+                  'w') as fobj:
+            fobj.write(REPOMD % checksum)
+        packages = [PACKAGE % ('pkg%d' % index, arch)
+                    for index, arch in enumerate(archs)]
+        fobj = gzip.open(os.path.join(self.repo, 'repodata',
+                                      'primary.xml.gz'), 'wb')
+        try:
+            fobj.write(PRIMARY % (len(packages), '\n  '.join(packages)))
+        finally:
+            fobj.close()
+
+    def test_archs(self):
+        '''archs of binary packages are returned, ix86 as i586'''
+        self._write_repo('aaa', ['i686', 'noarch', 'x86_64', 'src',
+                                 'armv7l', 'i386'])
+        self.assertEqual(set(['i586', 'x86_64', 'armv7l']),
+                         get_local_archs([self.repo]))
+
+    def test_remote_repo_skipped(self):
+        '''remote repos are not parsed'''
+        self.assertEqual(set(), get_local_archs(['http://server/repo']))
+
+    def test_cached(self):
+        '''unchanged repo is not parsed again'''
+        self._write_repo('aaa', ['x86_64'])
+        self.assertEqual(set(['x86_64']), get_local_archs([self.repo]))
+        self.assertTrue(os.path.isdir(os.path.join(
+            self.buildroot, 'local', 'gbscache', 'archs')))
+
+        # primary changed but checksum not: archs come from cache
+        self._write_repo('aaa', ['aarch64'])
+        self.assertEqual(set(['x86_64']), get_local_archs([self.repo]))
+
+    def test_checksum_changed(self):
+        '''changed checksum in repomd invalidates cached archs'''
+        self._write_repo('aaa', ['x86_64'])
+        self.assertEqual(set(['x86_64']), get_local_archs([self.repo]))
+
+        self._write_repo('bbb', ['aarch64'])
+        self.assertEqual(set(['aarch64']), get_local_archs([self.repo]))
+
+
+MANIFEST = '''<?xml version="1.0" encoding="UTF-8"?>
+<manifest>
+  <remote name="tizen" fetch="ssh://review.tizen.org"/>
+  <default remote="tizen" revision="tizen"/>
+  <project name="platform/upstream/bash" path="platform/upstream/bash"
+           revision="%s"/>
+  <project name="platform/upstream/zlib" path="platform/upstream/zlib"
+           revision="%s"/>
+  <project name="platform/core/base/acl"/>
+</manifest>
+''' % ('1' * 40, '2' * 40)
+
+
+class SyncSourceTest(unittest.TestCase):
+    '''Test helpers of syncing sources of full build and deps build'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-build-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _checkout(self, prj, head):
+        '''fake repo checkout of project with given HEAD'''
+        gitdir = os.path.join(self.tmpdir, prj, '.git')
+        os.makedirs(gitdir)
+        with open(os.path.join(gitdir, 'HEAD'), 'w') as fobj:
+            fobj.write(head + '\n')
+
+    def test_filter_all(self):
+        '''all projects are kept without filter, default revision used'''
+        _content, projects = filter_manifest(MANIFEST)
+        self.assertEqual([('platform/upstream/bash', '1' * 40),
+                          ('platform/upstream/zlib', '2' * 40),
+                          ('platform/core/base/acl', 'tizen')], projects)
+
+    def test_filter_exclude(self):
+        '''excluded projects are removed from manifest'''
+        content, projects = filter_manifest(
+            MANIFEST, exclude_pkgs=['platform/upstream/bash'])
+        self.assertEqual(['platform/upstream/zlib', 'platform/core/base/acl'],
+                         [prj for prj, _rev in projects])
+        self.assertFalse('platform/upstream/bash' in content)
+        self.assertTrue('<remote ' in content)
+
+    def test_filter_pkgs(self):
+        '''only given projects are kept'''
+        content, projects = filter_manifest(
+            MANIFEST, pkgs=['platform/upstream/zlib'])
+        self.assertEqual([('platform/upstream/zlib', '2' * 40)], projects)
+        self.assertFalse('acl' in content)
+
+    def test_filter_bad_manifest(self):
+        '''broken manifest raises GbsError'''
+        self.assertRaises(GbsError, filter_manifest, '<manifest>')
+
+    def test_changed_projects(self):
+        '''projects not checked out at their revision are changed'''
+        self._checkout('platform/upstream/bash', '1' * 40)
+        self._checkout('platform/upstream/zlib', '3' * 40)
+        self._checkout('platform/core/base/other', 'ref: refs/heads/tizen')
+        projects = [('platform/upstream/bash', '1' * 40),
+                    ('platform/upstream/zlib', '2' * 40),
+                    ('platform/core/base/other', '4' * 40),
+                    ('platform/core/base/missing', '5' * 40),
+                    ('platform/core/base/branch', None)]
+        self.assertEqual(['platform/upstream/zlib',
+                          'platform/core/base/other',
+                          'platform/core/base/missing',
+                          'platform/core/base/branch'],
+                         get_changed_projects(self.tmpdir, projects))
+
+    def test_up_to_date(self):
+        '''nothing changed if all projects are at their revision'''
+        self._checkout('platform/upstream/bash', '1' * 40)
+        self.assertEqual([], get_changed_projects(
+            self.tmpdir, [('platform/upstream/bash', '1' * 40)]))
+
+    def _synced_tree(self):
+        '''fake tree synced from MANIFEST by an earlier build'''
+        manifests = os.path.join(self.tmpdir, '.repo', 'manifests')
+        os.makedirs(os.path.join(manifests, 'unified', 'standard'))
+        with open(os.path.join(manifests, 'unified_standard.xml'),
+                  'w') as fobj:
+            fobj.write('<manifest><include name="metadata.xml"/>'
+                       '<include name="unified/standard/projects.xml"/>'
+                       '</manifest>')
+        projects = filter_manifest(MANIFEST)[1]
+        for prj, rev in projects:
+            self._checkout(prj, rev if len(rev) == 40 else '0' * 40)
+        with open(os.path.join(self.tmpdir, '.repo', 'project.list'),
+                  'w') as fobj:
+            fobj.write(''.join('%s\n' % prj for prj, _rev in projects))
+
+    def _sync(self, pkgs):
+        '''sync MANIFEST into tree with repo faked, return repo commands'''
+        response = argparse.Namespace(status_code=200, content=MANIFEST)
+        with patch('gitbuildsys.cmd_build.subprocess.call',
+                   return_value=0) as call, \
+             patch('gitbuildsys.cmd_build.requests.get',
+                   return_value=response):
+            sync_source(None, pkgs, 'http://server/projects.xml',
+                        self.tmpdir, 1)
+        return [args[0] for args, _kwargs in call.call_args_list
+                if args[0][0] == 'repo']
+
+    def test_sync_smaller_manifest(self):
+        '''projects left out of manifest are removed from synced tree'''
+        self._synced_tree()
+        cmds = self._sync(['platform/upstream/bash'])
+        self.assertEqual(['init'], [cmd[1] for cmd in cmds])
+        self.assertTrue(os.path.isdir(os.path.join(
+            self.tmpdir, 'platform', 'upstream', 'bash')))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.tmpdir, 'platform', 'upstream', 'zlib')))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.tmpdir, 'platform', 'core')))
+        with open(os.path.join(self.tmpdir, '.repo', 'project.list')) \
+                as fobj:
+            self.assertEqual('platform/upstream/bash\n', fobj.read())
+        with open(os.path.join(self.tmpdir, '.repo', 'manifests',
+                               'unified_standard.xml')) as fobj:
+            self.assertFalse('metadata.xml' in fobj.read())
+
+    def test_sync_changed(self):
+        '''only projects not at manifest revision are synced'''
+        self._synced_tree()
+        cmds = self._sync(None)
+        self.assertEqual(['repo', 'sync', '-j1', 'platform/core/base/acl'],
+                         cmds[-1])
+
+    def test_sync_nothing(self):
+        '''all synced projects are removed if no package is wanted'''
+        self._synced_tree()
+        self.assertEqual([], self._sync([]))
+        self.assertEqual(['.repo'], os.listdir(self.tmpdir))
+
+    def test_copy_local_projects(self):
+        '''copies of local projects of last build are replaced'''
+        sources = os.path.join(self.tmpdir, 'sources')
+        os.mkdir(sources)
+        for name in ('old', 'new'):
+            os.makedirs(os.path.join(self.tmpdir, 'local', name))
+            with open(os.path.join(self.tmpdir, 'local', name, 'file'),
+                      'w') as fobj:
+                fobj.write(name)
+
+        copy_local_projects([os.path.join(self.tmpdir, 'local', 'old')],
+                            sources)
+        self.assertTrue(os.path.isfile(os.path.join(sources, 'old', 'file')))
+
+        with open(os.path.join(self.tmpdir, 'local', 'new', 'file'),
+                  'w') as fobj:
+            fobj.write('changed')
+        for _ in range(2):
+            copy_local_projects([os.path.join(self.tmpdir, 'local', 'new')],
+                                sources)
+        self.assertFalse(os.path.exists(os.path.join(sources, 'old')))
+        with open(os.path.join(sources, 'new', 'file')) as fobj:
+            self.assertEqual('changed', fobj.read())
+
+
+def build_args(**kwargs):
+    '''get default gbs build arguments, updated with kwargs'''
+    args = argparse.Namespace(
+        exclude=None, exclude_from_file=None, overwrite=False,
+        clean_once=False, clean_repos=False, debug=False, incremental=False,
+        no_configure=False, keep_packs=False, use_higher_deps=False,
+        not_export_source=False, baselibs=False, skip_srcrpm=False,
+        fail_fast=False, keepgoing=None, disable_debuginfo=False,
+        style='git', export_only=False, with_submodules=False,
+        nocumulate=False, package_list='', package_from_file=None,
+        binary_list='', binary_from_file=None, deps=False, rdeps=False,
+        kvm=False, icecream=0, preordered_list='', profiling='',
+        release=None, threads=1, packaging_dir='packaging', commit=None,
+        include_all=False, spec=None)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+class PreExportTest(unittest.TestCase):
+    '''Test exporting sources before building with --pre-export'''
+
+    # spec names of packages in git projects
+    NAMES = {'acl': ['acl'], 'bash': ['bash', 'bash-static'],
+             'zlib': ['zlib']}
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-build-')
+        self.workdir = os.path.join(self.tmpdir, 'src')
+        for name in self.NAMES:
+            path = os.path.join(self.workdir, name)
+            os.makedirs(os.path.join(path, 'packaging'))
+            subprocess.check_call(['git', 'init', '-q', path])
+        self.env = patch.dict(os.environ, {'TIZEN_BUILD_ROOT': self.tmpdir})
+        self.env.start()
+        self.export = patch('gitbuildsys.cmd_build.export_packages')
+        self.export_packages = self.export.start()
+        self.names = patch('gitbuildsys.cmd_build.'
+                           'get_binary_names_of_packages', self._names)
+        self.names.start()
+
+    def tearDown(self):
+        self.names.stop()
+        self.export.stop()
+        self.env.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _names(self, _args, package_dirs):
+        '''spec names of package dirs'''
+        return dict((path, self.NAMES[os.path.basename(path)])
+                    for path in package_dirs)
+
+    def _exported(self, args):
+        '''pre-export with args, return names of exported projects'''
+        export_dir = pre_export_sources(args, self.workdir)
+        self.assertEqual(os.path.join(self.tmpdir, 'local', 'exported'),
+                         export_dir)
+        export_args, paths = self.export_packages.call_args[0]
+        self.assertEqual(export_dir, export_args.outdir)
+        return sorted(os.path.basename(path) for path in paths)
+
+    def test_all(self):
+        '''all packages are exported, depanneur builds them as tarballs'''
+        args = build_args()
+        self.assertEqual(['acl', 'bash', 'zlib'], self._exported(args))
+        opts = prepare_depanneur_opts(args)
+        self.assertTrue('--not-export-source' in opts)
+        self.assertTrue('--style=tar' in opts)
+
+    def test_package_list(self):
+        '''only packages of package list are exported'''
+        args = build_args(package_list='bash,%s' %
+                          os.path.join(self.workdir, 'zlib'))
+        self.assertEqual(['bash', 'zlib'], self._exported(args))
+
+    def test_package_from_file(self):
+        '''packages of package list file are exported'''
+        listfile = os.path.join(self.tmpdir, 'packages')
+        with open(listfile, 'w') as fobj:
+            fobj.write('acl\n\n')
+        args = build_args(package_from_file=listfile)
+        self.assertEqual(['acl'], self._exported(args))
+
+    def test_binary_list(self):
+        '''packages with specs of binary list are exported'''
+        args = build_args(binary_list='bash-static,zlib')
+        self.assertEqual(['bash', 'zlib'], self._exported(args))
+        opts = prepare_depanneur_opts(args)
+        self.assertTrue('--binary-list=bash-static,zlib' in opts)
+
+    def test_exclude(self):
+        '''packages with all specs excluded are not exported'''
+        args = build_args(exclude='acl,bash')
+        self.assertEqual(['bash', 'zlib'], self._exported(args))
+        opts = prepare_depanneur_opts(args)
+        self.assertTrue('--exclude=acl' in opts)
+        self.assertTrue('--exclude=bash' in opts)
+
+    def test_deps(self):
+        '''all packages are exported to find dependencies'''
+        args = build_args(package_list='bash', deps=True)
+        self.assertEqual(['acl', 'bash', 'zlib'], self._exported(args))
+
+    def test_nothing_selected(self):
+        '''error if no package is selected'''
+        args = build_args(binary_list='nothing')
+        self.assertRaises(GbsError, pre_export_sources, args, self.workdir)
+
+    def test_conflicts(self):
+        '''options conflicting with exporting before build are rejected'''
+        for conflict in ({'style': 'tar'}, {'not_export_source': True},
+                         {'export_only': True}, {'incremental': True}):
+            self.assertRaises(Usage, pre_export_sources,
+                              build_args(**conflict), self.workdir)
+        self.assertFalse(self.export_packages.called)
@@ -0,0 +1,116 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for depanneur output tracking"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from mock import patch
+
+from gitbuildsys.buildmonitor import BuildMonitor, run_depanneur
+
+OUTPUT = '''info: start building packages from: /src (git)
+info: *** [1/2] building glib2-2.36.1-1 armv7l tizen (worker: 0) ***
+info: *** [2/2] building gtk3-3.8.0-1 armv7l tizen (worker: 1) ***
+\x1b[32minfo: \x1b[0mfinished building glib2
+warning: build failed, Leaving the logs in /root/local/repos/tizen/armv7l/logs/fail/gtk3-3.8.0-1/log.txt
+info: Done
+'''
+
+
+class BuildMonitorTest(unittest.TestCase):
+    '''Test BuildMonitor class'''
+
+    def _events(self, output):
+        '''feed output to monitor, return events'''
+        events = StringIO()
+        monitor = BuildMonitor(events)
+        for line in output.splitlines(True):
+            monitor.feed(line)
+        monitor.summary(1)
+        return [json.loads(line) for line in events.getvalue().splitlines()]
+
+    def test_events(self):
+        '''started/finished/failed events are parsed from output'''
+        events = self._events(OUTPUT)
+        self.assertEqual([('started', 'glib2'), ('started', 'gtk3'),
+                          ('finished', 'glib2'), ('failed', 'gtk3'),
+                          ('done', None)],
+                         [(event['event'], event.get('package'))
+                          for event in events])
+        self.assertEqual(1, events[1]['worker'])
+        self.assertEqual('gtk3-3.8.0-1', events[3]['nvr'])
+        self.assertTrue(events[3]['duration'] >= 0)
+        self.assertEqual(1, events[4]['finished'])
+        self.assertEqual(1, events[4]['failed'])
+
+    def test_unknown_package(self):
+        '''result of package which is not started is ignored'''
+        events = self._events('info: finished building glib2\n')
+        self.assertEqual(['done'], [event['event'] for event in events])
+
+
+class RunDepanneurTest(unittest.TestCase):
+    '''Test run_depanneur function'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-monitor-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_run(self):
+        '''exit code is returned and events are written'''
+        script = os.path.join(self.tmpdir, 'depanneur')
+        with open(script, 'w') as fobj:
+            fobj.write('#!/bin/sh\ncat <<EOF\n%sEOF\nexit 3\n' % OUTPUT)
+        os.chmod(script, 0755)
+        events = os.path.join(self.tmpdir, 'events.json')
+
+        self.assertNotEqual(0, run_depanneur([script, '--arch=armv7l'],
+                                             events))
+        with open(events) as fobj:
+            self.assertEqual(5, len(fobj.readlines()))
+
+    def test_line_buffered(self):
+        '''perl output is tracked when printed, not when flushed at exit'''
+        script = os.path.join(self.tmpdir, 'depanneur')
+        with open(script, 'w') as fobj:
+            fobj.write('#!/usr/bin/perl\n'
+                       'print "*** [1/1] building glib2-2.36.1-1 armv7l '
+                       'tizen (worker: 0) ***\\n";\n'
+                       'sleep 1;\n'
+                       'print "\\e[32minfo: \\e[0mfinished building glib2";\n')
+        os.chmod(script, 0755)
+        events = os.path.join(self.tmpdir, 'events.json')
+
+        with patch('sys.stdout', new=StringIO()) as stdout:
+            self.assertEqual(0, run_depanneur([script], events))
+        with open(events) as fobj:
+            records = [json.loads(line) for line in fobj]
+        self.assertEqual(['started', 'finished', 'done'],
+                         [record['event'] for record in records])
+        self.assertTrue(records[1]['duration'] >= 0.9)
+        # colors are only kept if stdout is a terminal
+        self.assertTrue(stdout.getvalue().endswith(
+            'info: finished building glib2'))
@@ -0,0 +1,169 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for class FileCache and DigestCache"""
+
+import os
+import time
+import shutil
+import tempfile
+import hashlib
+import unittest
+
+from mock import patch, Mock
+
+from gitbuildsys.cache import FileCache
+from gitbuildsys.utils import DigestCache, file_md5
+
+
+class FileCacheTest(unittest.TestCase):
+    '''Test FileCache class'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-cache-')
+        self.cache = FileCache(os.path.join(self.tmpdir, 'cache'),
+                               max_size=1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _mkfile(self, name, size):
+        '''create a file with given size'''
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as fobj:
+            fobj.write('x' * size)
+        return path
+
+    def test_miss(self):
+        '''return None if key is not cached'''
+        self.assertEqual(None, self.cache.get('nothing'))
+        self.assertEqual(1, self.cache.misses)
+
+    def test_put_and_get(self):
+        '''files and meta can be got back'''
+        path = self._mkfile('primary.xml.gz', 10)
+        self.cache.put('http://server/repo', [path], {'etag': 'abc'})
+
+        entry = self.cache.get('http://server/repo')
+        self.assertEqual({'etag': 'abc'}, entry.meta)
+        self.assertEqual(['primary.xml.gz'], entry.files())
+        with open(entry.filepath('primary.xml.gz')) as fobj:
+            self.assertEqual('x' * 10, fobj.read())
+        self.assertEqual(1, self.cache.hits)
+
+    def test_tuple_key(self):
+        '''tuple keys are different from each other'''
+        self.cache.put(('a', 'b'), meta={'v': 1})
+        self.cache.put(('a', 'c'), meta={'v': 2})
+        self.assertEqual({'v': 1}, self.cache.get(('a', 'b')).meta)
+        self.assertEqual({'v': 2}, self.cache.get(('a', 'c')).meta)
+
+    def test_replace(self):
+        '''put replaces the old entry'''
+        self.cache.put('key', [self._mkfile('old', 1)])
+        self.cache.put('key', [self._mkfile('new', 1)])
+        self.assertEqual(['new'], self.cache.get('key').files())
+
+    def test_remove(self):
+        '''removed key can't be got'''
+        self.cache.put('key', meta={'v': 1})
+        self.cache.remove('key')
+        self.assertEqual(None, self.cache.get('key'))
+
+    def test_evict_lru(self):
+        '''least recently used entries are evicted first'''
+        self.cache.put('first', [self._mkfile('first', 400)])
+        self.cache.put('second', [self._mkfile('second', 400)])
+        # make 'first' older, then use 'second'
+        old = time.time() - 100
+        os.utime(os.path.join(self.cache.cachedir,
+                              FileCache.hashkey('first'), 'meta.json'),
+                 (old, old))
+        self.cache.get('second')
+        self.cache.put('third', [self._mkfile('third', 400)])
+
+        self.assertEqual(None, self.cache.get('first'))
+        self.assertNotEqual(None, self.cache.get('second'))
+        self.assertNotEqual(None, self.cache.get('third'))
+
+
+class DigestCacheTest(unittest.TestCase):
+    '''Test DigestCache class'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-digests-')
+        self.cachefile = os.path.join(self.tmpdir, 'cache', 'digests.json')
+        self.path = os.path.join(self.tmpdir, 'fake-1.0.tar.gz')
+        with open(self.path, 'w') as fobj:
+            fobj.write('x' * 100)
+        old = time.time() - 60
+        os.utime(self.path, (old, old))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_md5(self):
+        '''md5 of file and empty file'''
+        empty = os.path.join(self.tmpdir, 'empty')
+        open(empty, 'w').close()
+        self.assertEqual({self.path: hashlib.md5('x' * 100).hexdigest(),
+                          empty: hashlib.md5('').hexdigest()},
+                         DigestCache(None).md5_many([self.path, empty]))
+
+    def test_hardlink_not_hashed_again(self):
+        '''hardlink of hashed file in another dir is got from cache'''
+        cache = DigestCache(self.cachefile)
+        cache.md5(self.path)
+        cache.save()
+
+        link = os.path.join(self.tmpdir, 'cache', 'fake-1.0.tar.gz')
+        os.link(self.path, link)
+        with patch('gitbuildsys.utils.file_md5') as mocked:
+            digest = DigestCache(self.cachefile).md5(link)
+        self.assertFalse(mocked.called)
+        self.assertEqual(file_md5(self.path), digest)
+
+    def test_racy_file_not_kept(self):
+        '''digest of just modified file is not kept'''
+        cache = DigestCache(self.cachefile)
+        now = time.time()
+        os.utime(self.path, (now, now))
+        cache.md5(self.path)
+        self.assertEqual({}, cache.digests)
+
+    def test_mtime_ns(self):
+        '''sub-microsecond mtime change gives another key'''
+        stat = os.stat(self.path)
+        with patch('gitbuildsys.utils.os.stat') as mocked:
+            mocked.return_value = stat
+            key = DigestCache.file_key(self.path)[0]
+            changed = Mock(spec=['st_dev', 'st_ino', 'st_size', 'st_mtime'])
+            changed.st_dev, changed.st_ino, changed.st_size = \
+                stat.st_dev, stat.st_ino, stat.st_size
+            changed.st_mtime = stat.st_mtime + 0.0000005
+            mocked.return_value = changed
+            self.assertNotEqual(key, DigestCache.file_key(self.path)[0])
+
+    def test_changed_file(self):
+        '''changed file is hashed again'''
+        cache = DigestCache(self.cachefile)
+        cache.md5(self.path)
+        with open(self.path, 'a') as fobj:
+            fobj.write('y')
+        self.assertEqual(hashlib.md5('x' * 100 + 'y').hexdigest(),
+                         cache.md5(self.path))
@@ -0,0 +1,88 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for compression backends of exported archives"""
+
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from gitbuildsys.compression import Compression, find_command
+from gitbuildsys.errors import GbsError
+
+DATA = 'gbs compression test data\n' * 1000
+
+
+class CompressionTest(unittest.TestCase):
+    '''Test Compression backends like git-buildpackage uses them'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-compression-')
+        self.output = os.path.join(self.tmpdir, 'out.tar.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _compress(self, comp_type):
+        '''pipe DATA to compressor as git-buildpackage does'''
+        proc = subprocess.Popen('%s -c -6 > %s' % (comp_type, self.output),
+                                shell=True, stdin=subprocess.PIPE)
+        proc.communicate(DATA)
+        return proc.returncode
+
+    def test_parallel_gzip(self):
+        '''output of parallel gzip can be read by gzip'''
+        with Compression('parallel', 2) as compression:
+            self.assertEqual(0, self._compress('gzip'))
+        with gzip.open(self.output) as fobj:
+            self.assertEqual(DATA, fobj.read())
+
+        self.assertEqual(1, len(compression.stats))
+        self.assertEqual('gzip', compression.stats[0]['type'])
+        self.assertEqual(len(DATA), compression.stats[0]['input'])
+        self.assertEqual(os.path.getsize(self.output),
+                         compression.stats[0]['output'])
+
+    def test_serial(self):
+        '''serial backend runs the original compressor'''
+        with Compression('serial') as compression:
+            self.assertEqual(0, self._compress('gzip'))
+        self.assertEqual(find_command('gzip'),
+                         compression.stats[0]['command'])
+
+    def test_default(self):
+        '''default backend doesn't change PATH'''
+        path = os.environ['PATH']
+        with Compression('default') as compression:
+            self.assertEqual(path, os.environ['PATH'])
+            self.assertEqual(0, self._compress('gzip'))
+        self.assertEqual([], compression.stats)
+
+    def test_path_restored(self):
+        '''PATH is restored after compression'''
+        path = os.environ['PATH']
+        with Compression('parallel'):
+            self.assertNotEqual(path, os.environ['PATH'])
+        self.assertEqual(path, os.environ['PATH'])
+
+    def test_unknown_backend(self):
+        '''unknown backend is an error'''
+        self.assertRaises(GbsError, Compression, 'fastest')
@@ -1,14 +1,39 @@
 """Functionality tests for gbs export."""
 
 import unittest
+import argparse
 import imp
 import os
+import re
 import shutil
 import tempfile
+import subprocess
 from nose.tools import eq_
+from mock import patch
+
+from gitbuildsys.cache import FileCache
+from gitbuildsys.errors import GbsError, Usage
+from gitbuildsys.cmd_export import render_specs, store_export, \
+                                   restore_export, export_packages, \
+                                   get_export_cache_dir, get_export_cache_key
 
 GBS = imp.load_source("gbs", "./tools/gbs").main
 
+SPEC = """Name: %s
+Version: 1.0
+Release: 1
+Summary: fake
+License: GPL
+Source0: fake-1.0.tar.gz
+%s
+%%description
+fake
+
+%%prep
+%%setup -q
+%s
+"""
+
 class TestExport(unittest.TestCase):
     """Test export output of gbs commands"""
 
@@ -77,3 +102,192 @@ class TestExport(unittest.TestCase):
         except SystemExit as err:
             eq_(err.code, 2)
 
+
+
+class TestRenderSpecs(unittest.TestCase):
+    """Test rendering extra specs against main exported spec"""
+
+    def setUp(self):
+        self.export_dir = tempfile.mkdtemp(prefix='test-gbs-export-')
+
+    def tearDown(self):
+        shutil.rmtree(self.export_dir)
+
+    def _write(self, name, tags='', macros=''):
+        """write spec file to export dir"""
+        with open(os.path.join(self.export_dir, name), 'w') as fobj:
+            fobj.write(SPEC % (name[:-5], tags, macros))
+
+    def _read(self, name):
+        """read spec file from export dir"""
+        with open(os.path.join(self.export_dir, name)) as fobj:
+            return fobj.read()
+
+    def test_render(self):
+        """patches and VCS tag of main spec are used for rest specs"""
+        self._write('fake.spec', 'Patch0: 0001-fix.patch\nVCS: fake#1234',
+                    '# 0001-fix.patch\n%patch0 -p1')
+        self._write('fake-extra.spec')
+        self.assertTrue(render_specs(self.export_dir, 'fake.spec',
+                                     ['fake-extra.spec'], True))
+        content = self._read('fake-extra.spec')
+        self.assertTrue(re.search(r'^Patch0:\s*0001-fix.patch$', content,
+                                  re.M))
+        self.assertTrue('%patch0 -p1' in content)
+        self.assertTrue(re.search(r'^VCS:\s*fake#1234$', content, re.M))
+
+    def test_no_patch_export(self):
+        """patches are kept if they are not exported"""
+        self._write('fake.spec', 'VCS: fake#1234')
+        self._write('fake-extra.spec', 'Patch0: own.patch', '%patch0 -p1')
+        self.assertTrue(render_specs(self.export_dir, 'fake.spec',
+                                     ['fake-extra.spec'], False))
+        content = self._read('fake-extra.spec')
+        self.assertTrue('Patch0: own.patch' in content)
+        self.assertTrue('fake#1234' in content)
+
+    def test_conditional_patches(self):
+        """conditional patches need separate export"""
+        self._write('fake.spec', 'Patch0: 0001-fix.patch',
+                    '%ifarch armv7l\n%patch0 -p1\n%endif')
+        self._write('fake-extra.spec')
+        self.assertFalse(render_specs(self.export_dir, 'fake.spec',
+                                      ['fake-extra.spec'], True))
+
+    def test_conditional_patches_extra(self):
+        """conditional patches of extra spec need separate export"""
+        self._write('fake.spec', 'Patch0: 0001-fix.patch', '%patch0 -p1')
+        self._write('fake-extra.spec', 'Patch0: own.patch',
+                    '%if 0%{?extra}\n%patch0 -p1\n%endif')
+        self.assertFalse(render_specs(self.export_dir, 'fake.spec',
+                                      ['fake-extra.spec'], True))
+        self.assertTrue('own.patch' in self._read('fake-extra.spec'))
+
+    def test_other_upstream(self):
+        """spec of another upstream version needs separate export"""
+        self._write('fake.spec', 'Patch0: 0001-fix.patch', '%patch0 -p1')
+        self._write('fake-extra.spec')
+        content = self._read('fake-extra.spec').replace(
+            'Version: 1.0', 'Version: 2.0')
+        with open(os.path.join(self.export_dir, 'fake-extra.spec'),
+                  'w') as fobj:
+            fobj.write(content)
+        self.assertFalse(render_specs(self.export_dir, 'fake.spec',
+                                      ['fake-extra.spec'], True))
+        self.assertFalse('0001-fix.patch' in self._read('fake-extra.spec'))
+
+    def test_other_tarball(self):
+        """spec of another upstream tarball needs separate export"""
+        self._write('fake.spec', 'Patch0: 0001-fix.patch', '%patch0 -p1')
+        self._write('fake-extra.spec')
+        content = self._read('fake-extra.spec').replace(
+            'Source0: fake-1.0.tar.gz', 'Source0: extra-1.0.tar.gz')
+        with open(os.path.join(self.export_dir, 'fake-extra.spec'),
+                  'w') as fobj:
+            fobj.write(content)
+        self.assertFalse(render_specs(self.export_dir, 'fake.spec',
+                                      ['fake-extra.spec'], True))
+        self.assertFalse('0001-fix.patch' in self._read('fake-extra.spec'))
+
+
+class TestExportCache(unittest.TestCase):
+    """Test storing and restoring exported files"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-export-cache-')
+        self.cache = FileCache(os.path.join(self.tmpdir, 'cache'))
+        self.export_dir = os.path.join(self.tmpdir, 'export')
+        os.mkdir(self.export_dir)
+        for fname in ('fake.spec', 'fake-1.0.tar.gz', '0001-fix.patch'):
+            with open(os.path.join(self.export_dir, fname), 'w') as fobj:
+                fobj.write(fname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store_and_restore(self):
+        """packaging files are copied and generated files are linked"""
+        self.assertTrue(store_export(self.cache, 'key', ['argv0'],
+                                     self.export_dir, self.tmpdir,
+                                     set(['fake.spec'])))
+        # rewriting exported spec doesn't change the cached one
+        with open(os.path.join(self.export_dir, 'fake.spec'), 'w') as fobj:
+            fobj.write('changed')
+
+        entry = self.cache.get('key')
+        self.assertEqual(['argv0'], entry.meta['gbp_args'])
+        restored = os.path.join(self.tmpdir, 'restored')
+        os.mkdir(restored)
+        restore_export(entry, restored, set(['fake.spec']))
+
+        self.assertEqual(sorted(os.listdir(self.export_dir)),
+                         sorted(os.listdir(restored)))
+        with open(os.path.join(restored, 'fake.spec')) as fobj:
+            self.assertEqual('fake.spec', fobj.read())
+        self.assertNotEqual(
+            os.stat(os.path.join(restored, 'fake.spec')).st_ino,
+            os.stat(entry.filepath('fake.spec')).st_ino)
+        self.assertEqual(
+            os.stat(os.path.join(restored, 'fake-1.0.tar.gz')).st_ino,
+            os.stat(entry.filepath('fake-1.0.tar.gz')).st_ino)
+
+    def test_cache_dir(self):
+        """export cache is kept under the build root"""
+        with patch.dict(os.environ, {'TIZEN_BUILD_ROOT': self.tmpdir}):
+            self.assertEqual(os.path.join(self.tmpdir, 'local', 'gbscache',
+                                          'export'),
+                             get_export_cache_dir())
+
+    def test_cache_key_verbose(self):
+        """verbose output of --debug doesn't change cache key"""
+        for cmd in (['git', 'init', '-q'], ['git', 'add', '.'],
+                    ['git', '-c', 'user.name=gbs', '-c', 'user.email=gbs@test',
+                     'commit', '-q', '-m', 'init']):
+            subprocess.check_call(cmd, cwd=self.export_dir)
+        repo = argparse.Namespace(path=self.export_dir)
+        args = argparse.Namespace(upstream_branch='upstream',
+                                  fallback_to_native=None)
+        gbp_args = ['argv0', '--git-export=HEAD', '--git-export-dir=/tmp/a']
+        key = get_export_cache_key(repo, 'HEAD', gbp_args, args)
+        self.assertNotEqual(None, key)
+        self.assertEqual(key, get_export_cache_key(
+            repo, 'HEAD', gbp_args + ['--git-verbose'], args))
+        self.assertNotEqual(key, get_export_cache_key(
+            repo, 'HEAD', gbp_args + ['--git-pristine-tar'], args))
+
+
+class TestExportPackages(unittest.TestCase):
+    """Test exporting multiple packages in worker processes"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-export-packages-')
+        self.paths = []
+        for name in ('one', 'two', 'three'):
+            self.paths.append(os.path.join(self.tmpdir, name))
+            os.mkdir(self.paths[-1])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def _args(**kwargs):
+        """get export arguments"""
+        args = argparse.Namespace(gitdir=None, outdir=None, spec=None,
+                                  commit=None, include_all=False, jobs=2,
+                                  outdir_directly=False)
+        args.__dict__.update(kwargs)
+        return args
+
+    def test_failed_packages(self):
+        """failures of all packages are reported together"""
+        try:
+            export_packages(self._args(), self.paths)
+        except GbsError as err:
+            eq_('3 of 3 packages failed to be exported', err.args[0])
+        else:
+            self.fail('GbsError not raised')
+
+    def test_spec_with_multiple_packages(self):
+        """--spec can't be used for multiple packages"""
+        self.assertRaises(Usage, export_packages,
+                          self._args(spec='one.spec'), self.paths)
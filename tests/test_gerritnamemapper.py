@@ -0,0 +1,174 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for classes GerritNameMapper and PkgDependsGraph"""
+
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from gitbuildsys.cache import FileCache
+from gitbuildsys.utils import GerritNameMapper, PkgDependsGraph
+
+PKGXML = '''<builddepinfo>
+<package name="glib2"><source>glib2</source>
+<subpkg>glib2-debuginfo</subpkg><subpkg>libglib</subpkg>
+<subpkg>glib2-devel</subpkg></package>
+<package name="gtk3"><source>gtk3-src</source><subpkg>gtk3</subpkg>
+</package>
+<package name="bash"><source>bash</source></package>
+</builddepinfo>'''
+
+PRIMARY = '''<?xml version="1.0"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" packages="3">
+<package type="rpm"><name>glib2</name>
+<version epoch="0" ver="2.36" rel="1" vcs="platform/upstream/glib2#abc"/>
+</package>
+<package type="rpm"><name>gtk3</name>
+<version epoch="0" ver="3.8" rel="1" vcs="platform/upstream/gtk3#def"/>
+</package>
+<package type="rpm"><name>nogit</name>
+<version epoch="0" ver="1" rel="1"/></package>
+</metadata>'''
+
+# app needs gtk3-devel of gtk3, which needs libglib of glib2, in
+# revpkgdepends.xml pkgdep are packages depending on the package
+REVDEPENDSXML = '''<builddepinfo>
+<package name="glib2"><source>glib2</source><pkgdep>gtk3</pkgdep>
+<subpkg>libglib</subpkg></package>
+<package name="gtk3"><source>gtk3</source><pkgdep>app-devel</pkgdep>
+<pkgdep>unknown</pkgdep><subpkg>gtk3-devel</subpkg></package>
+<package name="app"><source>app</source><subpkg>app-devel</subpkg>
+</package>
+<package name="bash"><source>bash</source></package>
+<package name="perl"><source>perl</source><pkgdep>perl-tools</pkgdep>
+</package>
+<package name="perl-tools"><source>perl-tools</source><pkgdep>perl</pkgdep>
+</package>
+</builddepinfo>'''
+
+# same packages in pkgdepends.xml, pkgdep are packages it depends on
+DEPENDSXML = '''<builddepinfo>
+<package name="glib2"><source>glib2</source><subpkg>libglib</subpkg>
+</package>
+<package name="gtk3"><source>gtk3</source><pkgdep>libglib</pkgdep>
+<pkgdep>unknown</pkgdep><subpkg>gtk3-devel</subpkg></package>
+<package name="app"><source>app</source><pkgdep>gtk3-devel</pkgdep>
+</package>
+<package name="bash"><source>bash</source></package>
+<package name="perl"><source>perl</source><pkgdep>perl-tools</pkgdep>
+</package>
+<package name="perl-tools"><source>perl-tools</source><pkgdep>perl</pkgdep>
+</package>
+</builddepinfo>'''
+
+
+class GerritNameMapperTest(unittest.TestCase):
+    '''Test GerritNameMapper class'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-gnmapper-')
+        self.pkgxml = os.path.join(self.tmpdir, 'pkgs.xml')
+        with open(self.pkgxml, 'w') as fobj:
+            fobj.write(PKGXML)
+        self.primary = os.path.join(self.tmpdir, 'primary.xml.gz')
+        fobj = gzip.open(self.primary, 'wb')
+        fobj.write(PRIMARY)
+        fobj.close()
+        self.cache = FileCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check(self, mapper):
+        '''check mapping of test data'''
+        self.assertEqual('platform/upstream/glib2',
+                         mapper.get_gerritname_by_obsname('glib2'))
+        # source name not in primary, mapped by subpackage
+        self.assertEqual('platform/upstream/gtk3',
+                         mapper.get_gerritname_by_obsname('gtk3'))
+        self.assertEqual('platform/upstream/gtk3',
+                         mapper.get_gerritname_by_srcname('gtk3-src'))
+        self.assertEqual(None, mapper.get_gerritname_by_obsname('bash'))
+        self.assertEqual(None, mapper.get_gerritname_by_obsname('nothing'))
+        self.assertEqual('gtk3', mapper.get_pkgname_by_srcname('gtk3-src'))
+
+    def test_mapping(self):
+        '''names are mapped from pkgs and primary xml'''
+        self._check(GerritNameMapper(self.pkgxml, self.primary))
+
+    def test_cached_index(self):
+        '''index is reused from cache'''
+        self._check(GerritNameMapper(self.pkgxml, self.primary, self.cache))
+        self.assertEqual(1, self.cache.misses)
+        self._check(GerritNameMapper(self.pkgxml, self.primary, self.cache))
+        self.assertEqual(1, self.cache.hits)
+
+    def test_bad_xml(self):
+        '''broken xml is not cached'''
+        with open(self.pkgxml, 'w') as fobj:
+            fobj.write('<builddepinfo><package name="a">')
+        mapper = GerritNameMapper(self.pkgxml, self.primary, self.cache)
+        self.assertEqual(None, mapper.get_pkgname_by_srcname('a'))
+        self.assertEqual([], os.listdir(self.cache.cachedir)
+                         if os.path.exists(self.cache.cachedir) else [])
+
+
+class PkgDependsGraphTest(unittest.TestCase):
+    '''Test PkgDependsGraph class'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-depgraph-')
+        self.pkgxml = os.path.join(self.tmpdir, 'pkgdepends.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _graph(self, content, reverse):
+        '''graph of xml content'''
+        with open(self.pkgxml, 'w') as fobj:
+            fobj.write(content)
+        return PkgDependsGraph(self.pkgxml, reverse)
+
+    def _check(self, graph):
+        '''check reverse depends of test data'''
+        self.assertEqual(set(['gtk3', 'app']),
+                         graph.get_reverse_depends('glib2'))
+        self.assertEqual(set(['app']), graph.get_reverse_depends('gtk3'))
+        self.assertEqual(set(), graph.get_reverse_depends('app'))
+        self.assertEqual(set(), graph.get_reverse_depends('bash'))
+        # cycle is walked once
+        self.assertEqual(set(['perl-tools']),
+                         graph.get_reverse_depends('perl'))
+        self.assertTrue('bash' in graph)
+        self.assertFalse('unknown' in graph)
+
+    def test_revpkgdepends(self):
+        '''packages depending on package are got from revpkgdepends.xml'''
+        self._check(self._graph(REVDEPENDSXML, True))
+
+    def test_pkgdepends(self):
+        '''packages depending on package are got from pkgdepends.xml'''
+        self._check(self._graph(DEPENDSXML, False))
+
+    def test_bad_xml(self):
+        '''broken xml gives empty graph'''
+        self.assertFalse('a' in self._graph('<builddepinfo><package name="a">',
+                                            True))
@@ -0,0 +1,183 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for reading specs from git revisions"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from mock import patch
+
+from gitbuildsys.utils import GitCatFile, Workdir, guess_spec, \
+                              show_file_from_rev, file_exists_in_rev, \
+                              glob_in_rev, get_git_reader, close_git_readers
+
+
+def make_repo():
+    '''create git repo with specs under rpm/, packaging links to rpm'''
+    repo = tempfile.mkdtemp(prefix='test-gbs-catfile-')
+    os.mkdir(os.path.join(repo, 'rpm'))
+    for name in ('extra.spec', '%s.spec' % os.path.basename(repo)):
+        with open(os.path.join(repo, 'rpm', name), 'w') as fobj:
+            fobj.write('Name: %s\n' % name)
+    os.symlink('rpm', os.path.join(repo, 'packaging'))
+    for cmd in (['init', '-q'], ['add', '.'],
+                ['-c', 'user.name=gbs', '-c', 'user.email=gbs@test',
+                 'commit', '-q', '-m', 'init']):
+        subprocess.check_call(['git'] + cmd, cwd=repo)
+    return repo
+
+
+class GitCatFileTest(unittest.TestCase):
+    '''Test GitCatFile class and guess_spec with it'''
+
+    def setUp(self):
+        self.repo = make_repo()
+        self.reader = GitCatFile(self.repo)
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(self.repo)
+
+    def test_show(self):
+        '''file content is read from revision'''
+        self.assertEqual('Name: extra.spec\n',
+                         self.reader.show('rpm/extra.spec', 'HEAD'))
+        self.assertEqual(None, self.reader.show('rpm/none.spec', 'HEAD'))
+        self.assertEqual(None, self.reader.show('rpm', 'HEAD'))
+
+    def test_listdir(self):
+        '''entries of directory are listed in git order'''
+        self.assertEqual([('packaging', 'blob'), ('rpm', 'tree')],
+                         self.reader.listdir('', 'HEAD'))
+        self.assertEqual(None, self.reader.listdir('packaging', 'HEAD'))
+
+    def test_guess_spec(self):
+        '''guess_spec gives same result with and without reader'''
+        self.assertEqual(guess_spec(self.repo, 'packaging', None, 'HEAD'),
+                         guess_spec(self.repo, 'packaging', None, 'HEAD',
+                                    self.reader))
+        self.assertEqual(guess_spec(self.repo, 'packaging', 'extra.spec',
+                                    'HEAD'),
+                         guess_spec(self.repo, 'packaging', 'extra.spec',
+                                    'HEAD', self.reader))
+
+    def test_exists(self):
+        '''existence of files and dirs is checked'''
+        self.assertTrue(self.reader.exists('rpm/extra.spec', 'HEAD'))
+        self.assertTrue(self.reader.exists('rpm', 'HEAD', dir_only=True))
+        self.assertFalse(self.reader.exists('rpm/extra.spec', 'HEAD',
+                                            dir_only=True))
+        self.assertFalse(self.reader.exists('none', 'HEAD'))
+        self.assertFalse(self.reader.exists('rpm', 'nobranch'))
+
+    def test_tree_cache(self):
+        '''parsed trees are cached and bounded'''
+        self.reader.TREE_CACHE_SIZE = 1
+        self.reader.listdir('rpm', 'HEAD')
+        self.reader.listdir('', 'HEAD')
+        self.assertEqual(1, len(self.reader._trees))
+        self.assertEqual([('extra.spec', 'blob'),
+                          ('%s.spec' % os.path.basename(self.repo), 'blob')],
+                         sorted(self.reader.listdir('rpm', 'HEAD')))
+
+    def test_helpers(self):
+        '''helper functions use shared reader'''
+        self.assertEqual('Name: extra.spec\n',
+                         show_file_from_rev(self.repo, 'rpm/extra.spec',
+                                            'HEAD'))
+        self.assertTrue(file_exists_in_rev(self.repo, 'rpm', 'HEAD', True))
+        self.assertEqual(['rpm/extra.spec'],
+                         glob_in_rev(self.repo, 'rpm/ex*.spec', 'HEAD'))
+
+
+class ThreadSafetyTest(unittest.TestCase):
+    '''Run git helpers from many threads at once'''
+
+    def setUp(self):
+        self.repos = [make_repo() for _ in range(4)]
+        self.olddir = os.getcwd()
+
+    def tearDown(self):
+        for repo in self.repos:
+            shutil.rmtree(repo)
+
+    @staticmethod
+    def lookup(repo):
+        '''run all helpers on repo'''
+        main_spec, rest_specs = guess_spec(repo, 'packaging', None, 'HEAD')
+        return (main_spec, rest_specs,
+                show_file_from_rev(repo, main_spec, 'HEAD'),
+                file_exists_in_rev(repo, 'rpm', 'HEAD', dir_only=True),
+                glob_in_rev(repo, 'rpm/*.spec', 'HEAD'),
+                guess_spec(repo, 'packaging', None)[0])
+
+    def test_parallel_lookups(self):
+        '''helpers give same results in threads, while cwd is changed'''
+        expected = [self.lookup(repo) for repo in self.repos]
+        stop = threading.Event()
+
+        def change_cwd():
+            '''keep changing cwd of the process'''
+            while not stop.is_set():
+                for repo in self.repos:
+                    with Workdir(repo):
+                        pass
+
+        thread = threading.Thread(target=change_cwd)
+        thread.start()
+        pool = ThreadPool(16)
+        try:
+            results = pool.map(self.lookup, self.repos * 25)
+        finally:
+            pool.terminate()
+            stop.set()
+            thread.join()
+
+        self.assertEqual(expected * 25, results)
+        self.assertEqual(self.olddir, os.getcwd())
+
+    @patch('gitbuildsys.utils.GIT_READERS_SIZE', 1)
+    def test_evicted_reader(self):
+        '''reader evicted from shared readers is not closed under its user'''
+        close_git_readers()
+        reader = get_git_reader(self.repos[0])
+        self.assertEqual('blob', reader.info('HEAD:rpm/extra.spec')[1])
+        get_git_reader(self.repos[1])
+        self.assertTrue(reader is not get_git_reader(self.repos[0]))
+        self.assertTrue(reader._procs)
+        self.assertEqual('blob', reader.info('HEAD:rpm/extra.spec')[1])
+        reader.close()
+        self.assertFalse(reader._procs)
+
+    @patch('gitbuildsys.utils.GIT_READERS_SIZE', 1)
+    def test_parallel_eviction(self):
+        '''helpers work in threads while shared readers are evicted'''
+        close_git_readers()
+        expected = [self.lookup(repo) for repo in self.repos]
+        pool = ThreadPool(16)
+        try:
+            results = pool.map(self.lookup, self.repos * 25)
+        finally:
+            pool.terminate()
+        self.assertEqual(expected * 25, results)
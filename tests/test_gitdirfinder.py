@@ -0,0 +1,77 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for class GitDirFinder"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gitbuildsys.utils import GitDirFinder
+
+
+class GitDirFinderTest(unittest.TestCase):
+    '''Test GitDirFinder class'''
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp(prefix='test-gbs-gitdirfinder-')
+        for project in ('platform/core/glib2', 'platform/upstream/bash',
+                        'platform/upstream/bash/nested', 'tools/gbs'):
+            os.makedirs(os.path.join(self.top, project, '.git'))
+        os.makedirs(os.path.join(self.top, 'platform', 'upstream', 'bash',
+                                 'packaging'))
+        with open(os.path.join(self.top, 'platform', 'upstream', 'bash',
+                               'packaging', 'bash.spec'), 'w') as fobj:
+            fobj.write('Name: bash\n')
+        os.makedirs(os.path.join(self.top, 'docs', 'empty'))
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+
+    def _path(self, *projects):
+        '''get full path of projects'''
+        return [os.path.join(self.top, project) for project in projects]
+
+    def test_walk(self):
+        '''projects are found without descending into them'''
+        finder = GitDirFinder(self.top)
+        self.assertEqual(self._path('platform/core/glib2',
+                                    'platform/upstream/bash', 'tools/gbs'),
+                         finder.paths)
+        self.assertEqual(self._path('platform/upstream/bash/packaging/'
+                                    'bash.spec'), finder.specs)
+
+    def test_project_dir(self):
+        '''given dir is a git project'''
+        finder = GitDirFinder(os.path.join(self.top, 'tools', 'gbs'))
+        self.assertEqual(self._path('tools/gbs'), finder.paths)
+
+    def test_project_list(self):
+        '''projects are read from .repo/project.list'''
+        os.mkdir(os.path.join(self.top, '.repo'))
+        with open(os.path.join(self.top, '.repo', 'project.list'),
+                  'w') as fobj:
+            fobj.write('platform/core/glib2\nplatform/upstream/bash\n'
+                       'platform/not/synced\n')
+        self.assertEqual(self._path('platform/core/glib2',
+                                    'platform/upstream/bash'),
+                         GitDirFinder(self.top).paths)
+        self.assertEqual(self._path('platform/upstream/bash'),
+                         GitDirFinder(os.path.join(self.top, 'platform',
+                                                   'upstream')).paths)
@@ -0,0 +1,112 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for syncing git-ref-mapping"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from mock import patch
+
+from gitbuildsys.errors import GbsError
+from gitbuildsys.utils import GitRefMappingParser
+
+
+class GitRefMappingSyncTest(unittest.TestCase):
+    '''Test GitRefMappingParser.sync'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-refmapping-')
+        self.env = patch.dict(os.environ, {'HOME': self.tmpdir})
+        self.env.start()
+        self.upstream = os.path.join(self.tmpdir, 'upstream')
+        os.mkdir(self.upstream)
+        with open(os.path.join(self.upstream, 'git-ref-mapping.xml'),
+                  'w') as fobj:
+            fobj.write('<mapping><branch name="tizen_unified" '
+                       'OBS_project="Tizen:Unified" '
+                       'OBS_staging_project="Tizen:Unified:ref:20170101.1"/>'
+                       '</mapping>\n')
+        self._commit('init')
+        self.parser = GitRefMappingParser('file://%s' % self.upstream)
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _commit(self, msg):
+        '''commit all files of upstream git-ref-mapping'''
+        for cmd in (['git', 'init', '-q'], ['git', 'add', '.'],
+                    ['git', '-c', 'user.name=gbs', '-c',
+                     'user.email=gbs@test', 'commit', '-q',
+                     '--allow-empty', '-m', msg]):
+            subprocess.check_call(cmd, cwd=self.upstream)
+
+    def _stamp(self):
+        '''path of last sync stamp'''
+        return os.path.join(self.parser.workdir, '.git', 'gbs-last-sync')
+
+    def _head(self):
+        '''commit id of upstream HEAD'''
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=self.upstream).strip()
+
+    def test_clone(self):
+        '''first sync clones git-ref-mapping'''
+        self.parser.sync()
+        self.assertTrue(os.path.isfile(self.parser.refxml))
+        self.assertTrue(os.path.isfile(self._stamp()))
+
+    def test_offline_without_clone(self):
+        '''offline sync fails if git-ref-mapping was never fetched'''
+        self.assertRaises(GbsError, self.parser.sync, True)
+
+    def test_failed_fetch(self):
+        '''failed fetch doesn't suppress fetching again'''
+        self.parser.sync()
+        os.unlink(self._stamp())
+        shutil.rmtree(self.upstream)
+
+        self.parser.sync()
+        self.assertFalse(os.path.exists(self._stamp()))
+        self.assertTrue(os.path.isfile(self.parser.refxml))
+
+    def test_fetch(self):
+        '''new commits are fetched after ttl'''
+        self.parser.sync()
+        self._commit('update')
+        self.parser.sync()
+        self.assertNotEqual(self._head(), self.parser.head())
+
+        self.parser.sync(ttl=0)
+        self.assertEqual(self._head(), self.parser.head())
+
+    def test_parse_without_fetch(self):
+        '''parse uses synced git-ref-mapping without fetching again'''
+        self.parser.sync()
+        os.unlink(self._stamp())
+        shutil.rmtree(self.upstream)
+        self.parser.sync()
+
+        with patch.object(self.parser, '_git') as mocked:
+            self.assertEqual({'Tizen:Unified': '20170101.1'},
+                             self.parser.parse())
+        self.assertFalse(mocked.called)
@@ -0,0 +1,102 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for working tree status of git repositories"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import argparse
+import subprocess
+
+from mock import patch
+
+from gbp.rpm.git import RpmGitRepository
+
+from gitbuildsys.utils import worktree_status, git_status_checker
+
+
+class WorktreeStatusTest(unittest.TestCase):
+    '''Test worktree_status against gbp's status()'''
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp(prefix='test-gbs-status-')
+        for name in ('a.c', 'b.c', 'c d.c', 'old.c'):
+            self._write(name, name)
+        self._git('init', '-q')
+        self._git('add', '.')
+        self._git('-c', 'user.name=gbs', '-c', 'user.email=gbs@test',
+                  'commit', '-q', '-m', 'init')
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def _git(self, *args):
+        '''run git command in repo'''
+        subprocess.check_call(('git',) + args, cwd=self.repo)
+
+    def _write(self, name, content):
+        '''write file in repo'''
+        with open(os.path.join(self.repo, name), 'w') as fobj:
+            fobj.write(content)
+
+    def test_clean(self):
+        '''status of clean tree is empty'''
+        self.assertFalse(worktree_status(self.repo, refresh=True))
+
+    def test_same_as_gbp(self):
+        '''status has the same flags and paths as gbp's status()'''
+        self._write('a.c', 'changed')
+        self._write('b.c', 'staged')
+        self._git('add', 'b.c')
+        self._write('c d.c', 'space')
+        self._git('mv', 'old.c', 'new.c')
+        self._write('untracked.c', '')
+        os.mkdir(os.path.join(self.repo, 'build'))
+        self._write('build/out.o', '')
+
+        self.assertEqual(dict(RpmGitRepository(self.repo).status()),
+                         dict(worktree_status(self.repo, refresh=True)))
+
+    def test_memoized(self):
+        '''status is scanned once unless refreshed'''
+        self.assertFalse(worktree_status(self.repo, refresh=True))
+        self._write('untracked.c', '')
+        self.assertFalse(worktree_status(self.repo))
+        self.assertEqual(['untracked.c'],
+                         worktree_status(self.repo, refresh=True)['??'])
+
+    def test_no_untracked_cache(self):
+        '''untracked cache setting of user is not changed'''
+        worktree_status(self.repo, refresh=True)
+        # index has no untracked cache extension
+        with open(os.path.join(self.repo, '.git', 'index'), 'rb') as fobj:
+            self.assertFalse('UNTR' in fobj.read())
+
+    def test_checker_rename(self):
+        '''renamed files are shown as old -> new in warnings'''
+        self._git('mv', 'old.c', 'new.c')
+        worktree_status(self.repo, refresh=True)
+        opts = argparse.Namespace(commit=None, include_all=False)
+        with patch('gitbuildsys.utils.log') as log:
+            git_status_checker(RpmGitRepository(self.repo), opts)
+        warnings = ''.join(args[0] for args, _kwargs in
+                           log.warning.call_args_list)
+        self.assertTrue('\n   old.c -> new.c' in warnings)
+        self.assertFalse('\0' in warnings)
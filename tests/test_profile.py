@@ -115,6 +115,14 @@ class ProfileStyleTest(unittest.TestCase):
         self.assertEquals(None, profile.obs)
         self.assertEquals([], profile.repos)
 
+    @Fixture(home='compression.ini')
+    def test_compression(self):
+        'test read compression backend of profile'
+        profile = get_profile()
+
+        self.assertEquals('parallel', profile.compression)
+        self.assertEquals(4, profile.compression_threads)
+
     @Fixture(home='profile.ini')
     def test_local_repo_need_not_auth(self):
         '''test local path needn't auth info'''
@@ -0,0 +1,375 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for submitting multiple packages with remotebuild"""
+
+import os
+import errno
+import socket
+import urllib2
+import shutil
+import argparse
+import tempfile
+import unittest
+from xml.etree import cElementTree as ET
+
+from nose.tools import eq_
+
+from gitbuildsys.errors import GbsError, Usage, ObsError
+from gitbuildsys import oscapi
+from gitbuildsys.oscapi import MetaCache, OSC
+from gitbuildsys.cmd_remotebuild import find_packages, submit_packages, \
+     prepare_project, submit_package, watch_status, WATCH_FAILED, \
+     WATCH_MAX_EMPTY
+
+from fakeobs import FakeOBS
+
+class FakeAPI(object):
+    '''OSC API recording project lookups'''
+
+    apiurl = 'https://api.example.com'
+
+    def __init__(self):
+        self.calls = []
+
+    def exists(self, prj, pkg=''):
+        '''target project exists, packages don't'''
+        self.calls.append(('exists', prj, pkg))
+        return not pkg
+
+    def get_repos_of_project(self, prj):
+        '''one build repo'''
+        self.calls.append(('get_repos_of_project', prj))
+        return ['standard']
+
+
+class RemotebuildPackagesTest(unittest.TestCase):
+    '''Test remotebuild of a tree of git projects'''
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp(prefix='test-gbs-remotebuild-')
+        for project in ('platform/core/glib2', 'platform/upstream/bash',
+                        'tools/gbs'):
+            os.makedirs(os.path.join(self.top, project, '.git'))
+        self.exportdir = os.path.join(self.top, 'export')
+        os.mkdir(self.exportdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+
+    def _args(self, **kwargs):
+        '''get remotebuild arguments'''
+        args = argparse.Namespace(gitdir=self.top, package_list='',
+                                  spec=None, commit=None, include_all=False,
+                                  buildlog=False, status=False, jobs=2)
+        args.__dict__.update(kwargs)
+        return args
+
+    def test_find_all(self):
+        '''all git projects are found without package list'''
+        eq_(['platform/core/glib2', 'platform/upstream/bash', 'tools/gbs'],
+            sorted(os.path.relpath(path, self.top)
+                   for path in find_packages(self._args())))
+
+    def test_package_list(self):
+        '''packages are selected by dir name or relative path'''
+        args = self._args(package_list='bash, tools/gbs,missing')
+        eq_(['platform/upstream/bash', 'tools/gbs'],
+            sorted(os.path.relpath(path, self.top)
+                   for path in find_packages(args)))
+
+    def test_spec_with_multiple_packages(self):
+        '''--spec can't be used for multiple packages'''
+        self.assertRaises(Usage, submit_packages,
+                          self._args(spec='bash.spec'), FakeAPI(),
+                          find_packages(self._args()), self.exportdir,
+                          'home:test:gbs', None, None)
+
+    def test_failed_packages(self):
+        '''project is checked once and failures are reported together'''
+        api = FakeAPI()
+        try:
+            submit_packages(self._args(), api, find_packages(self._args()),
+                            self.exportdir, 'home:test:gbs', None, None)
+        except GbsError as err:
+            eq_('3 of 3 packages failed to be submitted', err.args[0])
+        else:
+            self.fail('GbsError not raised')
+        eq_([('exists', 'home:test:gbs', ''),
+             ('get_repos_of_project', 'home:test:gbs')], api.calls)
+
+
+class OBSTest(unittest.TestCase):
+    '''Test build results and logs against local OBS API stand-in'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-watch-')
+        self.obs = FakeOBS()
+        self.obs.start()
+        self.api = self.obs.make_api(self.tmpdir)
+
+    def tearDown(self):
+        self.obs.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_succeeded(self):
+        '''polling stops when all builds succeeded'''
+        self.obs.results = [
+            [('standard', 'i586', 'building', 'building'),
+             ('standard', 'armv7l', 'building', 'scheduled')],
+            [('standard', 'i586', 'building', 'building'),
+             ('standard', 'armv7l', 'building', 'building')],
+            [('standard', 'i586', 'finished', 'succeeded'),
+             ('standard', 'armv7l', 'building', 'building')],
+            [('standard', 'i586', 'published', 'succeeded'),
+             ('standard', 'armv7l', 'published', 'succeeded')]]
+        eq_(0, watch_status(self.api, 'home:test:gbs', 'ail', 0, 0))
+        eq_(4, self.obs.polls)
+
+    def test_oldstate(self):
+        '''last state and filters are sent to build server'''
+        self.obs.results = [
+            [('standard', 'i586', 'building', 'building')],
+            [('standard', 'i586', 'published', 'succeeded')]]
+        watch_status(self.api, 'home:test:gbs', 'ail', 0, 0)
+        method, path, query = self.obs.requests[0]
+        eq_(('GET', 'build/home:test:gbs/_result'), (method, path))
+        eq_('ail', query['package'])
+        eq_('1', query['lastbuild'])
+        eq_('1', query['multibuild'])
+        assert 'oldstate' not in query
+        eq_('0', self.obs.requests[1][2]['oldstate'])
+
+    def test_failed(self):
+        '''failed builds give its exit code'''
+        self.obs.results = [
+            [('standard', 'i586', 'published', 'failed'),
+             ('standard', 'armv7l', 'published', 'succeeded')]]
+        eq_(WATCH_FAILED,
+            watch_status(self.api, 'home:test:gbs', 'ail', 0, 0))
+
+    def test_outdated(self):
+        '''results of dirty repos are not final'''
+        self.obs.results = [
+            [('standard', 'i586', 'published', 'failed', True)],
+            [('standard', 'i586', 'published', 'succeeded')]]
+        eq_(0, watch_status(self.api, 'home:test:gbs', 'ail', 0, 0))
+        eq_(2, self.obs.polls)
+
+    def test_no_results(self):
+        '''watching stops with error if there are never build results'''
+        self.obs.results = [[]]
+        self.assertRaises(GbsError, watch_status, self.api, 'home:test:gbs',
+                          'ail', 0, 0)
+        eq_(WATCH_MAX_EMPTY, self.obs.polls)
+
+    def test_late_results(self):
+        '''results appearing after empty polls are watched'''
+        self.obs.results = [[]] * (WATCH_MAX_EMPTY - 1) + [
+            [('standard', 'i586', 'published', 'succeeded')]]
+        eq_(0, watch_status(self.api, 'home:test:gbs', 'ail', 0, 0))
+
+    def test_buildlog_chunks(self):
+        '''build log is got in chunks without control characters'''
+        self.obs.buildlog = ''.join('line %d\x1b[0m\r\n' % i
+                                    for i in range(100))
+        chunk = oscapi.BUILDLOG_CHUNK
+        oscapi.BUILDLOG_CHUNK = 100
+        try:
+            eq_(''.join('line %d[0m\n' % i for i in range(100)),
+                self.api.get_buildlog('home:test:gbs', 'ail', 'standard',
+                                      'i586'))
+        finally:
+            oscapi.BUILDLOG_CHUNK = chunk
+        starts = [int(query['start'])
+                  for _method, _path, query in self.obs.requests]
+        eq_(range(0, len(self.obs.buildlog) + 1, 100), starts)
+
+    def test_buildlog_follow(self):
+        '''new log is got until package is built'''
+        self.obs.buildlog = 'start\n'
+        self.obs.statuses = [('building', 'line 2\x1b[0m\n'),
+                             ('building', 'line 1\x1b[0m\n'),
+                             ('succeeded', 'line 0\x1b[0m\n')]
+        eq_('start\nline 2[0m\nline 1[0m\nline 0[0m\n',
+            ''.join(self.api.iter_buildlog('home:test:gbs', 'ail',
+                                           'standard', 'i586', follow=True,
+                                           interval=0)))
+
+    def test_retry_after(self):
+        '''unavailable server is retried after time it asks for'''
+        self.obs.fail(503, count=2, headers={'Retry-After': '0'})
+        self.obs.results = [[('standard', 'i586', 'published', 'succeeded')]]
+        eq_(('0', {('standard', 'i586', 'ail'): ('succeeded', False)}),
+            self.api.get_last_results('home:test:gbs', 'ail'))
+        eq_(3, len(self.obs.requests))
+        eq_([1, 2], self.api.stats['GET build/_result'][:2])
+
+    def test_post_not_retried(self):
+        '''POST which reached the server is not retried'''
+        self.obs.add_project('home:test:gbs')
+        self.obs.fail(503, method='POST', headers={'Retry-After': '0'})
+        self.assertRaises(ObsError, self.api.rebuild, 'home:test:gbs',
+                          'ail', None)
+        eq_(1, len(self.obs.requests))
+        eq_([1, 0], self.api.stats['POST build'][:2])
+
+    def test_unsent(self):
+        '''only errors before request was sent are unsent'''
+        refused = socket.error(errno.ECONNREFUSED, 'Connection refused')
+        assert OSC.unsent(refused)
+        assert OSC.unsent(urllib2.URLError(refused))
+        assert OSC.unsent(urllib2.URLError(socket.gaierror(-2, 'unknown')))
+        assert not OSC.unsent(socket.error(errno.ECONNRESET, 'reset'))
+        assert not OSC.unsent(urllib2.URLError(socket.timeout('timed out')))
+        assert not OSC.unsent(urllib2.URLError('unknown url type'))
+
+    def test_not_found(self):
+        '''client errors are not retried'''
+        eq_(False, self.api.exists('home:test:gbs', 'ail'))
+        eq_([('GET', 'source/home:test:gbs/ail/_meta')],
+            [request[:2] for request in self.obs.requests])
+
+    def test_retry_budget(self):
+        '''retries stop when retry budget is spent'''
+        self.api.retry_budget = 1
+        self.obs.fail(503, count=3, headers={'Retry-After': '0'})
+        self.assertRaises(ObsError, self.api.get_last_results,
+                          'home:test:gbs', 'ail')
+        eq_(2, len(self.obs.requests))
+
+    def test_meta_cache(self):
+        '''meta is got once until gbs changes it'''
+        self.obs.add_project('home:test:gbs')
+        eq_(False, self.api.exists('home:test:gbs', 'ail'))
+        eq_(False, self.api.exists('home:test:gbs', 'ail'))
+        eq_(1, len(self.obs.requests))
+        self.api.create_package('home:test:gbs', 'ail')
+        eq_(True, self.api.exists('home:test:gbs', 'ail'))
+        eq_(True, self.api.exists('home:test:gbs', 'ail'))
+        eq_(3, len(self.obs.requests))
+        eq_(2, self.api.meta_cache.hits)
+
+    def test_submit(self):
+        '''only changed files are uploaded to existing package'''
+        self.obs.add_project('home:test:gbs')
+        exportdir = os.path.join(self.tmpdir, 'export')
+        os.mkdir(exportdir)
+        for name in ('ail.spec', 'ail-0.1.tar.gz', 'fix.patch'):
+            with open(os.path.join(exportdir, name), 'w') as fobj:
+                fobj.write(name * 1000)
+            # old enough for their digests to be cached
+            os.utime(os.path.join(exportdir, name), (1000000000, 1000000000))
+        build_repos = prepare_project(self.api, 'home:test:gbs', None)
+        eq_({'standard': ['i586']}, build_repos)
+        eq_('committed', submit_package(self.api, 'home:test:gbs', 'ail',
+                                        exportdir, 'new', build_repos,
+                                        None))
+        package = self.obs.package('home:test:gbs', 'ail')
+        eq_(['ail-0.1.tar.gz', 'ail.spec', 'fix.patch'],
+            sorted(package['files']))
+
+        with open(os.path.join(exportdir, 'fix.patch'), 'a') as fobj:
+            fobj.write('changed')
+        del self.obs.requests[:]
+        eq_('committed', submit_package(self.api, 'home:test:gbs', 'ail',
+                                        exportdir, 'fix', build_repos,
+                                        None))
+        eq_([('PUT', 'source/home:test:gbs/ail/fix.patch')],
+            [request[:2] for request in self.obs.requests
+             if request[0] == 'PUT'])
+        eq_(2, package['rev'])
+        eq_('rebuilt', submit_package(self.api, 'home:test:gbs', 'ail',
+                                      exportdir, 'again', build_repos, None))
+        # digests are saved to the cache dir given to the API
+        assert os.path.isfile(os.path.join(self.tmpdir, 'cache',
+                                           'digests.json'))
+
+
+class MetaCacheTest(unittest.TestCase):
+    '''Test saving OBS metadata cache between runs'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-meta-cache-')
+        self.cachefile = os.path.join(self.tmpdir, 'cache', 'obs-meta.json')
+        self.key = ('https://api.example.com', 'home:test:gbs', 'ail', 'meta')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_saved(self):
+        '''entries are used by next run'''
+        cache = MetaCache(60, self.cachefile)
+        cache.set(self.key, '<package/>')
+        cache.set(self.key[:2] + ('bash', 'meta'), None)
+        cache.save()
+        cache = MetaCache(60, self.cachefile)
+        eq_((True, '<package/>'), cache.get(self.key))
+        eq_((True, None), cache.get(self.key[:2] + ('bash', 'meta')))
+
+    def test_non_ascii(self):
+        '''non-ASCII meta is read back as UTF-8 str'''
+        meta = u'<package><title>\u00e5\u00e4\u00f6</title></package>' \
+               .encode('utf-8')
+        cache = MetaCache(60, self.cachefile)
+        cache.set(self.key, meta)
+        cache.save()
+        found, data = MetaCache(60, self.cachefile).get(self.key)
+        eq_((True, meta), (found, data))
+        assert isinstance(data, str)
+        eq_(u'\u00e5\u00e4\u00f6', ET.fromstring(data).findtext('title'))
+        key = MetaCache(60, self.cachefile).entries.keys()[0]
+        assert all(isinstance(part, str) for part in key)
+
+    def test_not_utf8(self):
+        '''meta which is not UTF-8 fails to be saved quietly'''
+        cache = MetaCache(60, self.cachefile)
+        cache.set(self.key, '<package><title>\xff</title></package>')
+        cache.save()
+        assert not os.path.exists(self.cachefile)
+        eq_([], os.listdir(os.path.dirname(self.cachefile)))
+
+    def test_expired(self):
+        '''entries older than ttl are not used'''
+        cache = MetaCache(60, self.cachefile)
+        cache.set(self.key, '<package/>')
+        cache.entries[self.key]['time'] -= 61
+        cache.changed = True
+        cache.save()
+        eq_((False, None), MetaCache(60, self.cachefile).get(self.key))
+
+    def test_disabled(self):
+        '''nothing is saved without ttl'''
+        cache = MetaCache(0, self.cachefile)
+        cache.set(self.key, '<package/>')
+        cache.save()
+        assert not os.path.exists(self.cachefile)
+
+    def test_invalidate(self):
+        '''entries of package or whole project are removed'''
+        cache = MetaCache()
+        apiurl, prj = self.key[:2]
+        for pkg, kind in (('', 'meta'), ('', 'prjconf'), ('ail', 'meta'),
+                          ('ail', 'filelist'), ('bash', 'meta')):
+            cache.set((apiurl, prj, pkg, kind), 'data')
+        cache.invalidate(apiurl, prj, 'ail', 'filelist')
+        eq_(4, len(cache.entries))
+        cache.invalidate(apiurl, prj, 'ail')
+        eq_(3, len(cache.entries))
+        cache.invalidate(apiurl, prj)
+        eq_({}, cache.entries)
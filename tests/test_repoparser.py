@@ -0,0 +1,164 @@
+#!/usr/bin/python -tt
+# vim: ai ts=4 sts=4 et sw=4
+#
+# Copyright (c) 2012 Intel, Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc., 59
+# Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Functional tests for RepoParser against a local http server"""
+
+import os
+import gzip
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import SimpleHTTPServer
+import SocketServer
+
+from gitbuildsys.safe_url import SafeURL
+from gitbuildsys.utils import RepoParser, RepoMetaCache
+
+REPOMD = '''<?xml version="1.0"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">%s</repomd>'''
+REPOMD_DATA = '''<data type="%s"><checksum type="sha256">%s</checksum>
+<location href="repodata/%s"/></data>'''
+PRIMARY = '''<?xml version="1.0"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" packages="1">
+<package type="rpm"><name>%s</name><arch>armv7l</arch>
+<version epoch="0" ver="1" rel="1" vcs="platform/%s#1234"/></package>
+</metadata>'''
+BUILD_XML = '''<build><id>tizen_20130101.1</id>
+<buildconf>snap-build.conf</buildconf>
+<repos><repo>base</repo><repo>main</repo></repos>
+<archs><arch>ia32</arch><arch>armv7l</arch></archs></build>'''
+
+
+class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    '''serve files under Handler.root and record requested paths'''
+
+    root = None
+    requests = []
+
+    def translate_path(self, path):
+        Handler.requests.append(path)
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def log_message(self, *_args):
+        pass
+
+
+def write_file(path, content, compress=False):
+    '''write content to path, return its sha256'''
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fobj = gzip.open(path, 'wb') if compress else open(path, 'w')
+    fobj.write(content)
+    fobj.close()
+    with open(path) as fobj:
+        return hashlib.sha256(fobj.read()).hexdigest()
+
+
+def make_standard_repo(path, name, with_buildconf=True):
+    '''create a rpm repo with repomd.xml, primary and build conf'''
+    data = ''
+    if with_buildconf:
+        checksum = write_file(os.path.join(path, 'repodata', 'build.conf.gz'),
+                              '# build conf of %s\n' % name, True)
+        data += REPOMD_DATA % ('build', checksum, 'build.conf.gz')
+    checksum = write_file(os.path.join(path, 'repodata', 'primary.xml.gz'),
+                          PRIMARY % (name, name), True)
+    data += REPOMD_DATA % ('primary', checksum, 'primary.xml.gz')
+    write_file(os.path.join(path, 'repodata', 'repomd.xml'), REPOMD % data)
+
+
+class RepoParserTest(unittest.TestCase):
+    '''Test RepoParser with standard and snapshot repos'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test-gbs-repoparser-')
+        self.root = os.path.join(self.tmpdir, 'www')
+        Handler.root = self.root
+        Handler.requests = []
+        SocketServer.TCPServer.allow_reuse_address = True
+        self.server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0),
+                                                      Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+        make_standard_repo(os.path.join(self.root, 'one'), 'one')
+        make_standard_repo(os.path.join(self.root, 'two'), 'two', False)
+        make_standard_repo(os.path.join(self.root, 'three'), 'three')
+        snapshot = os.path.join(self.root, 'snapshot')
+        write_file(os.path.join(snapshot, 'builddata', 'build.xml'),
+                   BUILD_XML)
+        write_file(os.path.join(snapshot, 'builddata', 'snap-build.conf'),
+                   '# snapshot build conf\n')
+        for repo in ('base', 'main'):
+            for arch in ('ia32', 'armv7l'):
+                make_standard_repo(os.path.join(snapshot, 'repos', repo, arch,
+                                                'packages'), repo)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def _parse(self, names, metacache=None):
+        '''run RepoParser on given repo names'''
+        repos = [SafeURL('%s/%s/' % (self.url, name)) for name in names]
+        return RepoParser(repos, tempfile.mkdtemp(dir=self.tmpdir), metacache)
+
+    def test_selection_order(self):
+        '''build conf and primary of the last standard repo are used'''
+        parser = self._parse(['one', 'two', 'snapshot', 'three'])
+
+        self.assertEqual(['%s/%s/' % (self.url, name)
+                          for name in ('one', 'two', 'three')],
+                         parser.standardrepos)
+        self.assertEqual(['%s/snapshot/repos/%s/armv7l/packages' %
+                          (self.url, repo) for repo in ('base', 'main')],
+                         parser.repourls['armv7l'])
+        with open(parser.buildconf) as fobj:
+            self.assertEqual('# build conf of three\n', fobj.read())
+        with gzip.open(parser.primary) as fobj:
+            self.assertTrue('<name>three</name>' in fobj.read())
+
+    def test_no_duplicated_fetch(self):
+        '''every url is requested only once'''
+        self._parse(['one', 'two', 'snapshot', 'three'])
+        self.assertEqual(sorted(set(Handler.requests)),
+                         sorted(Handler.requests))
+
+    def test_buildconf_from_snapshot(self):
+        '''build conf is got from build.xml if not in repomd.xml'''
+        parser = self._parse(['two', 'snapshot'])
+        with open(parser.buildconf) as fobj:
+            self.assertEqual('# snapshot build conf\n', fobj.read())
+
+    def test_metacache(self):
+        '''unchanged primary and build conf are got from cache'''
+        cache = RepoMetaCache(os.path.join(self.tmpdir, 'cache'))
+        self._parse(['one'], cache)
+        Handler.requests = []
+        parser = self._parse(['one'], cache)
+
+        self.assertEqual(['/one/repodata/repomd.xml'], Handler.requests)
+        with open(parser.buildconf) as fobj:
+            self.assertEqual('# build conf of one\n', fobj.read())
+        with gzip.open(parser.primary) as fobj:
+            self.assertTrue('<name>one</name>' in fobj.read())